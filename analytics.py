@@ -0,0 +1,233 @@
+import os
+import csv
+import sys
+import argparse
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from catalogue import Catalogue
+from catalogues import CatalogueManager
+from graph import ModuleGraph
+from closure import ClosureIndex
+from typing import *
+
+
+YEAR = "2022-2023"
+
+
+class CatalogueAnalytics:
+    """
+    Bottleneck statistics of every module of a catalogue, computed from a single build of the module graph
+
+    For every module, the table holds its direct prerequisites (fan_in) and direct dependents (fan_out), the number of
+    modules it transitively depends on (ancestors) and unlocks (descendants), the length of its longest chain of
+    prerequisites (depth) and of dependents (height), and its betweenness centrality, i.e. the number of shortest
+    prerequisite paths between two other modules that go through it.
+
+    Counts and chains are read off the closure index and a topological sweep of the graph. Betweenness takes one
+    breadth-first search per module (Brandes' algorithm), so the searches are split across a pool of worker processes
+    that all read the graph in compressed sparse row form from a single block of shared memory, and their partial sums
+    are added up.
+    """
+
+    COLUMNS: Tuple[str, ...] = ("code", "title", "fan_in", "fan_out", "ancestors", "descendants", "depth", "height",
+                                "betweenness")
+    # below this many searches, starting worker processes costs more than running the searches in this process
+    PARALLEL_SOURCES: int = 2000
+
+    def __init__(self, catalogue: Catalogue, graph: Optional[ModuleGraph] = None):
+        self.catalogue = catalogue
+        self.graph = graph if graph else ModuleGraph.from_catalogue(catalogue)
+        self.closure = ClosureIndex.of(catalogue)
+
+    # ----- Statistics ----- #
+    def chains(self) -> Tuple[List[int], List[int]]:
+        """Returns the length of the longest chain of prerequisites, and of dependents, of every node of the graph"""
+
+        size = self.graph.size
+        depth = self._longest(size, *self.graph.csr())
+        height = self._longest(size, *self.graph.csr(reverse=True))
+        return depth, height
+
+    @staticmethod
+    def _longest(size: int, offsets: Sequence[int], targets: Sequence[int]) -> List[int]:
+        # longest[d] is the number of edges on the longest path ending at d, following the edges given in CSR form
+        longest = [0] * size
+        indegree = [0] * size
+        for target in targets:
+            indegree[target] += 1
+
+        order = [i for i in range(size) if indegree[i] == 0]
+        for origin in order:
+            for target in targets[offsets[origin]:offsets[origin + 1]]:
+                longest[target] = max(longest[target], longest[origin] + 1)
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    order.append(target)
+
+        # nodes on a cycle are never released, and only count the chains leading into the cycle
+        return longest
+
+    def betweenness(self, workers: Optional[int] = None, chunk_size: int = 64) -> List[float]:
+        """
+        Returns the betweenness centrality of every node of the graph
+
+        Parameters
+        ----------
+        :param workers:         The number of worker processes (default: the number of CPUs, or none for graphs with
+                                fewer than PARALLEL_SOURCES modules that are a prerequisite of another)
+        :param chunk_size:      The number of breadth-first searches sent to a worker at once
+        """
+
+        size = self.graph.size
+        offsets, targets = self.graph.csr()
+        # modules that are not a prerequisite of anything never lie on a path, so they need no search
+        sources = [i for i in range(size) if offsets[i + 1] > offsets[i]]
+        chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+        if not workers:
+            workers = (os.cpu_count() or 1) if len(sources) >= self.PARALLEL_SOURCES else 1
+
+        if workers == 1 or len(chunks) <= 1:
+            return _brandes(sources, size, offsets, targets)
+
+        block = shared_memory.SharedMemory(create=True, size=max(1, (len(offsets) + len(targets)) * offsets.itemsize))
+        try:
+            view = block.buf.cast("i")
+            view[:len(offsets)] = offsets
+            view[len(offsets):len(offsets) + len(targets)] = targets
+            view.release()
+
+            centrality = [0.0] * size
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_attach,
+                                     initargs=(block.name, size, len(targets))) as executor:
+                for partial in executor.map(_centrality_chunk, chunks):
+                    for node, value in enumerate(partial):
+                        centrality[node] += value
+        finally:
+            block.close()
+            block.unlink()
+
+        return centrality
+
+    def table(self, workers: Optional[int] = None) -> List[dict]:
+        """Returns one row of statistics per module of the catalogue, keyed by the names in COLUMNS"""
+
+        depth, height = self.chains()
+        centrality = self.betweenness(workers)
+        offsets, targets = self.graph.csr()
+        in_offsets, _ = self.graph.csr(reverse=True)
+
+        rows = []
+        for code in self.catalogue.codes():
+            node = self.graph.id_of(code)
+            rows.append({
+                "code": code,
+                "title": self.catalogue[code].get("title", ""),
+                "fan_in": in_offsets[node + 1] - in_offsets[node],
+                "fan_out": offsets[node + 1] - offsets[node],
+                "ancestors": self.closure.count_ancestors(code),
+                "descendants": self.closure.count_descendants(code),
+                "depth": depth[node],
+                "height": height[node],
+                "betweenness": round(centrality[node], 3)
+            })
+
+        return rows
+
+    @classmethod
+    def write(cls, rows: List[dict], path: str, delimiter: str = ","):
+        """Writes the rows of a table to a CSV file, or a TSV file with a tab delimiter"""
+
+        with open(path + ".tmp", "w", newline="") as f:
+            writer = csv.DictWriter(f, cls.COLUMNS, delimiter=delimiter)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(path + ".tmp", path)
+
+
+# ----- Workers ----- #
+_BLOCK: Optional[shared_memory.SharedMemory] = None
+_GRAPH: Optional[Tuple[int, Sequence[int], Sequence[int]]] = None
+
+def _attach(name: str, size: int, edges: int) -> None:
+    # every worker maps the CSR arrays of the graph from shared memory instead of receiving a copy
+    global _BLOCK, _GRAPH
+    # workers share the resource tracker of the parent, which owns the block and unlinks it once every worker is done
+    _BLOCK = shared_memory.SharedMemory(name=name)
+    view = _BLOCK.buf.cast("i")
+    _GRAPH = size, view[:size + 1], view[size + 1:size + 1 + edges]
+
+def _centrality_chunk(sources: List[int]) -> List[float]:
+    size, offsets, targets = _GRAPH
+    return _brandes(sources, size, offsets, targets)
+
+def _brandes(sources: Iterable[int], size: int, offsets: Sequence[int], targets: Sequence[int]) -> List[float]:
+    # the dependencies accumulated by the breadth-first searches from each source, as in Brandes' algorithm
+    centrality = [0.0] * size
+    for source in sources:
+        order = []
+        predecessors: Dict[int, List[int]] = {source: []}
+        paths = {source: 1}
+        distance = {source: 0}
+        queue = deque([source])
+        while queue:
+            v = queue.popleft()
+            order.append(v)
+            for w in targets[offsets[v]:offsets[v + 1]]:
+                if w not in distance:
+                    distance[w] = distance[v] + 1
+                    paths[w] = 0
+                    predecessors[w] = []
+                    queue.append(w)
+                if distance[w] == distance[v] + 1:
+                    paths[w] += paths[v]
+                    predecessors[w].append(v)
+
+        dependency = dict.fromkeys(order, 0.0)
+        for w in reversed(order):
+            for v in predecessors[w]:
+                dependency[v] += paths[v] / paths[w] * (1 + dependency[w])
+            if w != source:
+                centrality[w] += dependency[w]
+
+    return centrality
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compute the fan-out, descendants, prerequisite chain depth and "
+                                                 "centrality of every module of a year, and write them to a table")
+    parser.add_argument("--year", default=YEAR, help=f"academic year to analyse (default: {YEAR})")
+    parser.add_argument("--directory", default=None, help="directory holding the catalogue snapshot")
+    parser.add_argument("--output", default=None,
+                        help="table file to write (default: analytics-<year>.csv next to the snapshot)")
+    parser.add_argument("--format", choices=["csv", "tsv"], default="csv", help="format of the table file")
+    parser.add_argument("--sort", choices=CatalogueAnalytics.COLUMNS, default="descendants",
+                        help="column to sort the table by, largest first (default: descendants)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--top", type=int, default=10, help="number of modules to print (default: 10)")
+    args = parser.parse_args(argv)
+
+    catalogue = CatalogueManager(args.directory).get(args.year)
+    if catalogue is None:
+        print(f"The catalogue of {args.year} has not been ingested. Run python ingest.py {args.year} first.",
+              file=sys.stderr)
+        return 1
+
+    rows = CatalogueAnalytics(catalogue).table(args.workers)
+    rows.sort(key=lambda row: (row[args.sort], row["code"]) if args.sort in ("code", "title") else
+              (-row[args.sort], row["code"]))
+
+    output = args.output if args.output else \
+        os.path.join(args.directory if args.directory else Catalogue.DIRECTORY, f"analytics-{args.year}.{args.format}")
+    CatalogueAnalytics.write(rows, output, "\t" if args.format == "tsv" else ",")
+
+    for row in rows[:args.top]:
+        print("  ".join(f"{column}={row[column]}" for column in CatalogueAnalytics.COLUMNS if column != "title"))
+    print(f"Wrote {len(rows)} modules to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import io
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import MODULE_CODE_REGEX
+from catalogue import Catalogue
+from catalogues import CatalogueManager
+from prereq import PrereqEngine
+from scheduler import Scheduler, InfeasibleScheduleError
+from clash import ClashDetector
+from typing import *
+
+
+YEAR = "2022-2023"
+
+
+class PlanChecker:
+    """
+    Resolves, validates and schedules plans against the catalogue snapshot of a year
+
+    A plan is a dictionary holding an id, the module codes to take, and optionally the module codes completed before
+    the first semester. Checking a plan never raises: problems with the plan are reported in its result, and errors
+    are reported under "error".
+    """
+
+    def __init__(self, catalogue: Catalogue, semesters: Optional[int] = None, mc_cap: Optional[float] = None):
+        self.catalogue = catalogue
+        self.engine = PrereqEngine.of(catalogue)
+        self.scheduler = Scheduler(catalogue, semesters, mc_cap)
+        self.detector = ClashDetector.of(catalogue)
+
+    def check(self, plan: dict) -> dict:
+        """
+        Returns the result of checking a plan
+
+        The result holds the id and the modules of the plan, the modules that are not in the catalogue, the groups of
+        prerequisites missing from the plan for each module, and either the schedule of the plan, the lesson and exam
+        clashes in its semesters and the modules whose lessons could not be checked for clashes, or the reason each
+        module could not be scheduled
+        """
+
+        modules = list(dict.fromkeys(plan["modules"]))
+        completed = list(dict.fromkeys(plan.get("completed", ())))
+        result = {"id": plan.get("id"), "modules": modules, "valid": False}
+
+        try:
+            everything = set(modules) | set(completed)
+            unknown = [code for code in modules if code not in self.catalogue]
+            missing = {code: [sorted(group) for group in self.engine.missing(code, everything)] for code in modules}
+            result["unknown"] = unknown
+            result["missing"] = {code: groups for code, groups in missing.items() if groups}
+
+            try:
+                schedule = self.scheduler.solve(modules, completed)
+            except InfeasibleScheduleError as e:
+                result["reasons"] = e.reasons
+            else:
+                result["schedule"] = schedule.semesters
+                result["mcs"] = [schedule.mcs(s) for s in range(len(schedule))]
+                result["clashes"] = [clash.to_dict() for clashes in
+                                     self.detector.clashes_schedule(schedule.semesters).values() for clash in clashes]
+                result["unchecked"] = sorted({code for s, modules in enumerate(schedule.semesters)
+                                              for code in self.detector.missing_lessons(modules, s % 2 + 1)})
+                result["valid"] = not unknown
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        return result
+
+    def check_all(self, plans: Iterable[dict]) -> List[dict]:
+        """Returns the results of checking many plans, in order"""
+
+        return [self.check(plan) for plan in plans]
+
+
+# ----- Reading Plans ----- #
+def parse_plan(value: Any, index: int) -> dict:
+    """
+    Returns a plan from a JSON value, which is either a list of module codes, or an object with "modules" and
+    optionally "id" and "completed"
+    :return: dict
+    """
+    if isinstance(value, list):
+        value = {"modules": value}
+    if not isinstance(value, dict) or not isinstance(value.get("modules"), list):
+        raise ValueError(f"Plan {index + 1} must be a list of module codes or an object with a list of modules")
+    return {
+        "id": str(value.get("id", index + 1)),
+        "modules": [str(code).strip().upper() for code in value["modules"]],
+        "completed": [str(code).strip().upper() for code in value.get("completed", [])]
+    }
+
+def read_plans(stream: TextIO, kind: Optional[str] = None) -> List[dict]:
+    """
+    Reads plans from a JSON array (or an object with a "plans" array, or a single plan object), JSON lines, or CSV
+
+    CSV files need a header with a "modules" column, and optionally "id" and "completed" columns, and list the module
+    codes of a cell separated by spaces, commas or semicolons. The format is guessed from the content if not given.
+    :return: List[dict]
+    """
+    text = stream.read()
+    if kind is None:
+        stripped = text.strip()
+        kind = "json" if stripped.startswith(("[", "{")) else "csv"
+        if stripped.startswith("{"):
+            # several plans on their own lines are not a single JSON value, whereas a single one is read as one plan
+            try:
+                json.loads(stripped)
+            except ValueError:
+                kind = "jsonl"
+
+    if kind == "json":
+        data = json.loads(text)
+        if isinstance(data, dict):
+            values = data["plans"] if "plans" in data else [data]
+        else:
+            values = data
+        if not isinstance(values, list):
+            raise ValueError("A JSON plan file must hold an array of plans, or an object with a \"plans\" array")
+    elif kind == "jsonl":
+        values = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif kind == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+        if rows and "modules" not in rows[0]:
+            raise ValueError("A CSV plan file must have a header with a \"modules\" column")
+        values = []
+        for row in rows:
+            value = {"modules": re.findall(MODULE_CODE_REGEX, (row.get("modules") or "").upper()),
+                     "completed": re.findall(MODULE_CODE_REGEX, (row.get("completed") or "").upper())}
+            if row.get("id"):
+                value["id"] = row["id"]
+            values.append(value)
+    else:
+        raise ValueError(f"Unknown plan format {kind}")
+
+    return [parse_plan(value, i) for i, value in enumerate(values)]
+
+
+# ----- Running ----- #
+_CHECKER: Optional[PlanChecker] = None
+
+def _initialise(year: str, directory: Optional[str], semesters: Optional[int], mc_cap: Optional[float]) -> None:
+    # every worker process loads the memory-mapped snapshot once, and shares its pages with the other workers
+    global _CHECKER
+    catalogue = CatalogueManager(directory).get(year)
+    if catalogue is None:
+        raise ValueError(f"The catalogue of {year} has not been ingested")
+    _CHECKER = PlanChecker(catalogue, semesters, mc_cap)
+
+def _check_chunk(plans: List[dict]) -> List[dict]:
+    return _CHECKER.check_all(plans)
+
+def run(plans: Sequence[dict], year: str = YEAR, directory: Optional[str] = None, workers: Optional[int] = None,
+        chunk_size: int = 16, semesters: Optional[int] = None, mc_cap: Optional[float] = None) -> Iterator[dict]:
+    """
+    Checks many plans across a pool of worker processes, and yields the results in the order of the plans as soon as
+    they are ready
+    :return: Iterator[dict]
+    """
+    workers = workers if workers else os.cpu_count() or 1
+    chunks = [list(plans[i:i + chunk_size]) for i in range(0, len(plans), chunk_size)]
+
+    if workers == 1 or len(chunks) <= 1:
+        _initialise(year, directory, semesters, mc_cap)
+        for chunk in chunks:
+            yield from _check_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_initialise,
+                             initargs=(year, directory, semesters, mc_cap)) as executor:
+        for results in executor.map(_check_chunk, chunks):
+            yield from results
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check many plans against the catalogue snapshot of a year, and "
+                                                 "write one JSON result per plan")
+    parser.add_argument("plans", nargs="?", default="-", help="JSON, JSON lines or CSV plan file (default: stdin)")
+    parser.add_argument("--format", choices=["json", "jsonl", "csv"], default=None,
+                        help="format of the plan file (default: guessed from its content)")
+    parser.add_argument("--year", default=YEAR, help=f"academic year of the plans (default: {YEAR})")
+    parser.add_argument("--directory", default=None, help="directory holding the catalogue snapshot")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="number of plans sent to a worker at once")
+    parser.add_argument("--semesters", type=int, default=None, help="number of semesters to schedule over")
+    parser.add_argument("--mc-cap", type=float, default=None, help="maximum number of MCs in a semester")
+    parser.add_argument("--output", default=None, help="file to write the JSON lines results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if Catalogue.load(args.year, args.directory) is None:
+        print(f"The catalogue of {args.year} has not been ingested. Run python ingest.py {args.year} first.",
+              file=sys.stderr)
+        return 1
+
+    try:
+        if args.plans == "-":
+            plans = read_plans(sys.stdin, args.format)
+        else:
+            with open(args.plans, newline="") as f:
+                plans = read_plans(f, args.format)
+    except (OSError, ValueError) as e:
+        print(f"Could not read the plans: {e}", file=sys.stderr)
+        return 1
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    invalid = 0
+    try:
+        for result in run(plans, args.year, args.directory, args.workers, args.chunk_size, args.semesters,
+                          args.mc_cap):
+            invalid += not result["valid"]
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"Checked {len(plans)} plans: {len(plans) - invalid} valid, {invalid} not valid", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+
+from typing import *
+
+
+YEAR = "2022-2023"
+
+
+class Benchmark:
+    """
+    Reproducible timing and request-count benchmarks for the resolvers, graph building and plan validation
+
+    Every benchmark runs against the recorded fixture corpus in database/, served by a local MockServer with a
+    configurable latency, and with a fresh module store and catalogue snapshot in a temporary directory, so results do
+    not depend on the live API or on any cache left behind by earlier runs. Network-bound benchmarks are run cold
+    (empty store) and warm (store already filled by the cold run), and report the number of requests the server saw.
+    """
+
+    def __init__(self, latency: float = 0.005, repeat: int = 5, seed: int = 2022):
+        self.latency = latency
+        self.repeat = repeat
+        self.seed = seed
+        self.results: List[dict] = []
+
+    def run(self, names: Optional[Collection[str]] = None) -> List[dict]:
+        """Runs every benchmark, or the named ones only, and returns the results"""
+
+        # imported here so that importing this module stays cheap
+        import lib
+        import store
+        from catalogue import Catalogue
+        from mock_server import MockServer
+
+        with tempfile.TemporaryDirectory() as directory, MockServer(latency=self.latency) as server:
+            store.ModuleStore.DATABASE = directory + "/modules.sqlite3"
+            Catalogue.DIRECTORY = directory + "/empty"
+            lib.API_ENDPOINT = server.endpoint
+
+            for name, benchmark in self.benchmarks().items():
+                if names and name not in names:
+                    continue
+                benchmark(server, directory)
+
+        return self.results
+
+    def benchmarks(self) -> Dict[str, Callable]:
+        """Returns the benchmarks keyed by name"""
+
+        return {
+            "parser.prerequisite": self.bench_parser_prerequisite,
+            "lib.obtain_preclusions": self.bench_obtain_preclusions,
+            "lib.evaluate_modules": self.bench_evaluate_modules,
+            "catalogue.load": self.bench_load,
+            "graph.from_catalogue": self.bench_graph,
+            "closure.build": self.bench_closure,
+            "validator.validate": self.bench_validate,
+            "scheduler.solve": self.bench_schedule,
+            "startup": self.bench_startup
+        }
+
+    # ----- Recording ----- #
+    def record(self, name: str, timings: List[float], requests: Optional[int] = None, **extra):
+        """Records the timings of a benchmark"""
+
+        result = {
+            "name": name,
+            "runs": len(timings),
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.fmean(timings),
+            "max": max(timings)
+        }
+        if requests is not None:
+            result["requests"] = requests
+        result.update(extra)
+
+        self.results.append(result)
+
+    def time(self, function: Callable, repeat: Optional[int] = None) -> List[float]:
+        """Returns the wall-clock time of every run of a function"""
+
+        timings = []
+        for _ in range(repeat if repeat else self.repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+        return timings
+
+    def _network(self, name: str, server, session: Callable[[], Callable], function: Callable):
+        # every session starts with an empty memory layer, and the warm session reuses the store of the cold one, which
+        # is closed first. session opens a session and returns the function that closes it
+        close = session()
+        before = len(server.REQUESTS)
+        cold = self.time(function, 1)
+        self.record(name + "[cold]", cold, len(server.REQUESTS) - before)
+        close()
+
+        close = session()
+        try:
+            before = len(server.REQUESTS)
+            warm = self.time(function)
+            self.record(name + "[warm]", warm, len(server.REQUESTS) - before)
+        finally:
+            close()
+
+    def _catalogue(self, directory: str):
+        import ingest
+        from catalogue import Catalogue
+
+        ingest.ingest(YEAR, directory=directory + "/catalogue", from_fixtures=True)
+        return Catalogue.load(YEAR, directory + "/catalogue")
+
+    def _plans(self, catalogue, count: int, size: int = 40) -> List[List[str]]:
+        rng = random.Random(self.seed)
+        codes = catalogue.codes()
+        return [rng.sample(codes, min(size, len(codes))) for _ in range(count)]
+
+    # ----- Benchmarks ----- #
+    def bench_parser_prerequisite(self, server, directory: str):
+        from utils import ConnectionAlertLevel
+        from store import ModuleStore
+        from lib_reworked import Parser
+
+        modules = ["CS3230", "CS2103T", "CS2040S", "CS3244", "CS4248"]
+        path = directory + "/parser.sqlite3"
+        parser = None
+
+        def session():
+            nonlocal parser
+            parser = Parser(endpoint=server.endpoint, store=ModuleStore(path=path),
+                            alert_level=ConnectionAlertLevel.SUPPRESS)
+
+            def close():
+                parser.close()
+                parser.store.close()
+
+            return close
+
+        self._network("parser.prerequisite", server, session, lambda: [parser.prerequisite(m) for m in modules])
+
+    def _lib_session(self, directory: str) -> Callable:
+        # opens a store for the functions of lib, and returns the function that closes it along with their fetcher
+        import lib
+        from store import ModuleStore
+
+        lib.STORE = ModuleStore(path=directory + "/lib.sqlite3")
+        lib.FETCHER = None
+
+        def close():
+            if lib.FETCHER is not None:
+                lib.FETCHER.close()
+            lib.STORE.close()
+            lib.STORE, lib.FETCHER = None, None
+
+        return close
+
+    def bench_obtain_preclusions(self, server, directory: str):
+        import lib
+
+        modules = ["CS1010", "CS2040S", "CS2103T", "GEA1000", "MA1521"]
+        self._network("lib.obtain_preclusions", server, lambda: self._lib_session(directory),
+                      lambda: [lib.obtain_preclusions(m) for m in modules])
+
+    def bench_evaluate_modules(self, server, directory: str):
+        import lib
+
+        close = self._lib_session(directory)
+        try:
+            # every field is resolved up front, as lazy modules would otherwise be fetched and resolved by the first run
+            modules = lib.generate_modules({"CS3230", "CS2040S", "CS1101S", "CS1231S", "CS2030S", "CS2103T", "CS2101"},
+                                           fields=None)
+            self.record("lib.evaluate_modules", self.time(lambda: lib.evaluate_modules(modules)))
+        finally:
+            close()
+
+    def bench_load(self, server, directory: str):
+        from catalogue import Catalogue
+
+        self._catalogue(directory)
+        load = Catalogue.load
+        self.record("catalogue.load[json]", self.time(lambda: load(YEAR, directory + "/catalogue", mapped=False)))
+        self.record("catalogue.load[mapped]", self.time(lambda: load(YEAR, directory + "/catalogue")))
+
+    def bench_graph(self, server, directory: str):
+        from graph import ModuleGraph
+
+        catalogue = self._catalogue(directory)
+        self.record("graph.from_catalogue", self.time(lambda: ModuleGraph.from_catalogue(catalogue)),
+                    modules=len(catalogue))
+
+    def bench_closure(self, server, directory: str):
+        from graph import ModuleGraph
+        from closure import ClosureIndex
+
+        graph = ModuleGraph.from_catalogue(self._catalogue(directory))
+        self.record("closure.build", self.time(lambda: ClosureIndex.build(graph)), modules=len(graph))
+
+    def bench_validate(self, server, directory: str):
+        from validator import PlanValidator
+
+        catalogue = self._catalogue(directory)
+        validator = PlanValidator(catalogue)
+        plans = self._plans(catalogue, 1000)
+        self.record("validator.validate", self.time(lambda: validator.validate(plans)), plans=len(plans))
+
+    def bench_schedule(self, server, directory: str):
+        from defaults import COMPUTER_SCIENCE_CORE_MODS, COMPUTER_SCIENCE_MATH_MODS
+        from scheduler import Scheduler
+
+        scheduler = Scheduler(self._catalogue(directory))
+        plan = COMPUTER_SCIENCE_CORE_MODS + COMPUTER_SCIENCE_MATH_MODS
+        completed = ["MA1301", "ES1000", "ES1103", "AY2016"]
+        self.record("scheduler.solve", self.time(lambda: scheduler.solve(plan, completed)), modules=len(plan))
+
+    def bench_startup(self, server, directory: str):
+        import subprocess
+
+        # every run is a fresh interpreter, which prints the seconds it took to import pathfinder, or to reach the first
+        # prompt of the CLI (the prompt is replaced with one that exits straight away)
+        probes = {
+            "startup.import": "import time\n"
+                              "start = time.perf_counter()\n"
+                              "import pathfinder\n"
+                              "print(time.perf_counter() - start)\n",
+            "startup.first_prompt": "import os, time\n"
+                                    "start = time.perf_counter()\n"
+                                    "from InquirerPy import inquirer\n"
+                                    "class Prompt:\n"
+                                    "    def __init__(self, *args, **kwargs): pass\n"
+                                    "    def execute(self, *args, **kwargs):\n"
+                                    "        print(time.perf_counter() - start, flush=True)\n"
+                                    "        os._exit(0)\n"
+                                    "inquirer.select = Prompt\n"
+                                    "import pathfinder\n"
+                                    "pathfinder.CLIApp()\n"
+        }
+        root = os.path.dirname(os.path.abspath(__file__))
+        cache = directory + "/banner"
+        env = dict(os.environ, PATHFINDER_CACHE=cache, PYTHONDONTWRITEBYTECODE="1")
+
+        def run(probe: str) -> float:
+            output = subprocess.run([sys.executable, "-c", probe], cwd=root, env=env, capture_output=True, text=True,
+                                    check=True).stdout
+            return float(output.strip().splitlines()[-1])
+
+        self.record("startup.import", [run(probes["startup.import"]) for _ in range(self.repeat)])
+        # the first launch renders the banner and caches it, which every later launch reuses
+        self.record("startup.first_prompt[cold]", [run(probes["startup.first_prompt"])])
+        self.record("startup.first_prompt[warm]", [run(probes["startup.first_prompt"]) for _ in range(self.repeat)])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the pathfinder benchmarks against a local mock NUSMods server")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.005, help="latency injected into every response, in s")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs of every benchmark")
+    parser.add_argument("--seed", type=int, default=2022, help="seed of the generated plans")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    benchmark = Benchmark(args.latency, args.repeat, args.seed)
+    unknown = set(args.names) - set(benchmark.benchmarks())
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = {
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": benchmark.run(args.names)
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+import weakref
+
+from snapshot import Document, Snapshot, MappedModules
+from typing import *
+
+
+class Catalogue:
+    """
+    In-memory snapshot of the modules offered in a whole academic year
+
+    A catalogue is written once by the ingest command (see ingest.py) and loaded from a single file at startup, so that
+    module lookups do not need a round-trip to the API. Snapshots are stored in a compact indexed form: the module codes
+    in sorted order, and one record per code holding the values of FIELDS in order.
+
+    The ingest command also writes a binary snapshot of the catalogue (see snapshot.py), which load memory-maps when it
+    is up to date, so that module documents are only decoded when they are looked up.
+
+    A catalogue ingested from the bulk API download is complete, so any module it does not hold does not exist in that
+    year. Catalogues built from partial data (such as the recorded fixtures) are not complete.
+
+    Data derived from a catalogue and cached outside of it is keyed by the fingerprint of the catalogue, a digest of its
+    snapshot file, or of its documents if it has not been saved, so it is never reused for a different snapshot.
+    """
+
+    DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database")
+    FIELDS: Tuple[str, ...] = ("title", "moduleCredit", "department", "faculty", "prerequisite", "preclusion",
+                               "corequisite", "prereqTree", "semesterData", "attributes")
+
+    def __init__(self, year: str, modules: Mapping[str, dict], complete: bool = False,
+                 snapshot: Optional[Snapshot] = None):
+        self.YEAR = year
+        self.complete = complete
+        self.directory: Optional[str] = None
+        self.snapshot = snapshot
+        self._modules = modules
+        self._fingerprint: Optional[str] = None
+
+    def __contains__(self, module_code: str):
+        return module_code in self._modules
+
+    def __getitem__(self, module_code: str) -> dict:
+        return self._modules[module_code]
+
+    def __iter__(self):
+        return iter(self._modules)
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __repr__(self):
+        return f"Catalogue({self.YEAR}, {len(self)} modules)"
+
+    @property
+    def year(self):
+        """Year property"""
+
+        return self.YEAR
+
+    def get(self, module_code: str, default=None) -> dict or None:
+        """Returns the document of a module, or the default if the catalogue does not hold the module"""
+
+        return self._modules.get(module_code, default)
+
+    def codes(self) -> List[str]:
+        """Returns the module codes in the catalogue in sorted order"""
+
+        return list(self._modules) if self.snapshot is not None else sorted(self._modules)
+
+    @property
+    def fingerprint(self) -> str:
+        """A digest of the year and the contents of the catalogue, computed on first use"""
+
+        if self._fingerprint is None:
+            digest = hashlib.sha1(self.YEAR.encode())
+            path = self.path(self.YEAR, self.directory) if self.directory else None
+            if path is not None and os.path.isfile(path):
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+            else:
+                for code in self.codes():
+                    digest.update(json.dumps(self._modules[code], sort_keys=True, separators=(",", ":")).encode())
+            self._fingerprint = digest.hexdigest()[:16]
+
+        return self._fingerprint
+
+    # ----- Normalisation ----- #
+    @classmethod
+    def normalise(cls, document: dict) -> dict:
+        """Strips an API module document down to the fields kept in the catalogue"""
+
+        module = {"moduleCode": document["moduleCode"]}
+        for field in cls.FIELDS:
+            if document.get(field) is not None:
+                module[field] = document[field]
+
+        return module
+
+    @classmethod
+    def from_documents(cls, year: str, documents: Iterable[dict], complete: bool = False) -> "Catalogue":
+        """Builds a catalogue from an iterable of API module documents"""
+
+        modules = {}
+        for document in documents:
+            if document and "moduleCode" in document:
+                module = cls.normalise(document)
+                modules[module["moduleCode"]] = module
+
+        return cls(year, modules, complete)
+
+    @classmethod
+    def key(cls, document: dict) -> Tuple[str or None, ...]:
+        """
+        Returns the module code of a document followed by the compact JSON of every field, with sorted keys, or None if
+        the field is unset
+
+        This is the JSON stored in a binary snapshot (see Snapshot.key), so documents of a JSON catalogue and of a
+        memory-mapped one share a key, and values that only compare equal in Python (e.g. 4 and 4.0) do not.
+        """
+
+        return (document["moduleCode"],) + tuple(
+            None if document.get(field) is None else json.dumps(document[field], sort_keys=True, separators=(",", ":"))
+            for field in cls.FIELDS
+        )
+
+    def share(self, pool: MutableMapping[tuple, Document]):
+        """
+        Interns the module documents of the catalogue in a pool shared with other catalogues
+
+        Documents are interned by their key, so a module that is unchanged between two years is held once, and
+        comparing it between the years is an identity check. Documents of a memory-mapped catalogue are interned as
+        they are decoded, by the JSON stored in the snapshot, unless the snapshot holds other fields than FIELDS.
+
+        The pool may be a weakref.WeakValueDictionary, which only holds the documents while a catalogue still does.
+        """
+
+        if self.snapshot is not None:
+            self._modules.pool = pool if self.snapshot.fields == self.FIELDS else None
+        else:
+            for code, document in self._modules.items():
+                key = self.key(document)
+                shared = pool.get(key)
+                if shared is None:
+                    shared = pool[key] = document if isinstance(document, Document) else Document(document)
+                self._modules[code] = shared
+
+    # ----- Persistence ----- #
+    @classmethod
+    def path(cls, year: str, directory: Optional[str] = None) -> str:
+        """Returns the path of the snapshot file of a year"""
+
+        return os.path.join(directory if directory else cls.DIRECTORY, f"catalogue-{year}.json")
+
+    @classmethod
+    def binary_path(cls, year: str, directory: Optional[str] = None) -> str:
+        """Returns the path of the binary snapshot file of a year"""
+
+        return os.path.join(directory if directory else cls.DIRECTORY, f"catalogue-{year}.bin")
+
+    def save(self, directory: Optional[str] = None) -> str:
+        """Writes the catalogue to its snapshot file and returns the path of the file"""
+
+        codes = self.codes()
+        snapshot = {
+            "year": self.YEAR,
+            "complete": self.complete,
+            "fields": list(self.FIELDS),
+            "codes": codes,
+            "records": [[self._modules[code].get(field) for field in self.FIELDS] for code in codes]
+        }
+
+        path = self.path(self.YEAR, directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        self.directory = os.path.dirname(path)
+        self._fingerprint = None
+
+        return path
+
+    def save_binary(self, codes: Sequence[str], relations: Dict[str, Tuple[Sequence[int], Sequence[int]]],
+                    directory: Optional[str] = None) -> str:
+        """
+        Writes the catalogue to its binary snapshot file and returns the path of the file
+
+        Parameters
+        ----------
+        :param codes:           Every interned module code of the relations, the codes of the catalogue first
+        :param relations:       The relations between the modules, in CSR form over the interned codes
+        :param directory:       The directory to write the snapshot into
+        """
+
+        return Snapshot.write(self.binary_path(self.YEAR, directory), self.YEAR, self.complete, self.FIELDS,
+                              self._modules, codes, relations)
+
+    @classmethod
+    def load(cls, year: str, directory: Optional[str] = None, mapped: bool = True) -> "Catalogue" or None:
+        """
+        Loads the snapshot of a year, returning None if the year has not been ingested
+
+        The binary snapshot is memory-mapped if it is at least as recent as the JSON snapshot, unless mapped is unset
+        """
+
+        path = cls.path(year, directory)
+        if not os.path.isfile(path):
+            return None
+
+        binary = cls.binary_path(year, directory)
+        if mapped and os.path.isfile(binary) and os.path.getmtime(binary) >= os.path.getmtime(path):
+            snapshot = Snapshot(binary)
+            catalogue = cls(snapshot.year, MappedModules(snapshot), snapshot.complete, snapshot)
+            catalogue.directory = os.path.dirname(path)
+
+            return catalogue
+
+        with open(path) as f:
+            snapshot = json.load(f)
+
+        fields = snapshot["fields"]
+        modules = {}
+        for code, record in zip(snapshot["codes"], snapshot["records"]):
+            module = {"moduleCode": code}
+            for field, value in zip(fields, record):
+                if value is not None:
+                    module[field] = value
+            modules[code] = module
+
+        catalogue = cls(snapshot["year"], modules, snapshot.get("complete", False))
+        catalogue.directory = os.path.dirname(path)
+
+        return catalogue
+
+
+class CatalogueAttribute:
+    """
+    Attribute holding the catalogue an object is derived from weakly
+
+    Objects derived from a catalogue (e.g. PrereqEngine) are cached in a WeakKeyDictionary keyed by the catalogue, so
+    an entry holding its catalogue strongly would keep itself, and the catalogue, alive for good. Reading the attribute
+    once the catalogue has been garbage collected raises ReferenceError.
+    """
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = "_" + name
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Catalogue:
+        if instance is None:
+            return self
+
+        catalogue = instance.__dict__[self.name]()
+        if catalogue is None:
+            raise ReferenceError("The catalogue has been garbage collected")
+
+        return catalogue
+
+    def __set__(self, instance: Any, catalogue: Catalogue):
+        instance.__dict__[self.name] = weakref.ref(catalogue)
@@ -0,0 +1,210 @@
+import os
+import sys
+import weakref
+import argparse
+import threading
+
+from catalogue import Catalogue
+from snapshot import Document
+from prereq import PrereqEngine
+from typing import *
+
+
+class CatalogueDiff:
+    """The modules added, removed and changed between the catalogues of two years"""
+
+    def __init__(self, old_year: str, new_year: str, added: List[str], removed: List[str],
+                 changed: Dict[str, List[str]]):
+        self.old_year = old_year
+        self.new_year = new_year
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return f"CatalogueDiff({self.old_year} -> {self.new_year}, {len(self.added)} added, " \
+               f"{len(self.removed)} removed, {len(self.changed)} changed)"
+
+    def __str__(self):
+        lines = [f"{self.old_year} -> {self.new_year}"]
+        lines += [f"+ {code}" for code in self.added]
+        lines += [f"- {code}" for code in self.removed]
+        lines += [f"~ {code}: {', '.join(fields)}" for code, fields in self.changed.items()]
+        return "\n".join(lines)
+
+
+class CatalogueManager:
+    """
+    Catalogue snapshots of several academic years, held side by side
+
+    Every year is loaded once and then looked up in O(1), so Parser and ModuleGraph instances working on different
+    years each hold their own catalogue instead of switching a shared one. Module documents of every year are interned
+    in a single pool, so a module that did not change between two years is held once, and diffing two years skips
+    unchanged modules with an identity check instead of comparing or refetching them. The pool only holds its documents
+    weakly, so the documents of a snapshot that was reloaded or replaced are dropped once no catalogue holds them.
+
+    A year is reloaded when its snapshot file changes on disk, e.g. after it is ingested again. Use the CATALOGUES
+    instance to share the catalogues of a process.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+
+        self._lock = threading.RLock()
+        # keyed by snapshot path, holding the modification time of the snapshot, or None if added in memory
+        self._catalogues: Dict[str, Tuple[float or None, Catalogue]] = {}
+        self._pool: "weakref.WeakValueDictionary[tuple, Document]" = weakref.WeakValueDictionary()
+
+    def __contains__(self, year: str):
+        return self.get(year) is not None
+
+    def __repr__(self):
+        return f"CatalogueManager({', '.join(self.years())})"
+
+    def years(self) -> List[str]:
+        """Returns the years loaded so far, in order"""
+
+        with self._lock:
+            return sorted({catalogue.year for _, catalogue in self._catalogues.values()})
+
+    def get(self, year: str) -> Catalogue or None:
+        """Returns the catalogue of a year, loading it on first use, or None if the year has not been ingested"""
+
+        path = Catalogue.path(year, self.directory)
+        with self._lock:
+            entry = self._catalogues.get(path)
+            if entry is not None and entry[0] is None:
+                return entry[1]
+
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                return None
+
+            if entry is None or entry[0] != modified:
+                catalogue = Catalogue.load(year, self.directory)
+                if catalogue is None:
+                    return None
+                catalogue.share(self._pool)
+                entry = self._catalogues[path] = modified, catalogue
+
+            return entry[1]
+
+    def add(self, catalogue: Catalogue):
+        """Adds a catalogue built in memory, replacing the catalogue of its year"""
+
+        with self._lock:
+            catalogue.share(self._pool)
+            self._catalogues[Catalogue.path(catalogue.year, self.directory)] = None, catalogue
+
+    def clear(self):
+        """Forgets every catalogue"""
+
+        with self._lock:
+            self._catalogues.clear()
+            self._pool.clear()
+
+    def _pair(self, old_year: str, new_year: str) -> Tuple[Catalogue, Catalogue]:
+        old, new = self.get(old_year), self.get(new_year)
+        for year, catalogue in ((old_year, old), (new_year, new)):
+            if catalogue is None:
+                raise ValueError(f"The catalogue of {year} has not been ingested")
+
+        return old, new
+
+    # ----- Diffing ----- #
+    def diff(self, old_year: str, new_year: str, prefix: str = "",
+             fields: Optional[Collection[str]] = None) -> CatalogueDiff:
+        """
+        Returns the modules added, removed and changed between two years
+
+        Parameters
+        ----------
+        :param old_year:        The year to diff from
+        :param new_year:        The year to diff to
+        :param prefix:          Only diff the modules whose code starts with the prefix, e.g. "CS"
+        :param fields:          Only report changes to these fields (default: every field in Catalogue.FIELDS)
+        """
+
+        old, new = self._pair(old_year, new_year)
+        fields = tuple(fields) if fields else Catalogue.FIELDS
+
+        old_codes = {code for code in old if code.startswith(prefix)}
+        new_codes = {code for code in new if code.startswith(prefix)}
+
+        changed = {}
+        for code in sorted(old_codes & new_codes):
+            before, after = old[code], new[code]
+            if before is after:
+                continue
+
+            differences = [field for field in fields if before.get(field) != after.get(field)]
+            if differences:
+                changed[code] = differences
+
+        return CatalogueDiff(old_year, new_year, sorted(new_codes - old_codes), sorted(old_codes - new_codes), changed)
+
+    def prerequisite_changes(self, old_year: str, new_year: str, prefix: str = "") -> Dict[str, Tuple[Any, Any]]:
+        """
+        Returns the normalised prerequisite trees (see PrereqEngine.tree) of the modules whose prerequisites changed
+        between two years, as (old tree, new tree), where a module missing from a year has a tree of None
+
+        Parameters
+        ----------
+        :param old_year:        The year to diff from
+        :param new_year:        The year to diff to
+        :param prefix:          Only diff the modules whose code starts with the prefix, e.g. "CS"
+        """
+
+        old, new = self._pair(old_year, new_year)
+        old_engine, new_engine = PrereqEngine.of(old), PrereqEngine.of(new)
+
+        changes = {}
+        for code in sorted({code for code in old if code.startswith(prefix)} |
+                           {code for code in new if code.startswith(prefix)}):
+            if code in old and code in new and old[code] is new[code]:
+                continue
+
+            before, after = old_engine.tree(code), new_engine.tree(code)
+            if before != after:
+                changes[code] = before, after
+
+        return changes
+
+
+CATALOGUES = CatalogueManager()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Show what changed between the catalogue snapshots of two years")
+    parser.add_argument("old_year", help="year to diff from, e.g. 2022-2023")
+    parser.add_argument("new_year", help="year to diff to, e.g. 2023-2024")
+    parser.add_argument("--prefix", default="", help="only diff the modules whose code starts with the prefix")
+    parser.add_argument("--field", dest="fields", action="append", default=None,
+                        help="only report changes to this field (can be repeated)")
+    parser.add_argument("--prerequisites", action="store_true",
+                        help="show the old and new prerequisite trees of the modules whose prerequisites changed")
+    parser.add_argument("--directory", default=None, help="directory holding the snapshots")
+    args = parser.parse_args(argv)
+
+    manager = CatalogueManager(args.directory)
+    try:
+        if args.prerequisites:
+            for code, (before, after) in manager.prerequisite_changes(args.old_year, args.new_year,
+                                                                      args.prefix).items():
+                print(f"{code}: {before} -> {after}")
+        else:
+            print(manager.diff(args.old_year, args.new_year, args.prefix, args.fields))
+    except ValueError as e:
+        print(f"{e}. Run python ingest.py {args.old_year} and python ingest.py {args.new_year} first.",
+              file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import heapq
+import weakref
+import requests
+
+from datetime import datetime
+
+from catalogue import Catalogue, CatalogueAttribute
+from store import ModuleStore
+from typing import *
+
+
+class Clash:
+    """Two modules whose lessons or exams overlap in a semester"""
+
+    def __init__(self, kind: str, semester: int, modules: Tuple[str, str], when: str):
+        self.kind = kind
+        self.semester = semester
+        self.modules = modules
+        self.when = when
+
+    def __eq__(self, other):
+        return isinstance(other, Clash) and (self.kind, self.semester, self.modules) == \
+            (other.kind, other.semester, other.modules)
+
+    def __hash__(self):
+        return hash((self.kind, self.semester, self.modules))
+
+    def __repr__(self):
+        return f"Clash({self.kind}, Semester {self.semester}, {self.modules[0]} x {self.modules[1]})"
+
+    def __str__(self):
+        return f"Semester {self.semester} {self.kind} clash between {self.modules[0]} and {self.modules[1]}: " \
+               f"{self.when}"
+
+    def to_dict(self) -> dict:
+        """Returns the clash as a JSON-serialisable dictionary"""
+
+        return {"kind": self.kind, "semester": self.semester, "modules": list(self.modules), "when": self.when}
+
+
+class ClashDetector:
+    """
+    Finds the modules of a plan whose lessons or exams overlap, from the semesterData of the catalogue snapshot
+
+    The lessons of a module in a semester are turned into intervals of minutes from the start of the week, and its exam
+    into an interval of minutes from the epoch, once per module. Only lessons that cannot be avoided are checked, i.e.
+    the lessons of a lesson type that has a single class to choose from (usually lectures), as a student can pick other
+    classes around a clash. Lessons on disjoint teaching weeks do not clash.
+
+    A catalogue ingested from moduleInfo.json only holds the condensed semesterData of its modules, with their exams but
+    without their lessons. The lessons of such a module are read from its own document in the module store if one is
+    given, and otherwise the module is reported by missing_lessons, as its lesson clashes cannot be checked.
+
+    The intervals of the modules of a plan are then swept in order of their start, keeping the intervals still running
+    in a heap ordered by their end. Every interval left in the heap once the finished ones are popped overlaps the
+    current one, so a plan of n intervals is checked in O(n log n + k), where k is the number of pairs of intervals that
+    overlap in time (including pairs of lessons on disjoint weeks, which are then skipped), instead of comparing every
+    pair of modules. Use ClashDetector.of(catalogue) to share a single detector between every user of a catalogue.
+    """
+
+    API_ENDPOINT: str = "https://api.nusmods.com/v2/"
+    DAYS: Tuple[str, ...] = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+    LESSON: str = "lesson"
+    EXAM: str = "exam"
+
+    catalogue = CatalogueAttribute()
+
+    _DETECTORS: "weakref.WeakKeyDictionary[Catalogue, ClashDetector]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue, store: Optional[ModuleStore] = None, endpoint: Optional[str] = None):
+        self.catalogue = catalogue
+        self.store = store
+        self.endpoint = endpoint if endpoint else self.API_ENDPOINT
+
+        # (start, end, kind, module code, weeks, description) of every module, keyed by (module code, semester)
+        self._intervals: Dict[Tuple[str, int], List[Tuple[int, int, str, str, FrozenSet[int] or None, str]]] = {}
+        # the (module code, semester) of the modules whose lessons could not be found
+        self._missing: Set[Tuple[str, int]] = set()
+
+    @classmethod
+    def of(cls, catalogue: Catalogue, store: Optional[ModuleStore] = None,
+           endpoint: Optional[str] = None) -> "ClashDetector":
+        """Returns the clash detector of a catalogue, creating it on first use"""
+
+        detector = cls._DETECTORS.get(catalogue)
+        if detector is None:
+            detector = cls._DETECTORS[catalogue] = cls(catalogue, store, endpoint)
+
+        return detector
+
+    # ----- Intervals ----- #
+    @staticmethod
+    def _minutes(time: str) -> int:
+        return int(time[:2]) * 60 + int(time[2:])
+
+    def _semester_data(self, module_code: str, semester: int) -> dict or None:
+        module = self.catalogue.get(module_code)
+        for data in (module.get("semesterData") or []) if module is not None else []:
+            if data.get("semester") == semester:
+                return data
+
+        return None
+
+    def _timetable(self, module_code: str, semester: int, data: dict) -> List[dict] or None:
+        # the lessons of a module in a semester, from the module's own document if the catalogue only holds the
+        # condensed semesterData, or None if they cannot be found
+        if "timetable" in data:
+            return data["timetable"] or []
+        if self.store is None:
+            return None
+
+        try:
+            module = self.store.get(self.endpoint, self.catalogue.year, module_code)
+        except requests.RequestException:
+            return None
+
+        for full in (module.get("semesterData") or []) if module is not None else []:
+            if full.get("semester") == semester and "timetable" in full:
+                return full["timetable"] or []
+
+        return None
+
+    def intervals(self, module_code: str,
+                  semester: int) -> List[Tuple[int, int, str, str, FrozenSet[int] or None, str]]:
+        """
+        Returns the unavoidable lessons and the exam of a module in a semester (1 or 2) as intervals of
+        (start, end, kind, module code, weeks, description), where weeks is None for an exam or for lessons whose weeks
+        are not listed
+        """
+
+        key = module_code, semester
+        if key not in self._intervals:
+            intervals = []
+            data = self._semester_data(module_code, semester)
+            if data is not None:
+                timetable = self._timetable(module_code, semester, data)
+                if timetable is None:
+                    self._missing.add(key)
+                    timetable = []
+
+                classes: Dict[str, Set[str]] = {}
+                for lesson in timetable:
+                    classes.setdefault(lesson.get("lessonType"), set()).add(lesson.get("classNo"))
+
+                for lesson in timetable:
+                    if len(classes[lesson.get("lessonType")]) != 1 or lesson.get("day") not in self.DAYS:
+                        continue
+                    try:
+                        day = self.DAYS.index(lesson["day"]) * 24 * 60
+                        start, end = self._minutes(lesson["startTime"]), self._minutes(lesson["endTime"])
+                    except (KeyError, ValueError):
+                        continue
+                    weeks = lesson.get("weeks")
+                    weeks = frozenset(weeks) if isinstance(weeks, list) else None
+                    intervals.append((day + start, day + end, self.LESSON, module_code, weeks,
+                                      f"{lesson['day']} {lesson['startTime']}-{lesson['endTime']} "
+                                      f"{lesson.get('lessonType', 'Lesson')}"))
+
+                if data.get("examDate"):
+                    try:
+                        start = datetime.fromisoformat(data["examDate"].replace("Z", "+00:00"))
+                        duration = int(data.get("examDuration") or 120)
+                    except (TypeError, ValueError):
+                        pass
+                    else:
+                        minutes = int(start.timestamp()) // 60
+                        intervals.append((minutes, minutes + duration, self.EXAM, module_code, None,
+                                          f"exam on {data['examDate'][:10]} ({duration} minutes)"))
+
+            self._intervals[key] = intervals
+
+        return self._intervals[key]
+
+    # ----- Detection ----- #
+    def clashes(self, module_codes: Iterable[str], semester: int) -> List[Clash]:
+        """
+        Returns the clashes between modules taken in the same semester
+
+        Parameters
+        ----------
+        :param module_codes:    The module codes taken in the semester
+        :param semester:        The semester of the academic year the modules are taken in, 1 or 2
+        """
+
+        intervals = [interval for code in dict.fromkeys(module_codes) for interval in self.intervals(code, semester)]
+        intervals.sort(key=lambda interval: interval[0])
+
+        found: Dict[Tuple[str, str, str], Clash] = {}
+        running: Dict[str, List[tuple]] = {self.LESSON: [], self.EXAM: []}
+        for i, (start, end, kind, code, weeks, description) in enumerate(intervals):
+            heap = running[kind]
+            while heap and heap[0][0] <= start:
+                heapq.heappop(heap)
+
+            # every interval still running started before this one and ends after its start, so they all overlap it
+            for _, _, other, other_weeks, other_description in heap:
+                if other == code or (weeks is not None and other_weeks is not None and weeks.isdisjoint(other_weeks)):
+                    continue
+                pair = tuple(sorted((code, other)))
+                if (kind, *pair) not in found:
+                    found[kind, *pair] = Clash(kind, semester, pair,
+                                               other_description if kind == self.EXAM else
+                                               f"{other_description} and {description}")
+
+            heapq.heappush(heap, (end, i, code, weeks, description))
+
+        return sorted(found.values(), key=lambda clash: (clash.kind, clash.modules))
+
+    def missing_lessons(self, module_codes: Iterable[str], semester: int) -> List[str]:
+        """
+        Returns the modules taken in a semester whose lessons could not be found, so that their lesson clashes were not
+        checked (their exams still are)
+
+        Parameters
+        ----------
+        :param module_codes:    The module codes taken in the semester
+        :param semester:        The semester of the academic year the modules are taken in, 1 or 2
+        """
+
+        module_codes = list(dict.fromkeys(module_codes))
+        for code in module_codes:
+            self.intervals(code, semester)
+
+        return [code for code in module_codes if (code, semester) in self._missing]
+
+    def clashes_schedule(self, semesters: Sequence[Iterable[str]]) -> Dict[int, List[Clash]]:
+        """
+        Returns the clashes of every semester of a schedule that has any, keyed by the index of the semester, where
+        semesters alternate between Semester 1 and Semester 2 as in Scheduler
+        """
+
+        clashes = {}
+        for s, modules in enumerate(semesters):
+            found = self.clashes(modules, s % 2 + 1)
+            if found:
+                clashes[s] = found
+
+        return clashes
+
+    def clashes_batch(self, plans: Sequence[Iterable[str]], semester: int) -> List[List[Clash]]:
+        """Returns the clashes of each of many sets of modules taken in the same semester"""
+
+        return [self.clashes(plan, semester) for plan in plans]
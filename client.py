@@ -0,0 +1,279 @@
+import time
+import random
+import threading
+import requests
+
+from urllib.parse import urlsplit
+
+from metrics import METRICS, Metrics
+from typing import *
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit breaker is open"""
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, allowing bursts of up to burst requests and rate requests per second on average
+
+    acquire blocks the calling thread until a token is available, so the threads of a crawl share a single budget.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self) -> float:
+        """Takes a token, waiting for one if the bucket is empty, and returns the number of seconds waited"""
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single host
+
+    The circuit opens after threshold requests in a row have failed, and every request is then refused without touching
+    the network for reset seconds. After that, a single trial request is let through (half-open): the circuit closes
+    again if it succeeds, and opens for another reset seconds if it fails.
+    """
+
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half-open"
+
+    def __init__(self, threshold: int, reset: float):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self._probing = False
+        self._prober: Optional[int] = None
+
+    @property
+    def state(self) -> str:
+        """The state of the circuit, one of CLOSED, OPEN and HALF_OPEN"""
+
+        if self.opened_at is None:
+            return self.CLOSED
+
+        return self.OPEN if time.monotonic() - self.opened_at < self.reset else self.HALF_OPEN
+
+    def remaining(self) -> float:
+        """Returns the number of seconds until an open circuit lets a trial request through"""
+
+        return max(0.0, self.opened_at + self.reset - time.monotonic()) if self.opened_at is not None else 0.0
+
+    def allow(self) -> bool:
+        """Returns whether a request may be sent, letting a single trial request through a half-open circuit"""
+
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self._prober = threading.get_ident()
+                return True
+
+            return False
+
+    def success(self):
+        """Records a request that succeeded, closing the circuit"""
+
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        """Records a request that failed, opening the circuit after threshold failures in a row or a failed trial"""
+
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """
+        Ends the trial request of the calling thread if it was neither recorded as a success nor as a failure (e.g. it
+        raised an unexpected error), so that the half-open circuit lets another trial request through
+        """
+
+        with self._lock:
+            if self._probing and self._prober == threading.get_ident():
+                self._probing = False
+
+
+class ResilientClient:
+    """
+    HTTP client shared by the module store, ModuleGraph and the ingester, so that every request to the API is sent with
+    the same timeouts, retries, rate limit and circuit breaker
+
+    Requests go through a pooled keep-alive session. Connection errors, timeouts and 429 or 5xx answers are retried up
+    to retries times, after a jittered exponential backoff (a random wait of up to backoff * 2^attempt, capped at
+    max_backoff) or after the Retry-After sent by the server. Every other answer, including 304 and 404, is returned to
+    the caller as is.
+
+    Every host gets a token bucket of rate requests per second (with bursts of burst requests) and a circuit breaker
+    that opens after threshold failed requests in a row, and then refuses requests with CircuitOpenError for reset
+    seconds, so an outage fails fast instead of stalling a crawl on timeouts. Every attempt is recorded in the metrics.
+    """
+
+    TIMEOUT: Tuple[float, float] = (3.05, 10.0)
+    RETRIES: int = 4
+    BACKOFF: float = 0.1
+    MAX_BACKOFF: float = 5.0
+    RATE: float = 250.0
+    BURST: int = 32
+    THRESHOLD: int = 5
+    RESET: float = 30.0
+    RETRY_STATUSES: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, session: Optional[requests.Session] = None,
+                 timeout: Optional[float or Tuple[float, float]] = None, retries: Optional[int] = None,
+                 backoff: Optional[float] = None, max_backoff: Optional[float] = None, rate: Optional[float] = None,
+                 burst: Optional[int] = None, threshold: Optional[int] = None, reset: Optional[float] = None,
+                 metrics: Optional[Metrics] = None):
+        self.session = session if session else requests.Session()
+        self.timeout = self.TIMEOUT if timeout is None else timeout
+        self.retries = self.RETRIES if retries is None else retries
+        self.backoff = self.BACKOFF if backoff is None else backoff
+        self.max_backoff = self.MAX_BACKOFF if max_backoff is None else max_backoff
+        self.rate = self.RATE if rate is None else rate
+        self.burst = self.BURST if burst is None else burst
+        self.threshold = self.THRESHOLD if threshold is None else threshold
+        self.reset = self.RESET if reset is None else reset
+        self.metrics = metrics if metrics else METRICS
+
+        if self.retries < 0 or self.backoff < 0 or self.max_backoff < 0 or self.rate < 0 or self.burst < 1 or \
+                self.threshold < 1 or self.reset < 0:
+            raise ValueError("Retries, backoffs, rate and reset must not be negative, and burst and threshold must be "
+                             "at least 1")
+
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def host(url: str) -> str:
+        """Returns the host of a URL, which rate limits and circuit breakers are kept per"""
+
+        return urlsplit(url).netloc
+
+    def bucket(self, url: str) -> TokenBucket or None:
+        """Returns the token bucket of the host of a URL, or None if requests are not rate limited"""
+
+        if not self.rate:
+            return None
+
+        with self._lock:
+            host = self.host(url)
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """Returns the circuit breaker of the host of a URL"""
+
+        with self._lock:
+            host = self.host(url)
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.threshold, self.reset)
+            return self._breakers[host]
+
+    def _delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        # the server knows best when it can take requests again, otherwise the backoff is spread out at random so that
+        # the threads of a crawl do not all come back at once
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(self.max_backoff, float(response.headers["Retry-After"]))
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None,
+            endpoint: Optional[str] = None) -> requests.Response:
+        """
+        Sends a GET request, retrying it on connection errors, timeouts and 429 or 5xx answers, and returns the last
+        response
+
+        Parameters
+        ----------
+        :param url:             The URL to request
+        :param headers:         Optional headers of the request, e.g. If-None-Match
+        :param endpoint:        The API endpoint the request is recorded under in the metrics (default: the host)
+        :raise:                 CircuitOpenError if the circuit of the host is open, and requests.ConnectionError or
+                                requests.Timeout if every attempt failed to get an answer
+        """
+
+        endpoint = endpoint if endpoint else self.host(url)
+        breaker, bucket = self.breaker(url), self.bucket(url)
+        if not breaker.allow():
+            self.metrics.request(endpoint, CircuitOpenError.__name__, 0.0, url)
+            raise CircuitOpenError(f"Too many failed requests to {self.host(url)}, retrying in "
+                                   f"{breaker.remaining():.1f}s")
+
+        try:
+            for attempt in range(self.retries + 1):
+                if bucket is not None:
+                    bucket.acquire()
+
+                response, error = None, None
+                start = time.perf_counter()
+                try:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                    self.metrics.request(endpoint, type(e).__name__, time.perf_counter() - start, url)
+                else:
+                    self.metrics.request(endpoint, response.status_code, time.perf_counter() - start, url)
+                    if response.status_code not in self.RETRY_STATUSES:
+                        breaker.success()
+                        return response
+
+                if attempt < self.retries:
+                    time.sleep(self._delay(attempt, response))
+                    if response is not None:
+                        response.close()
+
+            breaker.failure()
+            if error is not None:
+                raise error
+
+            return response
+        finally:
+            # any other error (e.g. an invalid URL) must not leave a trial request of a half-open circuit running
+            breaker.release()
+
+    def close(self):
+        """Closes the HTTP session"""
+
+        self.session.close()
+
+
+CLIENT = ResilientClient()
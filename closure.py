@@ -0,0 +1,212 @@
+import os
+import glob
+import json
+import weakref
+
+from graph import ModuleGraph
+from catalogue import Catalogue
+from typing import *
+
+
+class ClosureIndex:
+    """
+    Transitive closure of a module graph, answering "what must I take before this module" without any search
+
+    Every module gets two reachability bitsets (arbitrary-precision integers indexed by the ids of the graph), one for
+    its ancestors and one for its descendants. They are built with a single sweep over the graph in topological order,
+    followed by a fixpoint over the few modules that sit on a prerequisite cycle.
+
+    After the index is built, checking whether one module is an ancestor of another is a single bit test, and the
+    ancestors of any set of modules are the union of their bitsets. The index of a catalogue is persisted next to its
+    snapshot under the fingerprint of the catalogue, so it is only ever reused for the same snapshot.
+    """
+
+    _INDEXES: "weakref.WeakKeyDictionary[Catalogue, ClosureIndex]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, codes: List[str or None], ancestors: List[int], descendants: List[int]):
+        self._codes = codes
+        self._ids = {code: i for i, code in enumerate(codes) if code is not None}
+        self._ancestors = ancestors
+        self._descendants = descendants
+
+    def __contains__(self, module_code: str):
+        return module_code in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    # ----- Building ----- #
+    @classmethod
+    def build(cls, graph: ModuleGraph) -> "ClosureIndex":
+        """Builds the closure of every module in a graph"""
+
+        size = graph.size
+        offsets, targets = graph.csr()
+        ancestors = cls._sweep(size, offsets, targets)
+
+        offsets, targets = graph.csr(reverse=True)
+        descendants = cls._sweep(size, offsets, targets)
+
+        return cls([graph.code_of(i) for i in range(size)], ancestors, descendants)
+
+    @staticmethod
+    def _sweep(size: int, offsets: Sequence[int], targets: Sequence[int]) -> List[int]:
+        # reach[d] collects every node with a path to d, following the edges given in CSR form
+        reach = [0] * size
+        indegree = [0] * size
+        for target in targets:
+            indegree[target] += 1
+
+        order = [i for i in range(size) if indegree[i] == 0]
+        for origin in order:
+            carried = reach[origin] | (1 << origin)
+            for target in targets[offsets[origin]:offsets[origin + 1]]:
+                reach[target] |= carried
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    order.append(target)
+
+        # nodes on a cycle were never released by the sweep, so propagate among them until nothing changes
+        remaining = [i for i in range(size) if indegree[i] > 0]
+        changed = True
+        while changed:
+            changed = False
+            for origin in remaining:
+                carried = reach[origin] | (1 << origin)
+                for target in targets[offsets[origin]:offsets[origin + 1]]:
+                    if reach[target] | carried != reach[target]:
+                        reach[target] |= carried
+                        changed = True
+
+        return reach
+
+    # ----- Persistence ----- #
+    @staticmethod
+    def path(catalogue: Catalogue) -> str or None:
+        """
+        Returns the path the closure of a catalogue is persisted to, next to the snapshot of the catalogue and keyed by
+        its fingerprint, or None if the catalogue was neither loaded from nor saved to a directory
+        """
+
+        if catalogue.directory is None:
+            return None
+
+        return os.path.join(catalogue.directory, f"closure-{catalogue.year}-{catalogue.fingerprint}.json")
+
+    def save(self, path: str):
+        """Writes the index to a file"""
+
+        with open(path + ".tmp", "w") as f:
+            json.dump({
+                "codes": self._codes,
+                "ancestors": [format(mask, "x") for mask in self._ancestors],
+                "descendants": [format(mask, "x") for mask in self._descendants]
+            }, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "ClosureIndex":
+        """Reads an index written by save"""
+
+        with open(path) as f:
+            data = json.load(f)
+
+        return cls(data["codes"], [int(mask, 16) for mask in data["ancestors"]],
+                   [int(mask, 16) for mask in data["descendants"]])
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "ClosureIndex":
+        """
+        Returns the closure of the graph of a whole catalogue
+
+        The index persisted for the snapshot of the catalogue is loaded if there is one. Otherwise, the graph is built
+        from the catalogue, and the new index is persisted in place of the index of any earlier snapshot of the year.
+        """
+
+        index = cls._INDEXES.get(catalogue)
+        if index is not None:
+            return index
+
+        path = cls.path(catalogue)
+        if path is not None and os.path.isfile(path):
+            index = cls.load(path)
+        else:
+            index = cls.build(ModuleGraph.from_catalogue(catalogue))
+            if path is not None:
+                for stale in glob.glob(os.path.join(catalogue.directory, f"closure-{catalogue.year}*.json")):
+                    os.remove(stale)
+                index.save(path)
+
+        cls._INDEXES[catalogue] = index
+        return index
+
+    # ----- Queries ----- #
+    def _decode(self, mask: int) -> Set[str]:
+        codes = set()
+        while mask:
+            low = mask & -mask
+            codes.add(self._codes[low.bit_length() - 1])
+            mask ^= low
+
+        codes.discard(None)
+        return codes
+
+    def ancestor_mask(self, module_codes: Iterable[str]) -> int:
+        """Returns the bitset of every module that is a transitive prerequisite of any of the modules"""
+
+        mask = 0
+        for code in module_codes:
+            node = self._ids.get(code)
+            if node is not None:
+                mask |= self._ancestors[node]
+
+        return mask
+
+    def descendant_mask(self, module_codes: Iterable[str]) -> int:
+        """Returns the bitset of every module that any of the modules is a transitive prerequisite of"""
+
+        mask = 0
+        for code in module_codes:
+            node = self._ids.get(code)
+            if node is not None:
+                mask |= self._descendants[node]
+
+        return mask
+
+    def ancestors(self, module_code: str) -> Set[str]:
+        """Returns every module that is a transitive prerequisite of a module"""
+
+        return self._decode(self.ancestor_mask([module_code]))
+
+    def descendants(self, module_code: str) -> Set[str]:
+        """Returns every module that a module is a transitive prerequisite of"""
+
+        return self._decode(self.descendant_mask([module_code]))
+
+    def ancestors_of(self, module_codes: Iterable[str]) -> Set[str]:
+        """Returns every module that is a transitive prerequisite of any of the modules"""
+
+        return self._decode(self.ancestor_mask(module_codes))
+
+    def descendants_of(self, module_codes: Iterable[str]) -> Set[str]:
+        """Returns every module that any of the modules is a transitive prerequisite of"""
+
+        return self._decode(self.descendant_mask(module_codes))
+
+    def is_ancestor(self, ancestor: str, module_code: str) -> bool:
+        """Returns whether a module is a transitive prerequisite of another module"""
+
+        a, m = self._ids.get(ancestor), self._ids.get(module_code)
+        return a is not None and m is not None and bool(self._ancestors[m] >> a & 1)
+
+    def count_ancestors(self, module_code: str) -> int:
+        """Returns the number of transitive prerequisites of a module"""
+
+        node = self._ids.get(module_code)
+        return self._ancestors[node].bit_count() if node is not None else 0
+
+    def count_descendants(self, module_code: str) -> int:
+        """Returns the number of modules that a module is a transitive prerequisite of"""
+
+        node = self._ids.get(module_code)
+        return self._descendants[node].bit_count() if node is not None else 0
@@ -19,3 +19,106 @@ COMPUTER_SCIENCE_MATH_MODS = [
     "ST2334"
 ]
 
+
+DATA_LITERACY_MODS = [
+    "GEA1000",
+    "BT1101",
+    "ST1131",
+    "DSE1101"
+]
+
+# Degree requirements, as consumed by requirements.RequirementEngine. Every programme lists named requirements, each of
+# which is one of:
+#   {"all": [codes]}                every module (or an equivalent) must be taken
+#   {"pick": n, "of": [codes]}      at least n of the modules must be taken
+#   {"mcs": n, "of": [codes]}       the modules taken must add up to at least n MCs
+# where codes may end with % to stand for every module starting with the prefix, e.g. CS4% for level-4000 CS modules.
+# A requirement may also list constraints on the modules it counts under "including", in the same forms, e.g.
+#   {"mcs": 32, "of": ["CS3%", "CS4%"], "including": {"Level 4000": {"mcs": 12, "of": ["CS4%"]}}}
+# for 32 MCs of which at least 12 are at level 4000. A module only counts towards one requirement of a programme, and
+# max_shared caps the MCs a programme may share with the primary degree (None for no cap).
+COMPUTER_SCIENCE_FOCUS_AREAS = {
+    "Algorithms and Theory": ["CS3230", "CS3231", "CS3236", "CS4231", "CS4232", "CS4234"],
+    "Artificial Intelligence": ["CS2109S", "CS3243", "CS3244", "CS3263", "CS3264", "CS4243", "CS4244", "CS4246",
+                                "CS4248"],
+    "Computer Graphics and Games": ["CS3241", "CS3242", "CS3247", "CS4247", "CS4350"],
+    "Computer Security": ["CS2107", "CS3235", "CS4236", "CS4238", "CS4239"],
+    "Database Systems": ["CS2102", "CS3223", "CS4221", "CS4224", "CS4225"],
+    "Networking and Distributed Systems": ["CS2105", "CS3103", "CS4222", "CS4226", "CS4231"],
+    "Parallel Computing": ["CS3210", "CS3211", "CS4223", "CS4231"],
+    "Software Engineering": ["CS2103T", "CS3203", "CS3216", "CS3217", "CS3219", "CS4211", "CS4218", "CS4239"]
+}
+
+PRIMARY_PROGRAMME = "Computer Science"
+
+PROGRAMMES = {
+    PRIMARY_PROGRAMME: {
+        "kind": "degree",
+        "max_shared": None,
+        "requirements": {
+            "Computer Science Foundation": {"all": COMPUTER_SCIENCE_CORE_MODS},
+            "Mathematics and Sciences": {"all": COMPUTER_SCIENCE_MATH_MODS},
+            "Data Literacy": {"pick": 1, "of": DATA_LITERACY_MODS},
+            "Breadth and Depth": {"mcs": 32, "of": ["CS3%", "CS4%", "CS5%"], "including": {
+                "Level 4000 and above": {"mcs": 12, "of": ["CS4%", "CS5%"]}
+            }}
+        }
+    },
+    **{
+        f"Focus Area: {name}": {
+            "kind": "specialisation",
+            "max_shared": None,
+            "requirements": {
+                "Primaries": {"pick": 3, "of": primaries, "including": {
+                    "Level 4000 Primary": {"pick": 1, "of": [code for code in primaries if code.startswith("CS4")]}
+                }}
+            }
+        } for name, primaries in COMPUTER_SCIENCE_FOCUS_AREAS.items()
+    },
+    "Second Major in Mathematics": {
+        "kind": "major",
+        "max_shared": 16,
+        "requirements": {
+            "Essential Modules": {"all": ["MA2001", "MA2002", "MA2101", "MA2108"]},
+            "Electives": {"mcs": 32, "of": ["MA%", "ST%"], "including": {
+                "Level 3000 and above": {"mcs": 16, "of": ["MA3%", "MA4%"]}
+            }}
+        }
+    },
+    "Minor in Mathematics": {
+        "kind": "minor",
+        "max_shared": 8,
+        "requirements": {
+            "Linear Algebra": {"pick": 1, "of": ["MA2001", "MA2101"]},
+            "Electives": {"mcs": 16, "of": ["MA%"], "including": {
+                "Level 2000 and above": {"mcs": 12, "of": ["MA2%", "MA3%", "MA4%"]}
+            }}
+        }
+    },
+    "Minor in Statistics": {
+        "kind": "minor",
+        "max_shared": 8,
+        "requirements": {
+            "Probability and Statistics": {"all": ["ST2131", "ST2132"]},
+            "Electives": {"mcs": 12, "of": ["ST%"], "including": {
+                "Level 3000 and above": {"mcs": 8, "of": ["ST3%", "ST4%"]}
+            }}
+        }
+    },
+    "Minor in Economics": {
+        "kind": "minor",
+        "max_shared": 8,
+        "requirements": {
+            "Principles": {"all": ["EC1101E", "EC2101", "EC2102"]},
+            "Electives": {"mcs": 8, "of": ["EC2%", "EC3%", "EC4%"]}
+        }
+    },
+    "Minor in Interactive Media Development": {
+        "kind": "minor",
+        "max_shared": 8,
+        "requirements": {
+            "Media Foundations": {"pick": 2, "of": ["NM2207", "NM2209", "CS1010", "CS2030S"]},
+            "Development": {"pick": 2, "of": ["CS3240", "CS3247", "CS4240", "CS4350", "NM3216", "NM3239"]}
+        }
+    }
+}
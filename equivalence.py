@@ -0,0 +1,137 @@
+import re
+import weakref
+
+from utils import MODULE_CODE_REGEX
+from catalogue import Catalogue, CatalogueAttribute
+from typing import *
+
+
+class PreclusionIndex:
+    """
+    Preclusions of every module, following chains of preclusions, computed once over a whole catalogue
+
+    A module lists the modules it precludes, and the modules equivalent to it are every module reachable by following
+    those lists, i.e. the same modules a crawl of the preclusions of the module would find. As a preclusion is not
+    always listed both ways, this is not symmetric: a module that only names a member of a group of equivalent modules
+    is not equivalent to the rest of the group. Modules referenced by a preclusion but missing from the catalogue are
+    reachable, but do not lead any further.
+
+    The classes of the index are the groups of modules that all reach each other (the strongly connected components of
+    the preclusion graph), found with Tarjan's algorithm over interned module codes. The modules reachable from every
+    class are then collected once, sinks first, so the class id and the equivalents of any module are O(1) lookups. Use
+    PreclusionIndex.of(catalogue) to share a single index between every user of a catalogue.
+    """
+
+    catalogue = CatalogueAttribute()
+
+    _INDEXES: "weakref.WeakKeyDictionary[Catalogue, PreclusionIndex]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+
+        ids: Dict[str, int] = {}
+        codes: List[str] = []
+        edges: List[List[int]] = []
+
+        def intern(code: str) -> int:
+            if code not in ids:
+                ids[code] = len(codes)
+                codes.append(code)
+                edges.append([])
+            return ids[code]
+
+        for code in catalogue:
+            origin = intern(code)
+            for precluded in re.findall(MODULE_CODE_REGEX, catalogue[code].get("preclusion", "")):
+                target = intern(precluded)
+                if target != origin:
+                    edges[origin].append(target)
+
+        # iterative Tarjan, which completes every class after the classes it reaches
+        self._class: Dict[str, int] = {}
+        members: List[List[str]] = []
+        reach: List[FrozenSet[str]] = []
+        index, low, on_stack = [-1] * len(codes), [0] * len(codes), [False] * len(codes)
+        stack: List[int] = []
+        counter = 0
+        for root in range(len(codes)):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, i = work.pop()
+                if i == 0:
+                    index[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                if i < len(edges[node]):
+                    work.append((node, i + 1))
+                    target = edges[node][i]
+                    if index[target] == -1:
+                        work.append((target, 0))
+                    elif on_stack[target]:
+                        low[node] = min(low[node], index[target])
+                    continue
+
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        self._class[codes[member]] = len(members)
+                        component.append(codes[member])
+                        if member == node:
+                            break
+                    found = set(component)
+                    for member in component:
+                        for target in edges[ids[member]]:
+                            target_class = self._class[codes[target]]
+                            if target_class != len(members):
+                                found |= reach[target_class]
+                    members.append(component)
+                    reach.append(frozenset(found))
+
+        self._members: List[FrozenSet[str]] = [frozenset(m) for m in members]
+        self._reach = reach
+
+    def __contains__(self, module_code: str):
+        return module_code in self._class
+
+    def __len__(self):
+        return len(self._members)
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "PreclusionIndex":
+        """Returns the index of a catalogue, building it on first use"""
+
+        index = cls._INDEXES.get(catalogue)
+        if index is None:
+            index = cls._INDEXES[catalogue] = cls(catalogue)
+
+        return index
+
+    def class_id(self, module_code: str) -> int or None:
+        """
+        Returns the id of the class of a module, i.e. of the modules that it and every one of them preclude in turn, or
+        None if the module is not in the index
+        """
+
+        return self._class.get(module_code)
+
+    def members(self, class_id: int) -> FrozenSet[str]:
+        """Returns the module codes in a class"""
+
+        return self._members[class_id]
+
+    def equivalents(self, module_code: str) -> FrozenSet[str]:
+        """
+        Returns the module codes equivalent to a module, i.e. every module reached by following its preclusions,
+        including the module itself
+        """
+
+        class_id = self._class.get(module_code)
+        return self._reach[class_id] if class_id is not None else frozenset({module_code})
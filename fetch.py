@@ -0,0 +1,117 @@
+import time
+import weakref
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+from store import ModuleStore
+from typing import *
+
+
+class Fetcher:
+    """
+    Concurrent fetch engine that resolves many module documents at once
+
+    Fetches are dispatched to a bounded thread pool, which caps the number of requests in flight, and go through the
+    pooled keep-alive session of the module store, so connections to the API are reused instead of being opened for
+    every module. Crawls use it to resolve a whole BFS frontier level in parallel.
+
+    The connection pool of a session is sized once, by the first fetcher that uses it (or by a later one that needs a
+    larger pool), so fetchers sharing a store also share its pooled connections.
+    """
+
+    MAX_IN_FLIGHT: int = 16
+
+    # the pool size mounted on every session fetchers have used
+    _POOLS: "weakref.WeakKeyDictionary[requests.Session, int]" = weakref.WeakKeyDictionary()
+    _POOLS_LOCK = threading.Lock()
+
+    def __init__(self, store: ModuleStore, max_in_flight: Optional[int] = None):
+        self.store = store
+        self.max_in_flight = max_in_flight if max_in_flight else self.MAX_IN_FLIGHT
+
+        self.mount(self.store.session, self.max_in_flight)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="pathfinder-fetch")
+
+    @classmethod
+    def mount(cls, session: requests.Session, pool_size: int):
+        """Mounts a connection pool of at least pool_size connections on a session, unless it already has one"""
+
+        with cls._POOLS_LOCK:
+            if cls._POOLS.get(session, 0) >= pool_size:
+                return
+
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            cls._POOLS[session] = pool_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def map(self, function: Callable[[str], Any], module_codes: Iterable[str]) -> Dict[str, Any]:
+        """
+        Applies a function to every module code concurrently and returns the results keyed by module code
+
+        Duplicate module codes are only resolved once. An exception raised for any module code is raised again here,
+        after every other module code has been resolved.
+
+        Parameters
+        ----------
+        :param function:        The function that resolves a single module code, e.g. Parser.send_request
+        :param module_codes:    The module codes to resolve
+        """
+
+        module_codes = list(dict.fromkeys(module_codes))
+        if len(module_codes) <= 1:
+            return {code: function(code) for code in module_codes}
+
+        futures = {code: self._executor.submit(function, code) for code in module_codes}
+        results, error = {}, None
+        for code, future in futures.items():
+            try:
+                results[code] = future.result()
+            except Exception as e:
+                error = error if error else e
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def fetch_many(self, endpoint: str, year: str, module_codes: Iterable[str]) -> Dict[str, dict or None]:
+        """Fetches the documents of many modules from the module store concurrently"""
+
+        return self.map(lambda code: self.store.get(endpoint, year, code), module_codes)
+
+    def close(self):
+        """Waits for the requests in flight and shuts the thread pool down"""
+
+        self._executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    from mock_server import MockServer
+
+    # compare a serial crawl of every fixture module against a concurrent one, with 20ms of latency per request
+    with MockServer(latency=0.02) as mock, tempfile.TemporaryDirectory() as directory:
+        codes = list(mock.FIXTURES)[:100]
+
+        with ModuleStore(path=directory + "/serial.sqlite3") as store:
+            start = time.perf_counter()
+            for module in codes:
+                store.get(mock.endpoint, mock.YEAR, module)
+            print(f"Serial:     {len(codes)} modules in {time.perf_counter() - start:.2f}s")
+
+        with ModuleStore(path=directory + "/concurrent.sqlite3") as store, Fetcher(store) as fetcher:
+            start = time.perf_counter()
+            fetcher.fetch_many(mock.endpoint, mock.YEAR, codes)
+            print(f"Concurrent: {len(codes)} modules in {time.perf_counter() - start:.2f}s")
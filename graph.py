@@ -1,30 +1,64 @@
 import re
+import requests
+
+from array import array
 
 from utils import *
+from client import CLIENT, CircuitOpenError, ResilientClient
+from catalogue import Catalogue
+from catalogues import CATALOGUES
+from equivalence import PreclusionIndex
+from prereq import PrereqEngine
+from table import ModuleTable
+from metrics import METRICS, Metrics, timed
 from typing import *
 
 
 class ModuleGraph:
+    """
+    Dependency graph of modules, where an edge links a module to every module that it is a prerequisite of
+
+    Module codes are interned to integer ids, and the edges of every node are kept in two integer arrays, one for its
+    outgoing edges and one for its incoming edges, so that nodes and edges are added and removed in O(degree). For
+    whole-graph analysis, the graph is exported in compressed sparse row (CSR) form, which is cached until the graph
+    changes again.
+
+    The graph of a whole year is built in a single pass over the catalogue snapshot with ModuleGraph.from_catalogue.
+    Otherwise, the graph grows as modules are looked up, and modules missing from the snapshot are requested through
+    the shared client.CLIENT, with failures reported according to the alert level.
+    """
+
     API_ENDPOINT: str = "https://api.nusmods.com/v2/"
     YEAR: str = "2022-2023"
 
-    def __init__(self, endpoint: str, year: str):
-        try:
-            r = requests.get(endpoint)
-        except requests.ConnectionError | requests.HTTPError:
-            raise ValueError("There might be an error with your Internet Connection or with the API Endpoint input")
-        else:
-            if r.status_code == 200:
+    def __init__(self, endpoint: Optional[str] = None, year: Optional[str] = None,
+                 catalogue: Optional[Catalogue] = None, metrics: Optional[Metrics] = None,
+                 alert_level: ConnectionAlertLevel = ConnectionAlertLevel.LOG,
+                 client: Optional[ResilientClient] = None):
+        if endpoint is not None:
+            if isinstance(endpoint, str) and re.match(r"https?://\w*", endpoint):
                 self.API_ENDPOINT = endpoint
             else:
                 raise ValueError("Invalid URL")
 
-        if re.match(r"\d{4}-\d{4}", year):
-            self.YEAR = year
-        else:
-            raise ValueError(r"Year input does not match the required year input format (\d{4}-\d{4})")
+        if year is not None:
+            if re.match(r"\d{4}-\d{4}", year):
+                self.YEAR = year
+            else:
+                raise ValueError(r"Year input does not match the required year input format (\d{4}-\d{4})")
+
+        self.catalogue = catalogue if catalogue else CATALOGUES.get(self.YEAR)
+        self.metrics = metrics if metrics else METRICS
+        self.alert_level = alert_level
+        self.client = client if client else CLIENT
 
-        self.GRAPH: Dict[Module, List[Module]] = {}
+        self._ids: Dict[str, int] = {}
+        self._codes: List[str or None] = []
+        self._out: List[array] = []
+        self._in: List[array] = []
+        self._csr: Dict[bool, Tuple[array, array]] = {}
+        # ids of the nodes whose own prerequisites have been added, as a node can also be added as a prerequisite
+        self._expanded: Set[int] = set()
 
     def __str__(self):
         return str(self.GRAPH)
@@ -32,6 +66,42 @@ class ModuleGraph:
     def __repr__(self):
         return str(self.GRAPH)
 
+    def __contains__(self, module: Module or str):
+        return str(module) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    @classmethod
+    def from_catalogue(cls, catalogue: Catalogue) -> "ModuleGraph":
+        """
+        Builds the graph of every module in a catalogue in a single pass
+
+        Each module is linked from every module code found in its compiled prerequisite tree. Modules that are only
+        referenced by prerequisite trees are added as nodes as well. The graph shares the interned codes and ids of the
+        ModuleTable of the catalogue, so edges are copied over as ids without hashing any module code.
+        """
+
+        graph = cls(year=catalogue.year, catalogue=catalogue)
+
+        with graph.metrics.span("graph.from_catalogue", year=catalogue.year):
+            table = ModuleTable.of(catalogue)
+
+            # the modules of the catalogue come first in the table, so they keep the same ids in the graph
+            for code in table.codes[:len(table)]:
+                graph._intern(code)
+            graph._expanded.update(range(len(table)))
+
+            for destination in range(len(table)):
+                for origin in table.prerequisites(destination):
+                    if origin >= len(table):
+                        origin = graph._intern(table.code_of(origin))
+                    if origin != destination:
+                        graph._out[origin].append(destination)
+                        graph._in[destination].append(origin)
+
+        return graph
+
     # ----- Verifiers ----- #
     @staticmethod
     def parse_module_code(module_code: str):
@@ -39,13 +109,51 @@ class ModuleGraph:
 
         return re.match(r"[A-Z]{2,3}\d{4}[A-Z]{0,}", module_code)
 
+    def parse_error_codes(self, exception: Exception, logger_string: str):
+        """A function that parses the incoming exception according to the alert level set by the class"""
+
+        if self.alert_level == ConnectionAlertLevel.RAISE:
+            raise exception
+        elif self.alert_level == ConnectionAlertLevel.LOG:
+            print(logger_string)
+        elif self.alert_level == ConnectionAlertLevel.SUPPRESS:
+            pass
+
+    # ----- Interning ----- #
+    def _intern(self, module_code: str) -> int:
+        node = self._ids.get(module_code)
+        if node is None:
+            node = self._ids[module_code] = len(self._codes)
+            self._codes.append(module_code)
+            self._out.append(array("i"))
+            self._in.append(array("i"))
+            self._csr.clear()
+
+        return node
+
+    def id_of(self, module: Module or str) -> int or None:
+        """Returns the integer id of a module in the graph, or None if the module is not in the graph"""
+
+        return self._ids.get(str(module))
+
+    def code_of(self, node: int) -> str or None:
+        """Returns the module code of an integer id, or None if the module has been removed from the graph"""
+
+        return self._codes[node]
+
+    @property
+    def size(self) -> int:
+        """The number of ids handed out, including the ids of removed modules"""
+
+        return len(self._codes)
+
     # ----- Graph Building Functions ----- #
-    def add_module_node(self, module: Module):
+    def add_module_node(self, module: Module or str):
         """Adds a module as a Node in the Graph"""
-        if module not in self.GRAPH:
-            self.GRAPH[module] = []
 
-    def add_module_edge(self, module_origin: Module, module_destination: Module):
+        self._intern(str(module))
+
+    def add_module_edge(self, module_origin: Module or str, module_destination: Module or str):
         """
         Adds a module Edge in the graph, linking the origin module to the destination module
 
@@ -54,12 +162,88 @@ class ModuleGraph:
         in the list
         """
 
-        if module_origin is module_destination or module_origin == module_destination:
+        if module_origin is module_destination or str(module_origin) == str(module_destination):
             raise ValueError("Module cannot be associated with itself or with an equivalent module")
-        elif module_origin not in self.GRAPH:
-            self.GRAPH[module_origin] = [module_destination]
-        else:
-            self.GRAPH.get(module_origin).append(module_destination)
+
+        origin, destination = self._intern(str(module_origin)), self._intern(str(module_destination))
+        if destination not in self._out[origin]:
+            self._out[origin].append(destination)
+            self._in[destination].append(origin)
+            self._csr.clear()
+
+    def remove_module_edge(self, module_origin: Module or str, module_destination: Module or str):
+        """Removes the Edge linking the origin module to the destination module, if it is in the graph"""
+
+        origin, destination = self.id_of(module_origin), self.id_of(module_destination)
+        if origin is not None and destination is not None and destination in self._out[origin]:
+            self._out[origin].remove(destination)
+            self._in[destination].remove(origin)
+            self._csr.clear()
+
+    def remove_deeply_from_graph(self, module: Module or str):
+        """
+        Remove a particular module deeply from the graph if it is found in it
+
+        The module is removed from the edge arrays of its neighbours only, so the cost depends on the degree of the
+        module and not on the size of the graph
+        """
+
+        node = self._ids.pop(str(module), None)
+        if node is None:
+            return
+
+        for origin in self._in[node]:
+            self._out[origin].remove(node)
+        for destination in self._out[node]:
+            self._in[destination].remove(node)
+
+        self._codes[node] = None
+        self._expanded.discard(node)
+        self._out[node] = array("i")
+        self._in[node] = array("i")
+        self._csr.clear()
+
+    # ----- Graph Queries ----- #
+    @property
+    def GRAPH(self) -> Dict[Module, List[Module]]:
+        """The adjacency list of the graph, keyed by Module"""
+
+        return {Module(code): [Module(self._codes[d]) for d in self._out[self._ids[code]]] for code in self._ids}
+
+    def nodes(self) -> List[str]:
+        """Returns the module codes of every node in the graph"""
+
+        return list(self._ids)
+
+    def successors(self, module: Module or str) -> List[str]:
+        """Returns the module codes that a module is a direct prerequisite of"""
+
+        node = self.id_of(module)
+        return [self._codes[d] for d in self._out[node]] if node is not None else []
+
+    def predecessors(self, module: Module or str) -> List[str]:
+        """Returns the module codes that are direct prerequisites of a module"""
+
+        node = self.id_of(module)
+        return [self._codes[o] for o in self._in[node]] if node is not None else []
+
+    def csr(self, reverse: bool = False) -> Tuple[array, array]:
+        """
+        Returns the graph in compressed sparse row form, as a pair of integer arrays (offsets, targets)
+
+        The edges of the node with id i are targets[offsets[i]:offsets[i + 1]]. With reverse set, the incoming edges
+        are returned instead of the outgoing edges.
+        """
+
+        if reverse not in self._csr:
+            edges = self._in if reverse else self._out
+            offsets, targets = array("i", [0]), array("i")
+            for node_edges in edges:
+                targets.extend(node_edges)
+                offsets.append(len(targets))
+            self._csr[reverse] = (offsets, targets)
+
+        return self._csr[reverse]
 
     # ----- API Request and Parsing ----- #
     def send_request(self, module_code: str) -> dict or None:
@@ -71,12 +255,19 @@ class ModuleGraph:
         if not isinstance(module_code, str) and not self.parse_module_code(module_code):
             raise TypeError("Module Code must be a string, and match the format of a Module Code")
 
+        if self.catalogue is not None and (module_code in self.catalogue or self.catalogue.complete):
+            self.metrics.hit("catalogue")
+            return self.catalogue.get(module_code)
+        self.metrics.miss("catalogue")
+
         url = self.API_ENDPOINT + self.YEAR + "/modules/" + module_code + ".json"
 
         try:
-            r = requests.get(url)
+            r = self.client.get(url, endpoint=self.API_ENDPOINT)
             r.raise_for_status()
-        except requests.ConnectionError as e:
+        except CircuitOpenError as e:
+            self.parse_error_codes(e, f"API is unavailable, not sending requests for now. {e}")
+        except (requests.ConnectionError, requests.Timeout) as e:
             self.parse_error_codes(e, "Connection to API failed. Check your Internet connection and/or your "
                                       "API Endpoint")
         except requests.HTTPError as e:
@@ -84,70 +275,94 @@ class ModuleGraph:
         else:
             return r.json()
 
-    def get_tree(self, module: str):
-        if self.parse_module_code(module):
+    @timed("graph.get_tree")
+    def get_tree(self, module: str) -> dict:
+        """Returns the prerequisite tree, the preclusions and the corequisites of a module"""
+
+        if not self.parse_module_code(module):
+            raise ValueError("Module code is not in the correct format")
+
+        if self.catalogue is not None and module in self.catalogue:
+            prerequisite = PrereqEngine.of(self.catalogue).tree(module)
+        else:
             r = self.send_request(module)
-            all_modules = {
-                "prerequisite": None,
-                "preclusion": None,
-                "corequisite": self.get_corequisites(module)
-            }
+            prerequisite = r.get("prereqTree") if r is not None else None
+
+        return {
+            "prerequisite": prerequisite,
+            "preclusion": self.get_preclusions(Module(module), remove=False),
+            "corequisite": self.get_corequisites(module)
+        }
 
-    def get_corequisites(self, module: str):
+    def get_corequisites(self, module: str) -> Set[str]:
         """Returns the corequisites of a module"""
 
         if self.parse_module_code(module):
             r = self.send_request(module)
 
-            if "corequisite" in r.keys():
-                return set([mod for mod in self.parse_string(r.get("corequisite"))])
-        else:
-            raise ValueError("Module code is not in the correct format")
-
-    def get_prerequisites(self, module: str):
-        """Returns a list of prerequisites of an input module"""
-        # TODO
+            if r is not None and "corequisite" in r.keys():
+                return set(re.findall(MODULE_CODE_REGEX, r.get("corequisite")))
 
-        if self.parse_module_code(module):
-            pass
+            return set()
         else:
             raise ValueError("Module code is not in the correct format")
 
-    def get_preclusions(self, module: Module):
+    @timed("graph.get_prerequisites")
+    def get_prerequisites(self, module: str) -> List[str]:
         """
-        Returns a list of preclusions of an input module
+        Returns a list of the direct prerequisites of an input module
 
-        This is a BFS search for all the preclusions in the chain
+        If the prerequisites of the module have not been added to the graph yet, the module is added along with edges
+        from each of its prerequisites, even if it is already in the graph as the prerequisite of another module
         """
 
-        to_check = [module]
-        finalised = set()
-
-        while to_check:
-            curr_module = to_check.pop()
-            r = self.send_request(str(curr_module))
+        if not self.parse_module_code(module):
+            raise ValueError("Module code is not in the correct format")
 
-            if r is not None and "preclusion" in r.keys():
-                to_check.extend(r.get("preclusion"))
+        if self.id_of(module) not in self._expanded:
+            if self.catalogue is not None and module in self.catalogue:
+                prerequisites = PrereqEngine.flatten(PrereqEngine.of(self.catalogue).tree(module))
+            else:
+                r = self.send_request(module)
+                prerequisites = re.findall(MODULE_CODE_REGEX, r.get("prerequisite", "")) if r is not None else []
 
-            finalised.add(curr_module)
+            self.add_module_node(module)
+            for prerequisite in prerequisites:
+                if prerequisite != module:
+                    self.add_module_edge(prerequisite, module)
+            self._expanded.add(self.id_of(module))
 
-        # remove the preclusions from the graph completely
-        for mod in finalised:
-            self.remove_deeply_from_graph(mod)
+        return self.predecessors(module)
 
-        return finalised
-
-    def remove_deeply_from_graph(self, module: Module):
+    @timed("graph.get_preclusions")
+    def get_preclusions(self, module: Module, remove: bool = True):
         """
-        Remove a particular module deeply from the graph if it is found in it
+        Returns a list of preclusions of an input module, and removes them from the graph unless remove is unset
 
-        Node list takes precedence over the edge lists in the graph, and is checked first before the edges are checked
+        This is a lookup in the preclusion index of the catalogue snapshot if the module is in it, and
+        a BFS search for all the preclusions in the chain otherwise
         """
 
-        if module in self.GRAPH:
-            del self.GRAPH[module]
+        if self.catalogue is not None and str(module) in self.catalogue:
+            finalised = set(Module(code) for code in PreclusionIndex.of(self.catalogue).equivalents(str(module)))
+        else:
+            to_check = [str(module)]
+            finalised = set()
+
+            while to_check:
+                curr_module = Module(to_check.pop())
+                if curr_module in finalised:
+                    continue
 
-        for node in self.GRAPH:
-            if module in self.GRAPH[node]:
-                self.GRAPH[node].remove(module)
+                r = self.send_request(str(curr_module))
+                if r is not None and "preclusion" in r.keys():
+                    to_check.extend(re.findall(MODULE_CODE_REGEX, r.get("preclusion")))
+
+                finalised.add(curr_module)
+
+        # remove the preclusions from the graph completely
+        if remove:
+            for mod in finalised:
+                self.remove_deeply_from_graph(mod)
+
+        return finalised
@@ -0,0 +1,75 @@
+import os
+import re
+import sys
+import argparse
+import requests
+
+from client import CLIENT
+from store import ModuleStore
+from catalogue import Catalogue
+from closure import ClosureIndex
+from table import ModuleTable
+from mock_server import load_fixtures
+from typing import *
+
+
+API_ENDPOINT = "https://api.nusmods.com/v2/"
+YEAR = "2022-2023"
+
+
+def download(year: str, endpoint: str = API_ENDPOINT) -> List[dict]:
+    """
+    Downloads the details of every module offered in a year in a single request to moduleInfo.json
+    :return: List[dict]
+    """
+    r = CLIENT.get(endpoint + year + "/moduleInfo.json", endpoint=endpoint)
+    r.raise_for_status()
+    return r.json()
+
+def ingest(year: str, endpoint: str = API_ENDPOINT, directory: Optional[str] = None,
+           from_fixtures: bool = False, store: Optional[ModuleStore] = None) -> Catalogue:
+    """
+    Builds the catalogue snapshot of a year and writes it into the database directory, clearing the data derived from
+    earlier snapshots of the year from the module store kept alongside it (or from the given store)
+    :return: Catalogue
+    """
+    if from_fixtures:
+        catalogue = Catalogue.from_documents(year, load_fixtures().values(), complete=False)
+    else:
+        catalogue = Catalogue.from_documents(year, download(year, endpoint), complete=True)
+    catalogue.save(directory)
+    table = ModuleTable.of(catalogue)
+    catalogue.save_binary(table.codes, table.relations, directory)
+    # Anything derived from the previous snapshot of the year is stale now
+    path = os.path.join(directory, os.path.basename(ModuleStore.DATABASE)) if directory else ModuleStore.DATABASE
+    if store is not None:
+        store.clear_derived(year, keep=f"{year}:{catalogue.fingerprint}")
+    elif os.path.isfile(path):
+        with ModuleStore(path=path) as store:
+            store.clear_derived(year, keep=f"{year}:{catalogue.fingerprint}")
+    ClosureIndex.of(catalogue)
+    return catalogue
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Ingest a whole academic year of NUS modules into a local snapshot")
+    parser.add_argument("year", nargs="?", default=YEAR, help=f"academic year to ingest (default: {YEAR})")
+    parser.add_argument("--endpoint", default=API_ENDPOINT, help="API endpoint to download the catalogue from")
+    parser.add_argument("--directory", default=None, help="directory to write the snapshot into")
+    parser.add_argument("--from-fixtures", action="store_true",
+                        help="build the snapshot from the recorded modules in database/ instead of downloading it")
+    args = parser.parse_args(argv)
+
+    if not re.match(r"\d{4}-\d{4}", args.year):
+        parser.error(r"Year input does not match the required year input format (\d{4}-\d{4})")
+
+    try:
+        catalogue = ingest(args.year, args.endpoint, args.directory, args.from_fixtures)
+    except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+        print(f"Could not download the catalogue for {args.year}: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Ingested {len(catalogue)} modules into {Catalogue.path(args.year, args.directory)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,43 @@
 import re
 import sys
-import copy
+import tempfile
 import unittest
-import requests
+from utils import MODULE_CODE_REGEX
+from store import ModuleStore
+from fetch import Fetcher
+from catalogue import Catalogue
+from catalogues import CATALOGUES
+from equivalence import PreclusionIndex
+from prereq import PrereqEngine
 from typing import *
 
 class TestStringMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Serve the recorded modules in database/ locally instead of hitting the live API
+        from mock_server import MockServer
+        global API_ENDPOINT, STORE, FETCHER, CATALOGUE
+        cls.saved = (API_ENDPOINT, STORE, FETCHER, Catalogue.DIRECTORY)
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.server = MockServer()
+        cls.server.start()
+        API_ENDPOINT = cls.server.endpoint
+        STORE = ModuleStore(path=cls.directory.name + "/modules.sqlite3")
+        FETCHER = None
+        CATALOGUE = None
+        Catalogue.DIRECTORY = cls.directory.name
+
+    @classmethod
+    def tearDownClass(cls):
+        global API_ENDPOINT, STORE, FETCHER, CATALOGUE
+        if FETCHER is not None:
+            FETCHER.close()
+        STORE.close()
+        cls.server.stop()
+        cls.directory.cleanup()
+        API_ENDPOINT, STORE, FETCHER, Catalogue.DIRECTORY = cls.saved
+        CATALOGUE = None
+
     def test_set_year(self):
         global YEAR
         set_year("2019-2020")
@@ -68,6 +100,11 @@ class TestStringMethods(unittest.TestCase):
         # Test CS1010, which has no corequisites
         self.assertEqual(obtain_corequisites("CS1010"), set())
 
+    def test_is_module_code(self):
+        self.assertTrue(is_module_code("CS2040"))
+        self.assertFalse(is_module_code("XX1234"))
+        self.assertFalse(is_module_code("CS20"))
+
     def test_generate_modules(self):
         self.assertEqual(
             generate_modules({"CS1101S", "CS2030S"}),
@@ -86,39 +123,590 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(
             evaluate_modules(generate_modules({"CS2040S", "CS1101S"})),
             set({obtain_preclusions("CS1231S")}))
+
+    def test_client(self):
+        import requests
+        from unittest import mock
+        from client import CLIENT, CircuitBreaker, ResilientClient
+        # Stores share the client, and closing one store leaves it usable by the others
+        ModuleStore(path=":memory:").close()
+        self.assertIs(get_store().client, CLIENT)
+        self.assertIsNotNone(get_store().get(API_ENDPOINT, YEAR, "CS1010"))
+        # A trial request that fails with an unexpected error does not keep a half-open circuit from trying again
+        client = ResilientClient(retries=0, threshold=1, reset=0)
+        url = get_store().url(API_ENDPOINT, YEAR, "CS2040")
+        client.breaker(url).failure()
+        self.assertEqual(client.breaker(url).state, CircuitBreaker.HALF_OPEN)
+        with mock.patch.object(client.session, "get", side_effect=requests.exceptions.InvalidHeader):
+            self.assertRaises(requests.exceptions.InvalidHeader, client.get, url)
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(client.breaker(url).state, CircuitBreaker.CLOSED)
+        client.close()
+
+    def test_metrics(self):
+        import json
+        from metrics import Histogram, Metrics, timed
+        self.assertEqual(Histogram().quantile(0.5), 0.0)
+        path = f"{self.directory.name}/{type(self).__name__}.jsonl"
+        metrics = Metrics(trace=path)
+        for status, seconds in ((200, 0.002), (200, 0.02), ("ConnectionError", 0.5)):
+            metrics.request("api", status, seconds, "url")
+        metrics.hit("store")
+        metrics.miss("store")
+        metrics.miss("store")
+
+        class Resolver:
+            def __init__(self):
+                self.metrics = metrics
+
+            @timed("resolver.double")
+            def double(self, value: int) -> int:
+                return value * 2
+
+        with metrics.span("block", year=YEAR):
+            self.assertEqual(Resolver().double(2), 4)
+        metrics.close()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["requests"], {"api": {"200": 2, "ConnectionError": 1}})
+        # Quantiles are answered with the upper bound of the bucket they fall in, and never exceed the largest value
+        latency = snapshot["latency"]["api"]
+        self.assertEqual((latency["count"], latency["p50"], latency["p95"], latency["max"]), (3, 0.025, 0.5, 0.5))
+        self.assertAlmostEqual(latency["mean"], 0.174)
+        self.assertEqual((latency["buckets"]["le 0.0025"], latency["buckets"]["le 0.025"], latency["buckets"]["inf"]),
+                         (1, 1, 0))
+        self.assertEqual(snapshot["caches"]["store"], {"hits": 1, "misses": 2, "ratio": 1 / 3})
+        self.assertEqual((snapshot["spans"]["block"]["count"], snapshot["spans"]["resolver.double"]["count"]), (1, 1))
+        # Every request and span is traced, inner spans first as they end first
+        with open(path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([event["type"] for event in events], ["request"] * 3 + ["span"] * 2)
+        self.assertEqual({key: events[2][key] for key in ("endpoint", "url", "status", "duration")},
+                         {"endpoint": "api", "url": "url", "status": "ConnectionError", "duration": 0.5})
+        self.assertEqual((events[3]["name"], events[3]["args"]), ("resolver.double", [2]))
+        self.assertEqual((events[4]["name"], events[4]["year"]), ("block", YEAR))
+        self.assertTrue(all("time" in event for event in events))
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {"requests": {}, "caches": {}, "latency": {}, "spans": {}})
+
+    def test_store(self):
+        path = f"{self.directory.name}/{type(self).__name__}.sqlite3"
+        with ModuleStore(path=path) as store:
+            self.assertEqual(store.get(API_ENDPOINT, YEAR, "CS2040")["moduleCode"], "CS2040")
+            self.assertIsNone(store.get(API_ENDPOINT, YEAR, "XX1234"))
+            # Documents and unknown modules are both remembered, so asking again does not touch the network
+            requests = len(self.server.REQUESTS)
+            self.assertEqual(store.get(API_ENDPOINT, YEAR, "CS2040")["moduleCode"], "CS2040")
+            self.assertIsNone(store.get(API_ENDPOINT, YEAR, "XX1234"))
+            self.assertEqual(len(self.server.REQUESTS), requests)
+            # Clearing the derived data of a year keeps the data of the current snapshot only
+            store.put_derived("test", f"{YEAR}:old", {"CS2040": ["CS1010"]})
+            store.put_derived("test", f"{YEAR}:new", {"CS2040": ["CS1101S"]})
+            store.clear_derived(YEAR, keep=f"{YEAR}:new")
+            self.assertEqual(store.get_derived("test", f"{YEAR}:old"), {})
+            self.assertEqual(store.get_derived("test", f"{YEAR}:new"), {"CS2040": ["CS1101S"]})
+        # A store in offline mode only answers with what was stored before
+        with ModuleStore(path=path, offline=True) as store:
+            requests = len(self.server.REQUESTS)
+            self.assertEqual(store.get(API_ENDPOINT, YEAR, "CS2040")["moduleCode"], "CS2040")
+            self.assertIsNone(store.get(API_ENDPOINT, YEAR, "CS2030"))
+            self.assertEqual(len(self.server.REQUESTS), requests)
+
+class TestWithSnapshot(TestStringMethods):
+    # Run every test again with the recorded modules ingested, so the catalogue, index and engine paths are taken
+    @classmethod
+    def setUpClass(cls):
+        import ingest
+        super().setUpClass()
+        ingest.ingest(YEAR, directory=cls.directory.name, from_fixtures=True, store=STORE)
+
+    def test_snapshot_loaded(self):
+        self.assertIsNotNone(get_catalogue())
+        self.assertIn("CS1010", get_catalogue())
+
+    def test_catalogue(self):
+        mapped = Catalogue.load(YEAR, self.directory.name)
+        loaded = Catalogue.load(YEAR, self.directory.name, mapped=False)
+        self.assertIsNotNone(mapped.snapshot)
+        self.assertEqual(mapped.codes(), loaded.codes())
+        self.assertEqual(mapped.codes(), sorted(mapped.codes()))
+        self.assertEqual(mapped["CS2040"], loaded["CS2040"])
+        self.assertIsNone(mapped.get("XX1234"))
+        self.assertFalse(mapped.complete)
+        # Both forms of the same snapshot share a fingerprint, and a changed catalogue gets another one
+        self.assertEqual(mapped.fingerprint, loaded.fingerprint)
+        changed = Catalogue.from_documents(YEAR, [loaded[code] for code in loaded.codes() if code != "CS2040"])
+        self.assertNotEqual(changed.fingerprint, loaded.fingerprint)
+
+    def test_catalogues(self):
+        import gc
+        from catalogues import CatalogueManager
+        catalogue, manager = get_catalogue(), CatalogueManager(self.directory.name)
+        documents = [catalogue[code] for code in catalogue.codes()]
+        manager.add(Catalogue.from_documents("2021-2022", documents))
+        manager.add(Catalogue.from_documents("2020-2021", [dict(document, title="Changed")
+                                                          if document["moduleCode"] == "CS2040" else document
+                                                          for document in documents]))
+        # Unchanged modules are held once across the years, and the pool does not outlive the catalogues holding them
+        self.assertIs(manager.get("2021-2022")["CS1010"], manager.get("2020-2021")["CS1010"])
+        self.assertIsNot(manager.get("2021-2022")["CS2040"], manager.get("2020-2021")["CS2040"])
+        pooled = len(manager._pool)
+        manager.add(Catalogue.from_documents("2020-2021", documents))
+        gc.collect()
+        self.assertEqual(len(manager._pool), pooled - 1)
+        self.assertIs(manager.get("2021-2022")["CS2040"], manager.get("2020-2021")["CS2040"])
+        # Memory-mapped and JSON catalogues share documents, and values that are only equal in Python are not shared
+        self.assertIsNotNone(manager.get(YEAR).snapshot)
+        self.assertIs(manager.get(YEAR)["CS1010"], manager.get("2021-2022")["CS1010"])
+        for year, credits in (("2019-2020", int), ("2018-2019", float)):
+            manager.add(Catalogue.from_documents(year, [dict(document, moduleCredit=credits(document["moduleCredit"]))
+                                                        for document in documents]))
+        self.assertEqual(manager.get("2019-2020")["CS1010"], manager.get("2018-2019")["CS1010"])
+        self.assertIsNot(manager.get("2019-2020")["CS1010"], manager.get("2018-2019")["CS1010"])
+
+    def test_derived_caches(self):
+        import gc
+        import weakref
+        from route import RouteFinder
+        from clash import ClashDetector
+        from search import ModuleIndex
+        from requirements import RequirementEngine
+        catalogue = Catalogue.from_documents(YEAR, [get_catalogue()[code] for code in get_catalogue().codes()])
+        caches = (PreclusionIndex._INDEXES, PrereqEngine._ENGINES, ModuleIndex._INDEXES, RequirementEngine._ENGINES,
+                  RouteFinder._FINDERS, ClashDetector._DETECTORS)
+        for derived in (PreclusionIndex, PrereqEngine, ModuleIndex, RequirementEngine, RouteFinder, ClashDetector):
+            self.assertIs(derived.of(catalogue).catalogue, catalogue)
+        self.assertTrue(all(catalogue in cache for cache in caches))
+        # The cached objects do not keep their catalogue alive, so dropping the catalogue empties the caches
+        reference = weakref.ref(catalogue)
+        del catalogue
+        gc.collect()
+        self.assertIsNone(reference())
+        self.assertFalse(any(reference in cache.keyrefs() for cache in caches))
+
+    def test_snapshot(self):
+        snapshot = Catalogue.load(YEAR, self.directory.name).snapshot
+        self.assertEqual((snapshot.year, snapshot.complete), (YEAR, False))
+        record = snapshot.find("CS2040")
+        self.assertEqual(snapshot.code(record), "CS2040")
+        self.assertEqual(snapshot.document(record), get_catalogue()["CS2040"])
+        self.assertIsNone(snapshot.find("XX1234"))
+
+    def test_equivalence(self):
+        index = get_preclusion_index()
+        # CS1010 and CS1101S preclude each other, so they stand for each other
+        self.assertIn("CS1101S", index.equivalents("CS1010"))
+        self.assertEqual(index.class_id("CS1010"), index.class_id("CS1101S"))
+        # CS1010R precludes CS1010 but is not listed back, so it only stands for CS1010 one way
+        self.assertIn("CS1010", index.equivalents("CS1010R"))
+        self.assertNotIn("CS1010R", index.equivalents("CS1010"))
+        self.assertEqual(index.equivalents("XX1234"), frozenset({"XX1234"}))
+
+    def test_prereq(self):
+        engine = get_prereq_engine()
+        self.assertEqual(engine.tree("CS2040S"), ["and", [["or", ["MA1100", "CS1231"]], "CS1010"]])
+        self.assertIsNone(engine.tree("CS1010"))
+        # Any equivalent of a prerequisite fulfils it
+        self.assertTrue(engine.satisfied("CS2040S", ["CS1101S", "CS1231S"]))
+        self.assertFalse(engine.satisfied("CS2040S", ["CS1101S"]))
+        self.assertEqual(engine.satisfied_batch("CS2040S", [["CS1010", "MA1100"], ["MA1100"]]), [True, False])
+        self.assertEqual(engine.missing("CS2040S", ["CS1101S"]), [get_preclusion_index().equivalents("CS1231")
+                                                                   | get_preclusion_index().equivalents("MA1100")])
+
+    def test_prereq_wildcards(self):
+        documents = [dict(get_catalogue()[code]) for code in ("CS1010", "CS1231", "CS2040")]
+        trees = {"XX1000": {"and": ["CS1010", "ZZ10%:D"]}, "XX2000": {"or": ["ZZ10%:D"]},
+                 "XX3000": {"nOf": [2, ["CS1231:D", "ZZ10%:D", "CS10%:D"]]}}
+        documents += [{"moduleCode": code, "prereqTree": tree} for code, tree in trees.items()]
+        catalogue = Catalogue.from_documents(YEAR, documents)
+        # Wildcards that match no module are left out, and one that matches a single module stands for that module
+        engine = PrereqEngine.of(catalogue)
+        self.assertEqual(engine.tree("XX1000"), "CS1010")
+        self.assertIsNone(engine.tree("XX2000"))
+        self.assertEqual(engine.tree("XX3000"), ["nOf", 2, ["CS1231", "CS1010"]])
+        self.assertEqual(engine.groups("XX1000"), [PreclusionIndex.of(catalogue).equivalents("CS1010")])
+        self.assertEqual(engine.missing("XX2000", []), [])
+        # An engine built without a store caches its trees in the store of a later call
+        self.assertIsNone(engine.store)
+        self.assertIs(PrereqEngine.of(catalogue, STORE), engine)
+        self.assertIs(engine.store, STORE)
+        snapshot = f"{YEAR}:{catalogue.fingerprint}"
+        self.assertEqual(STORE.get_derived(PrereqEngine.TREES, snapshot)["XX1000"], "CS1010")
+
+    def test_graph(self):
+        from graph import ModuleGraph
+        graph = ModuleGraph.from_catalogue(get_catalogue())
+        self.assertEqual(graph.predecessors("CS2040"), ["CS1010"])
+        self.assertIn("CS2103T", graph.successors("CS2040"))
+        offsets, targets = graph.csr()
+        self.assertEqual(len(offsets), graph.size + 1)
+        self.assertEqual(len(targets), offsets[-1])
+
+    def test_table(self):
+        from table import ModuleTable
+        table = ModuleTable.of(get_catalogue())
+        self.assertEqual(len(table), len(get_catalogue()))
+        prerequisites = table.prerequisites(table.id_of("CS2040S"))
+        self.assertEqual(sorted(table.code_of(i) for i in prerequisites), ["CS1010", "CS1231", "MA1100"])
+        self.assertEqual([table.code_of(i) for i in table.corequisites(table.id_of("CS2101"))], ["CS2103T"])
+        # Modules that are only referenced get an id after every module of the catalogue
+        self.assertNotIn("CS1020", table)
+        self.assertGreaterEqual(table.id_of("CS1020"), len(table))
+        self.assertEqual(ModuleTable.of(Catalogue.load(YEAR, self.directory.name)).codes, table.codes)
+
+    def test_scheduler(self):
+        from scheduler import Scheduler, InfeasibleScheduleError
+        schedule = Scheduler(get_catalogue()).solve(["CS2040", "CS2030", "CS1010"])
+        self.assertLess(schedule.semester_of("CS1010"), schedule.semester_of("CS2040"))
+        self.assertLess(schedule.semester_of("CS1010"), schedule.semester_of("CS2030"))
+        self.assertEqual(schedule.mcs(schedule.semester_of("CS1010")), 4)
+        self.assertEqual(Scheduler(get_catalogue()).solve(["CS2040"], completed=["CS1101S"]).semester_of("CS2040"), 0)
+        with self.assertRaises(InfeasibleScheduleError) as context:
+            Scheduler(get_catalogue()).solve(["CS2040"])
+        self.assertEqual(list(context.exception.reasons), ["CS2040"])
+
+    def test_validator(self):
+        from validator import PlanValidator
+        validator = PlanValidator(get_catalogue())
+        self.assertEqual(validator.decode(validator.encode(["CS2040", "CS1010"])), ["CS1010", "CS2040"])
+        self.assertEqual(validator.valid([["CS1010", "CS2040"], ["CS2040"], []]), [True, False, True])
+        self.assertEqual(validator.validate([["CS2040"]]), [{get_preclusion_index().equivalents("CS1010")}])
+
+    def test_plan(self):
+        from plan import PlanState
+        plan = PlanState(get_catalogue(), ["CS2040", "CS2030"])
+        self.assertEqual(plan.blocked(), {"CS2040", "CS2030"})
+        # Adding CS1010 reports the modules it unblocks
+        self.assertEqual(plan.add("CS1010"), {"CS2040", "CS2030"})
+        self.assertTrue(plan.valid)
+        self.assertEqual(plan.remove("CS1010"), {"CS2040", "CS2030"})
+        self.assertEqual(plan.missing("CS2040"), [get_preclusion_index().equivalents("CS1010")])
+        plan.add("CS1101S", completed=True)
+        self.assertEqual(plan.blocked(), set())
+        self.assertEqual(plan.modules, ["CS2040", "CS2030"])
+
+    def test_analytics(self):
+        from analytics import CatalogueAnalytics
+        analytics = CatalogueAnalytics(get_catalogue())
+        rows = {row["code"]: row for row in analytics.table(workers=1)}
+        self.assertEqual((rows["CS1010"]["fan_in"], rows["CS1010"]["depth"]), (0, 0))
+        self.assertEqual((rows["CS2040"]["fan_in"], rows["CS2040"]["ancestors"], rows["CS2040"]["depth"]), (1, 1, 1))
+        self.assertGreater(rows["CS2040"]["descendants"], rows["CS2040"]["fan_out"])
+        # The searches split across worker processes add up to the same centrality as a single search
+        self.assertEqual([round(value, 6) for value in analytics.betweenness(workers=2, chunk_size=16)],
+                         [round(value, 6) for value in analytics.betweenness(workers=1)])
+
+    def test_evaluate_alternatives(self):
+        # CS2103T needs CS1020, CS2020, or both CS2030 and CS2040, so CS2030 alone is not enough
+        self.assertTrue(evaluate_modules(generate_modules({"CS1010", "CS2103T", "CS2030"})))
+        self.assertEqual(evaluate_modules(generate_modules({"CS1010", "CS2103T", "CS2030", "CS2040"})), set())
+        self.assertEqual([bool(missing) for missing in evaluate_plans([["CS1010", "CS2103T", "CS2030"],
+                                                                       ["CS1010", "CS2103T", "CS2030", "CS2040"]])],
+                         [True, False])
+
+    def test_batch(self):
+        import io
+        from batch import parse_plan, read_plans, run
+        plan = {"id": "1", "modules": ["CS1010", "CS2040"], "completed": []}
+        self.assertEqual(parse_plan([" cs1010", "CS2040"], 0), plan)
+        self.assertEqual(parse_plan({"id": 2, "modules": ["CS2040"], "completed": ["cs1010"]}, 0),
+                         {"id": "2", "modules": ["CS2040"], "completed": ["CS1010"]})
+        self.assertRaises(ValueError, parse_plan, {"id": "1"}, 0)
+        # The format is guessed from the content, and a single JSON line is a plan of its own
+        for text in ('[["CS1010", "CS2040"]]', '{"plans": [{"modules": ["CS1010", "CS2040"]}]}',
+                     '{"modules": ["CS1010", "CS2040"]}\n', '{"modules": ["CS1010", "CS2040"]}\n{"modules": []}\n',
+                     'id,modules\n1,"CS1010 CS2040"\n'):
+            self.assertEqual(read_plans(io.StringIO(text))[0], plan)
+        self.assertEqual(len(read_plans(io.StringIO('{"modules": ["CS1010"]}\n{"modules": []}'), "jsonl")), 2)
+        self.assertRaises(ValueError, read_plans, io.StringIO("id,codes\n1,CS1010\n"))
+        # Results come back in the order of the plans
+        results = list(run([plan, parse_plan(["CS2040", "XX1234"], 1)], YEAR, self.directory.name, workers=1))
+        self.assertEqual([(result["id"], result["valid"]) for result in results], [("1", True), ("2", False)])
+        self.assertEqual(results[0]["schedule"][:2], [["CS1010"], ["CS2040"]])
+        self.assertEqual(results[1]["unknown"], ["XX1234"])
+        self.assertEqual(list(results[1]["missing"]), ["CS2040"])
+
+    def test_service(self):
+        import time
+        import asyncio
+        import requests
+        from service import QueryService
+        with QueryService(port=0, directory=self.directory.name, endpoint=API_ENDPOINT, store=STORE) as service, \
+                requests.Session() as session:
+            def call(method: str, path: str, **kwargs) -> Tuple[int, Any]:
+                response = session.request(method, service.url + path, **kwargs)
+                return response.status_code, response.json()
+
+            self.assertEqual(call("GET", "health"), (200, {"status": "ok", "years": []}))
+            status, document = call("GET", f"{YEAR}/modules/CS2040")
+            self.assertEqual((status, document["moduleCode"]), (200, "CS2040"))
+            status, prerequisites = call("GET", f"{YEAR}/prerequisites/CS2040")
+            self.assertEqual((status, prerequisites["direct"]), (200, ["CS1010"]))
+            self.assertEqual(call("GET", f"{YEAR}/modules/XX1234")[0], 404)
+            self.assertEqual(call("GET", "nowhere")[0], 404)
+            self.assertEqual(call("GET", f"{YEAR}/validate")[0], 405)
+            # Plans are validated against the snapshot, which other years are missing
+            status, answer = call("POST", f"{YEAR}/validate", json={"plans": [["CS1010", "CS2040"], ["CS2040"]]})
+            self.assertEqual((status, [result["valid"] for result in answer["results"]]), (200, [True, False]))
+            self.assertEqual(call("POST", "2000-2001/validate", json={"plans": []})[0], 404)
+            status, answer = call("POST", f"{YEAR}/schedule", json={"modules": ["CS2040"], "completed": ["CS1010"]})
+            self.assertEqual((status, answer["semesters"][0]), (200, ["CS2040"]))
+            # Malformed bodies, and plans holding anything but module codes, are rejected
+            for path, body in (("validate", {"plans": [["CS2040", 1]]}), ("validate", {"plans": [[["CS2040"]]]}),
+                               ("validate", {"plans": "CS2040"}), ("schedule", {"modules": [2040]})):
+                self.assertEqual(call("POST", f"{YEAR}/{path}", json=body)[0], 400)
+            self.assertEqual(call("POST", f"{YEAR}/validate", data=b"{")[0], 400)
+
+            # Identical requests made while the first one is computed wait for its result instead of computing it
+            calls = []
+
+            def compute(value: int) -> int:
+                calls.append(value)
+                time.sleep(0.05)
+                return value
+
+            async def coalesce() -> list:
+                return await asyncio.gather(*(service._coalesce("key", compute, 1) for _ in range(3)))
+
+            computed, coalesced = service.COMPUTED, service.COALESCED
+            self.assertEqual(asyncio.run_coroutine_threadsafe(coalesce(), service._loop).result(), [1, 1, 1])
+            self.assertEqual((len(calls), service.COMPUTED - computed, service.COALESCED - coalesced), (1, 1, 2))
+
+    def test_search(self):
+        index = get_module_index()
+        self.assertEqual(index.title("CS2040"), "Data Structures and Algorithms")
+        self.assertIsNone(index.title("XX1234"))
+        self.assertEqual(index.codes_with_prefix("cs204"), ["CS2040", "CS2040C", "CS2040S"])
+        self.assertEqual(index.codes_with_prefix("CS10", 3), ["CS1010", "CS1010E", "CS1010J"])
+        self.assertEqual(index.codes_with_prefix("ZZ"), [])
+        # Every word of a title prefix must be in the title, and the last one may be cut short
+        self.assertEqual(index.titles_with_prefix("data struct"), ["CS2040", "CS2040C", "CS2040S"])
+        self.assertEqual(index.titles_with_prefix("structures algor"), ["CS2040", "CS2040C", "CS2040S"])
+        self.assertEqual(index.titles_with_prefix(" "), [])
+        # Mistyped codes fall back to the closest codes of the same subject
+        self.assertEqual(index.fuzzy("CS1O10")[0], "CS1010")
+        self.assertIn("CS2040", index.fuzzy("CS2400"))
+        self.assertEqual(index.fuzzy(""), [])
+        self.assertEqual(index.complete("cs204"), ["CS2040", "CS2040C", "CS2040S"])
+        self.assertIn("CS3230", index.complete("algor"))
+        self.assertEqual(index.complete("CS1O10", 1), ["CS1010"])
+
+    def test_requirements(self):
+        engine = get_requirement_engine()
+        name = "Focus Area: Artificial Intelligence"
+        # The level-4000 primary counts towards the three primaries, instead of needing a fourth module
+        result = engine.evaluate(["CS2109S", "CS3243", "CS4243"], [name])[name]
+        self.assertTrue(result.satisfied)
+        self.assertEqual(sorted(result.rules[0].used), ["CS2109S", "CS3243", "CS4243"])
+        # Three primaries without a level-4000 one do not satisfy the focus area
+        result = engine.evaluate(["CS2109S", "CS3243", "CS3244"], [name])[name]
+        self.assertFalse(result.satisfied)
+        self.assertEqual(result.rules[0].constraints[0].missing, ["CS4243", "CS4244", "CS4246", "CS4248"])
+
+    def test_clash(self):
+        import ingest
+        from clash import ClashDetector
+        self.assertEqual([clash.modules for clash in ClashDetector(get_catalogue()).clashes(["CS1010", "CS2030"], 1)],
+                         [("CS1010", "CS2030")])
+        # moduleInfo.json leaves the lessons out, so they are fetched from the module documents, or reported missing
+        condensed = Catalogue.from_documents(YEAR, ingest.download(YEAR, API_ENDPOINT))
+        self.assertNotIn("timetable", condensed["CS1010"]["semesterData"][0])
+        self.assertEqual(ClashDetector(condensed).clashes(["CS1010", "CS2030"], 1), [])
+        self.assertEqual(ClashDetector(condensed).missing_lessons(["CS1010", "CS2030"], 1), ["CS1010", "CS2030"])
+        detector = ClashDetector(condensed, STORE, API_ENDPOINT)
+        self.assertEqual([clash.modules for clash in detector.clashes(["CS1010", "CS2030"], 1)], [("CS1010", "CS2030")])
+        self.assertEqual(detector.missing_lessons(["CS1010", "CS2030"], 1), [])
+
+    def test_parser_close(self):
+        from lib_reworked import Parser
+        with Parser(endpoint=API_ENDPOINT, store=STORE) as first:
+            adapter = STORE.session.get_adapter(API_ENDPOINT)
+            with Parser(endpoint=API_ENDPOINT, store=STORE) as second:
+                self.assertEqual(first.prerequisite("CS2040"), second.prerequisite("CS2040"))
+                # Both parsers share the connection pool of the store
+                self.assertIs(STORE.session.get_adapter(API_ENDPOINT), adapter)
+        # Closing the parsers stops their threads, and leaves the store they were given open
+        self.assertTrue(first.fetcher._executor._shutdown)
+        self.assertIsNotNone(STORE.get(API_ENDPOINT, YEAR, "CS2040"))
+
+    def test_closure(self):
+        import os
+        from closure import ClosureIndex
+        catalogue = get_catalogue()
+        self.assertTrue(ClosureIndex.of(catalogue).is_ancestor("CS1010", "CS2040"))
+        self.assertTrue(os.path.isfile(ClosureIndex.path(catalogue)))
+        # A catalogue that was never saved is not answered from the index persisted for another snapshot of the year
+        documents = [{key: value for key, value in catalogue[code].items() if key not in ("prerequisite", "prereqTree")}
+                     if code == "CS2040" else catalogue[code] for code in catalogue.codes()]
+        edited = Catalogue.from_documents(YEAR, documents)
+        self.assertIsNone(ClosureIndex.path(edited))
+        self.assertFalse(ClosureIndex.of(edited).is_ancestor("CS1010", "CS2040"))
+
+    def test_route(self):
+        from route import RouteFinder
+        catalogue, engine = get_catalogue(), get_prereq_engine()
+        # CS1020 is not in the catalogue, so CS2103T is unlocked through CS2030 and CS2040 instead
+        route = RouteFinder.of(catalogue).route("CS2103T")
+        self.assertEqual(route.modules, ["CS1010", "CS2030", "CS2040", "CS2103T"])
+        taken = set()
+        for semester in route.semesters:
+            self.assertTrue(all(code in catalogue and engine.satisfied(code, taken) for code in semester))
+            taken.update(semester)
  
 YEAR = "2022-2023"
+API_ENDPOINT = "https://api.nusmods.com/v2/"
+STORE = None
+FETCHER = None
+CATALOGUE = None
 
 class Or:
+    __slots__ = ("preclus", "_hash")
+
     def __init__(self, preclus: FrozenSet[str] = frozenset()):
-        self.preclus = frozenset(preclus)
+        self.preclus = frozenset(sys.intern(code) for code in preclus)
+        self._hash = hash(self.preclus)
 
     def __eq__(self, other):
         return self.preclus == other.preclus
 
     def __hash__(self):
-        return hash(self.preclus)
+        return self._hash
 
 class Module:
-    def __init__(self, code: str, prereqs: Set[Or] = set(), preclus = Or, coreqs: Set[str] = set()):
-        self.code = code
-        self.prereqs = prereqs
-        self.preclus = preclus
-        self.coreqs = coreqs
+    # Fields left out of a lazy module are resolved with obtain_prerequisites, obtain_preclusions and
+    # obtain_corequisites on first access, and memoised
+    __slots__ = ("code", "_prereqs", "_preclus", "_coreqs", "_hash")
+
+    FIELDS = ("prereqs", "preclus", "coreqs")
+
+    def __init__(self, code: str, prereqs: Optional[Set[Or]] = None, preclus: Optional[Or] = None,
+                 coreqs: Optional[Set[str]] = None, lazy: bool = False):
+        self.code = sys.intern(code)
+        self._prereqs = None if lazy and prereqs is None else frozenset(prereqs) if prereqs else frozenset()
+        self._preclus = None if lazy and preclus is None else preclus if preclus is not None else Or()
+        self._coreqs = None if lazy and coreqs is None else \
+            frozenset(sys.intern(code) for code in coreqs) if coreqs else frozenset()
+        self._hash = hash(self.code)
 
     def __eq__(self, other):
         return self.code == other.code
 
     def __hash__(self):
-        return hash(self.code)
+        return self._hash
+
+    @property
+    def prereqs(self) -> FrozenSet[Or]:
+        if self._prereqs is None:
+            self._prereqs = frozenset(obtain_prerequisites(self.code))
+        return self._prereqs
+
+    @property
+    def preclus(self) -> Or:
+        if self._preclus is None:
+            preclus = obtain_preclusions(self.code)
+            self._preclus = preclus if isinstance(preclus, Or) else Or()
+        return self._preclus
+
+    @property
+    def coreqs(self) -> FrozenSet[str]:
+        if self._coreqs is None:
+            self._coreqs = frozenset(sys.intern(code) for code in obtain_corequisites(self.code))
+        return self._coreqs
 
 def set_year(current_year) -> None:
     """
     Sets the year of NUS modules to explore
     :return: None
     """
-    global YEAR
+    global YEAR, CATALOGUE
     YEAR = current_year
+    CATALOGUE = None
+
+def get_store() -> ModuleStore:
+    """
+    Returns the module store shared by the functions in this module, opening it on first use
+    :return: ModuleStore
+    """
+    global STORE
+    if STORE is None:
+        STORE = ModuleStore()
+    return STORE
+
+def get_catalogue() -> Catalogue or None:
+    """
+    Returns the catalogue snapshot of the current year, loaded once per year and kept alongside the other years
+    :return: Catalogue or None, if the year has not been ingested
+    """
+    global CATALOGUE
+    if CATALOGUE is None or CATALOGUE.year != YEAR:
+        CATALOGUE = CATALOGUES.get(YEAR)
+    return CATALOGUE
+
+def get_preclusion_index() -> PreclusionIndex or None:
+    """
+    Returns the preclusions of every module of the current year, built once from the catalogue snapshot
+    :return: PreclusionIndex or None, if the year has not been ingested
+    """
+    catalogue = get_catalogue()
+    return PreclusionIndex.of(catalogue) if catalogue is not None else None
+
+def get_prereq_engine() -> PrereqEngine or None:
+    """
+    Returns the compiled prerequisite trees of the current year, compiled once from the catalogue snapshot
+    :return: PrereqEngine or None, if the year has not been ingested
+    """
+    catalogue = get_catalogue()
+    return PrereqEngine.of(catalogue, get_store()) if catalogue is not None else None
+
+def get_module_index() -> "ModuleIndex or None":
+    """
+    Returns the prefix index over the module codes and titles of the current year, built once from the catalogue
+    snapshot
+    :return: ModuleIndex or None, if the year has not been ingested
+    """
+    from search import ModuleIndex
+    catalogue = get_catalogue()
+    return ModuleIndex.of(catalogue) if catalogue is not None else None
+
+def get_requirement_engine() -> "RequirementEngine or None":
+    """
+    Returns the degree requirements of every programme in defaults.PROGRAMMES, compiled once against the catalogue
+    snapshot of the current year
+    :return: RequirementEngine or None, if the year has not been ingested
+    """
+    from requirements import RequirementEngine
+    catalogue = get_catalogue()
+    return RequirementEngine.of(catalogue) if catalogue is not None else None
+
+def is_module_code(module_code) -> bool:
+    """
+    Returns whether a module exists in the current year, answered from the catalogue snapshot when it has the module
+    :return: bool
+    """
+    index = get_module_index()
+    if index is not None and (module_code in index or get_catalogue().complete):
+        return module_code in index
+    return re.fullmatch(MODULE_CODE_REGEX, module_code) is not None and fetch_module(module_code) is not None
+
+def fetch_module(module_code) -> dict or None:
+    """
+    Returns the API document of a module for the current year, or None if the module does not exist
+    :return: dict or None
+    """
+    catalogue = get_catalogue()
+    if catalogue is not None and (module_code in catalogue or catalogue.complete):
+        return catalogue.get(module_code)
+    return get_store().get(API_ENDPOINT, YEAR, module_code)
+
+def fetch_modules(module_codes) -> Dict[str, dict or None]:
+    """
+    Returns the API documents of many modules for the current year keyed by module code, fetching them concurrently
+    :return: Dict[str, dict or None]
+    """
+    global FETCHER
+    if FETCHER is None:
+        FETCHER = Fetcher(get_store())
+    return FETCHER.map(fetch_module, module_codes)
 
 def parse_string(string) -> List[str]:
     """
@@ -132,38 +720,35 @@ def obtain_prerequisites(module_code) -> Set[Or]:
     Returns a set of all prerequisites for a certain module or its equivalents
     :return: Set[Or]
     """
-    prereqs = set()
-    r = requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{module_code}.json")
-    if r.status_code == 404:
+    catalogue = get_catalogue()
+    if catalogue is not None and (module_code in catalogue or catalogue.complete):
+        # Read the groups off the compiled prerequisite trees of the module and its equivalents
+        if module_code not in catalogue:
+            return set()
+        engine = get_prereq_engine()
+        return {Or(group) for mod in get_preclusion_index().equivalents(module_code) for group in engine.groups(mod)}
+    r = fetch_module(module_code)
+    if r is None:
         return set()
-    # Obtain the prerequisites directly from the module
-    if "prerequisite" in r.json().keys():
-        for mod in parse_string(r.json()["prerequisite"]):
-            for or_set in prereqs:
-                if mod in or_set.preclus:
-                    continue
-            mod_preclus = obtain_preclusions(mod)
-            if not mod_preclus:
-                continue
-            prereqs.add(mod_preclus)
-    # From all the equivalents, obtain the prerequisites
+    # Obtain the prerequisites directly from the module, and from all of its equivalents
+    modules = {module_code: r}
     equivalents = obtain_preclusions(module_code)
     if equivalents:
-        equivalents = set(equivalents.preclus)
-        while equivalents:
-            current_working_module = equivalents.pop()
-            s = requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{current_working_module}.json")
-            if s.status_code == 404:
-                continue
-            if "prerequisite" in s.json().keys():
-                for mod in parse_string(s.json()["prerequisite"]):
-                    for or_set in prereqs:
-                        if mod in or_set.preclus:
-                            continue
-                    mod_preclus = obtain_preclusions(mod)
-                    if not mod_preclus:
-                        continue
-                    prereqs.add(mod_preclus)
+        modules.update(fetch_modules(equivalents.preclus - {module_code}))
+    prerequisite_codes = []
+    for s in modules.values():
+        if s is not None and "prerequisite" in s.keys():
+            prerequisite_codes.extend(parse_string(s["prerequisite"]))
+    # Warm up every prerequisite in parallel before resolving their preclusions
+    fetch_modules(prerequisite_codes)
+    prereqs = set()
+    for mod in dict.fromkeys(prerequisite_codes):
+        if any(mod in or_set.preclus for or_set in prereqs):
+            continue
+        mod_preclus = obtain_preclusions(mod)
+        if not mod_preclus:
+            continue
+        prereqs.add(mod_preclus)
     return prereqs
 
 def obtain_preclusions(module_code) -> Or:
@@ -171,28 +756,26 @@ def obtain_preclusions(module_code) -> Or:
     Returns a set of all preclusions, or equivalents, of a module
     :return: Or
     """
-    r = requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{module_code}.json")
-    if r.status_code == 404:
+    catalogue = get_catalogue()
+    if catalogue is not None and (module_code in catalogue or catalogue.complete):
+        # The preclusions of the whole year are computed once, so this is a single lookup
+        if module_code not in catalogue:
+            return set()
+        return Or(get_preclusion_index().equivalents(module_code))
+    r = fetch_module(module_code)
+    if r is None:
         return set()
     explored = {module_code}
-    if "preclusion" in r.json().keys():
-        action_set = set()
-        for mod in parse_string(r.json()["preclusion"]):
-            action_set.add(mod)
-        # Search for additional preclusions in action_set till depleted
+    if "preclusion" in r.keys():
+        action_set = set(parse_string(r["preclusion"])) - explored
+        # Search for additional preclusions in action_set till depleted, fetching one level at a time in parallel
         while action_set:
-            current_working_module = action_set.pop()
-            if current_working_module in explored:
-                continue
-            explored.add(current_working_module)
-            s = requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{current_working_module}.json")
-            if s.status_code == 404:
-                continue
-            if "preclusion" in s.json().keys():
-                for mod in parse_string(s.json()["preclusion"]):
-                    if mod in explored:
-                        continue
-                    action_set.add(mod)
+            explored.update(action_set)
+            found = set()
+            for s in fetch_modules(action_set).values():
+                if s is not None and "preclusion" in s.keys():
+                    found.update(parse_string(s["preclusion"]))
+            action_set = found - explored
     return Or(explored)
 
 def obtain_corequisites(module_code) -> Set[str]:
@@ -200,29 +783,49 @@ def obtain_corequisites(module_code) -> Set[str]:
     Returns a set of all corequisites of a module
     :return: Set[str]
     """
-    r = requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{module_code}.json")
-    if r.status_code == 404:
+    r = fetch_module(module_code)
+    if r is None:
         return set()
     coreqs = set()
-    if "corequisite" in r.json().keys():
-        for mod in parse_string(r.json()["corequisite"]):
+    if "corequisite" in r.keys():
+        for mod in parse_string(r["corequisite"]):
             coreqs.add(mod)
     # Corequisite modules are much stricter and may not allow equivalents, hence we only use direct results
     return coreqs
 
-def generate_modules(module_list) -> Set[Module]:
+def generate_modules(module_list, fields=()) -> Set[Module]:
+    """
+    Generates a final set of modules from a set of module codes. The fields of every module (out of Module.FIELDS)
+    are resolved on first access, except for the fields given, which are resolved up front for every module at once
+    :return: Set[Module]
+    """
+    module_set = {Module(code=mod, lazy=True) for mod in module_list}
+    resolve_modules(module_set, Module.FIELDS if fields is None else fields)
+    return module_set
+
+def resolve_modules(module_set, fields=Module.FIELDS) -> Set[Module]:
     """
-    Generates a final set of modules from a set of module codes
+    Resolves fields of many lazy modules at once, fetching the modules, and the modules their fields depend on, in
+    one parallel batch per level instead of one module at a time
     :return: Set[Module]
     """
-    module_set = set()
-    for mod in module_list:
-        module_set.add(
-            Module(
-                code = mod,
-                prereqs = obtain_prerequisites(mod),
-                preclus = obtain_preclusions(mod),
-                coreqs = obtain_corequisites(mod)))
+    pending = {field: [mod for mod in module_set if getattr(mod, "_" + field) is None] for field in fields}
+    codes = {mod.code for mods in pending.values() for mod in mods}
+    if not codes:
+        return module_set
+    catalogue = get_catalogue()
+    if catalogue is None or not catalogue.complete:
+        documents = fetch_modules(codes)
+        if pending.get("prereqs"):
+            # Warm up every module named in the prerequisites or preclusions of the modules in a single batch
+            named = set()
+            for r in documents.values():
+                if r is not None:
+                    named.update(parse_string(r.get("prerequisite", "") + " " + r.get("preclusion", "")))
+            fetch_modules(named - codes)
+    for field, mods in pending.items():
+        for mod in mods:
+            getattr(mod, field)
     return module_set
 
 def evaluate_modules(module_set) -> Set[Or]:
@@ -232,22 +835,43 @@ def evaluate_modules(module_set) -> Set[Or]:
     the sets of missing prerequisites
     :return: Set[Or]
     """
-    working_set = copy.deepcopy(module_set)
+    engine = get_prereq_engine()
+    if engine is not None:
+        # Evaluate the compiled prerequisite trees themselves, so that alternatives such as one of two pairs of
+        # modules are honoured, and only fall back to the groups of modules missing from the snapshot
+        catalogue = get_catalogue()
+        taken = {mod.code for mod in module_set}
+        missing = set()
+        for current_module in module_set:
+            if current_module.code in catalogue:
+                missing.update(Or(group) for group in engine.missing(current_module.code, taken))
+                continue
+            for or_set in current_module.prereqs:
+                if taken.isdisjoint(or_set.preclus):
+                    missing.add(or_set)
+        return missing
+    taken = {mod.code for mod in module_set}
     missing = set()
-    while working_set:
-        current_module = working_set.pop()
-        current_prerequisites = current_module.prereqs
-        for or_set in current_prerequisites:
-            in_set = False
+    for current_module in module_set:
+        for or_set in current_module.prereqs:
             # Check if every Or in the prerequisite is fulfilled
-            for prereq in or_set.preclus:
-                for mod in module_set:
-                    if mod.code == prereq:
-                        in_set = True
-            if not in_set:
+            if taken.isdisjoint(or_set.preclus):
                 missing.add(or_set)
     return missing
 
+def evaluate_plans(plans) -> List[Set[Or]]:
+    """
+    Evaluates many plans at once, each given as a collection of module codes.
+    For every plan, list and return all the sets of missing prerequisites,
+    which is empty if the plan is valid
+    :return: List[Set[Or]]
+    """
+    from validator import PlanValidator
+    catalogue = get_catalogue()
+    if catalogue is None:
+        return [evaluate_modules(generate_modules(plan)) for plan in plans]
+    return [{Or(group) for group in groups} for groups in PlanValidator(catalogue).validate(list(plans))]
+
 def add_module_code(query) -> Set[str]:
     """
     Generates a set of valid module code strings from user input
@@ -265,10 +889,12 @@ def add_module_code(query) -> Set[str]:
             modules.remove(x)
             print(f"Removed {x}")
         else:
-            if requests.get(f"https://api.nusmods.com/v2/{YEAR}/modules/{x}.json").status_code == 200:
+            if is_module_code(x):
                 modules.add(x)
             else:
-                print("Unrecognised module")
+                index = get_module_index()
+                suggestions = index.complete(x, 5) if index is not None else []
+                print("Unrecognised module" + (f", did you mean {', '.join(suggestions)}?" if suggestions else ""))
     return modules
 
 if __name__ == "__main__":
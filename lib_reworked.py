@@ -2,6 +2,15 @@ import re
 import requests
 
 from utils import *
+from client import CircuitOpenError
+from store import ModuleStore
+from metrics import METRICS, Metrics, timed
+from fetch import Fetcher
+from catalogue import Catalogue
+from catalogues import CATALOGUES
+from equivalence import PreclusionIndex
+from prereq import PrereqEngine
+from closure import ClosureIndex
 from typing import *
 
 
@@ -10,10 +19,34 @@ class Parser:
     YEAR: str = "2022-2023"
 
     def __init__(self, year: Optional[str] = None, endpoint: Optional[str] = None,
-                 alert_level: ConnectionAlertLevel = ConnectionAlertLevel.LOG):
+                 alert_level: ConnectionAlertLevel = ConnectionAlertLevel.LOG, store: Optional[ModuleStore] = None,
+                 offline: Optional[bool] = None, catalogue: Optional[Catalogue] = None,
+                 metrics: Optional[Metrics] = None):
         self.YEAR = self.YEAR if (not year and not isinstance(year, str)) else year
         self.API_ENDPOINT = self.API_ENDPOINT if (not endpoint and not isinstance(endpoint, str)) else endpoint
         self.alert_level = alert_level
+        self.metrics = metrics if metrics else METRICS
+        self.store = store if store else ModuleStore(offline=offline, metrics=self.metrics)
+        self.fetcher = Fetcher(self.store)
+        # a store passed in belongs to the caller, and is left open by close
+        self._owns_store = store is None
+        self.catalogue = catalogue if catalogue else CATALOGUES.get(self.YEAR)
+        # module codes whose last request failed, whose data is missing from anything resolved since
+        self.failed: Set[str] = set()
+        self._circuit_reported: Optional[float] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Shuts the fetch threads of the parser down, and closes its module store if the parser created it"""
+
+        self.fetcher.close()
+        if self._owns_store:
+            self.store.close()
 
     @property
     def year(self):
@@ -27,6 +60,7 @@ class Parser:
 
         if isinstance(v, str) and re.match(r"\d{4}-\d{4}", v):
             self.YEAR = v
+            self.catalogue = CATALOGUES.get(v)
         else:
             raise TypeError(f"Cannot set year to {v}")
 
@@ -40,7 +74,7 @@ class Parser:
     def endpoint(self, v: str):
         """Sets the value of the global API endpoint for the running instance of the Parser"""
 
-        if isinstance(v, str) and re.match(r"https://\w*", v):
+        if isinstance(v, str) and re.match(r"https?://\w*", v):
             self.API_ENDPOINT = v
         else:
             raise TypeError(f"Cannot set API Endpoint to {v}")
@@ -79,112 +113,220 @@ class Parser:
         """
         Public method that sends a request to the API endpoint with a specific module and returns a Python dictionary
         containing the details of the request
+
+        Modules in the catalogue snapshot of the year are answered from the snapshot. Other requests go through the
+        module store of the Parser, so each module is only fetched from the network once, and failed requests are
+        retried by its client. Requests that still fail are reported according to the alert level and recorded in
+        failed, and an open circuit breaker is only reported once every time it opens
         """
 
         if not isinstance(module_code, str) and not self.parse_module_code(module_code):
             raise TypeError("Module Code must be a string, and match the format of a Module Code")
 
-        url = self.API_ENDPOINT + self.YEAR + "/modules/" + module_code + ".json"
+        if self.catalogue is not None and (module_code in self.catalogue or self.catalogue.complete):
+            self.metrics.hit("catalogue")
+            return self.catalogue.get(module_code)
+
+        self.metrics.miss("catalogue")
+        url = self.store.url(self.API_ENDPOINT, self.YEAR, module_code)
 
         try:
-            r = requests.get(url)
-            r.raise_for_status()
-        except requests.ConnectionError as e:
+            r = self.store.get(self.API_ENDPOINT, self.YEAR, module_code)
+        except CircuitOpenError as e:
+            self.failed.add(module_code)
+            opened_at = self.store.client.breaker(url).opened_at
+            if self.alert_level == ConnectionAlertLevel.RAISE or opened_at != self._circuit_reported:
+                self._circuit_reported = opened_at
+                self.parse_error_codes(e, f"API is unavailable, not sending requests for now. {e}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.failed.add(module_code)
             self.parse_error_codes(e, "Connection to API failed. Check your Internet connection and/or your "
                                       "API Endpoint")
         except requests.HTTPError as e:
-            self.parse_error_codes(e, f"Invalid URL: {url}")
+            self.failed.add(module_code)
+            self.parse_error_codes(e, f"Invalid URL: {url}" if e.response is not None and
+                                   e.response.status_code < 500 else f"API failed to answer for {url}: {e}")
         else:
-            return r.json()
+            self.failed.discard(module_code)
+            if r is None and not self.store.offline:
+                self.parse_error_codes(requests.HTTPError(f"404 Client Error: Not Found for url: {url}"),
+                                       f"Invalid URL: {url}")
+            return r
+
+    def send_many(self, module_codes: Iterable[str]) -> Dict[str, dict or None]:
+        """
+        Sends requests for many modules at once and returns the Python dictionaries of each module keyed by module code
+
+        Modules in the catalogue snapshot are answered directly, and the rest are fetched concurrently by the fetch
+        engine of the Parser
+        """
+
+        return self.fetcher.map(self.send_request, module_codes)
 
-    def prerequisite(self, module_code: str):
-        """Conducts a DFS to find all dependencies for a given module"""
+    @timed("parser.prerequisite")
+    def prerequisite(self, module_code: str) -> Set[str]:
+        """
+        Conducts a BFS to find all dependencies for a given module, along with the dependencies of its equivalents
+
+        Modules in the catalogue snapshot are answered from the transitive closure of the year's module graph.
+        Otherwise, every level of the search is fetched in parallel
+        """
 
         if not self.parse_module_code(module_code):
             raise TypeError("Module Code must be of the correct format")
 
-        prerequisite = []
-        preclusions = self.preclusion(module_code)
-        equivalents = list(preclusions)
-        running = [module_code]
-        completed = []
-
-        while running:
-            curr_module = running.pop()
-            r = self.send_request(curr_module)
-
-            if r is not None and "prerequisite" in r.keys():
-                for module in self.parse_string(r.get("prerequisite")):
-                    if module in completed:
-                        continue
-                    else:
-                        if module not in preclusions:
-                            preclusions.update(self.preclusion(module))
-
-                        completed.append(module)
-
-        while equivalents:
-            curr_module = equivalents.pop()
-            cm_requests = self.send_request(curr_module)
-            if cm_requests is None:
-                continue
-
-            if cm_requests is not None and "prerequisite" in cm_requests.keys():
-                for mod in self.parse_string(cm_requests.get("prerequisite")):
-                    for or_set in prerequisite:
-                        if mod not in or_set.preclus:
-                            mod_preclus = self.preclusions(mod)
-                            if not mod_preclus:
-                                continue
-                            prerequisite.add(mod_preclus)
-
-        return prerequisite
+        equivalents = self.preclusion(module_code) | {module_code}
 
+        if self.catalogue is not None and module_code in self.catalogue:
+            return ClosureIndex.of(self.catalogue).ancestors_of(equivalents) - equivalents
+
+        return self._crawl({module_code: equivalents}, "prerequisite")[module_code] - equivalents
+
+    @timed("parser.preclusion")
     def preclusion(self, module_code: str) -> Set:
-        """Conducts a BFS to find all precluded modules in the chain"""
+        """
+        Conducts a BFS to find all precluded modules in the chain
+
+        Modules in the catalogue snapshot are answered from the preclusion index of the year instead.
+        Otherwise, every level of the search is fetched in parallel
+        """
 
         if not self.parse_module_code(module_code):
             raise TypeError("Module Code must be of the correct format")
 
-        to_check = [module_code]
-        completed = []
-        precluded = []
+        if self.catalogue is not None and module_code in self.catalogue:
+            equivalents = PreclusionIndex.of(self.catalogue).equivalents(module_code)
+            return set(equivalents) if len(equivalents) > 1 else set()
+
+        return self._crawl({module_code: {module_code}}, "preclusion")[module_code]
+
+    def _crawl(self, starts: Dict[str, Set[str]], field: str) -> Dict[str, Set[str]]:
+        """
+        Conducts a BFS over the module codes found in a field (e.g. "preclusion") from the starting codes of many
+        modules at once, and returns the codes found for each module
+
+        Every level of the search of every module is fetched together in a single parallel request
+        """
+
+        found = {code: set() for code in starts}
+        completed = {code: set() for code in starts}
+        to_check = {code: set(codes) for code, codes in starts.items()}
 
-        while to_check:
-            curr_mod = to_check.pop()
-            if curr_mod in completed:
-                continue
+        while any(to_check.values()):
+            documents = self.send_many(set().union(*to_check.values()))
 
-            r = self.send_request(curr_mod)
-            if r is not None and "preclusion" in r.keys():
-                for mod in self.parse_string(r["preclusion"]):
-                    to_check.append(mod)
-                    precluded.append(mod)
+            for code, checking in to_check.items():
+                completed[code].update(checking)
+                level = set()
 
-            completed.append(curr_mod)
+                for mod in checking:
+                    r = documents.get(mod)
+                    if r is not None and field in r.keys():
+                        level.update(self.parse_string(r[field]))
 
-        return set(precluded)
+                found[code].update(level)
+                to_check[code] = level - completed[code]
+
+        return found
+
+    @timed("parser.satisfies")
+    def satisfies(self, module_code: str, completed: Collection[str]) -> bool:
+        """
+        Returns whether a collection of completed module codes fulfils the prerequisites of a module
 
+        The compiled prerequisite tree of the module is used if the module is in the catalogue snapshot. Otherwise,
+        every module code found in its prerequisites, or an equivalent, must have been completed
+        """
+
+        if self.catalogue is not None and module_code in self.catalogue:
+            return PrereqEngine.of(self.catalogue, self.store).satisfied(module_code, completed)
+
+        r = self.send_request(module_code)
+        if r is None or "prerequisite" not in r.keys():
+            return True
+
+        completed = set(completed)
+        return all(mod in completed or self.preclusion(mod) & completed
+                   for mod in self.parse_string(r.get("prerequisite")))
+
+    @timed("parser.corequisites")
     def corequisites(self, module_code: str) -> Set[str]:
         """Returns a set of corequisite modules for a particular input module"""
         r = self.send_request(module_code)
 
-        if "corequisite" in r.keys():
+        if r is not None and "corequisite" in r.keys():
             return set([mod for mod in self.parse_string(r.get("corequisite"))])
 
         return set()
 
-    def return_modules(self, module_list) -> Set[Module]:
-        """Parses a list of module code and return the Module representation of each module"""
+    @timed("parser.resolve")
+    def resolve(self, field: str, module_codes: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        Resolves one field of many modules at once, batching the underlying lookups, and returns the codes of the field
+        for each module keyed by module code
+
+        Modules in the catalogue snapshot are answered from the indexes of the year. The searches of every other module
+        are run side by side, so every level of all of them is fetched in a single parallel request
+
+        Parameters
+        ----------
+        :param field:           "preclusions", "prerequisites" or "corequisites", as in Module.FIELDS
+        :param module_codes:    The module codes to resolve the field of
+        """
+
+        if field not in Module.FIELDS:
+            raise ValueError(f"Unknown field {field}, expected one of {', '.join(Module.FIELDS)}")
+
+        module_codes = list(dict.fromkeys(module_codes))
+        for module_code in module_codes:
+            if not self.parse_module_code(module_code):
+                raise TypeError("Module Code must be of the correct format")
+
+        local = [code for code in module_codes if self.catalogue is not None and code in self.catalogue]
+        remote = [code for code in module_codes if self.catalogue is None or code not in self.catalogue]
+
+        if field == "corequisites":
+            self.send_many(module_codes)
+            return {code: self.corequisites(code) for code in module_codes}
+
+        preclusions = {code: self.preclusion(code) for code in local}
+        if remote:
+            preclusions.update(self._crawl({code: {code} for code in remote}, "preclusion"))
+        if field == "preclusions":
+            return {code: preclusions[code] for code in module_codes}
+
+        prerequisites = {code: self.prerequisite(code) for code in local}
+        if remote:
+            equivalents = {code: preclusions[code] | {code} for code in remote}
+            for code, found in self._crawl(equivalents, "prerequisite").items():
+                prerequisites[code] = found - equivalents[code]
+
+        return {code: prerequisites[code] for code in module_codes}
+
+    @timed("parser.return_modules")
+    def return_modules(self, module_list, fields: Optional[Collection[str]] = ()) -> Set[Module]:
+        """
+        Parses a list of module code and return the Module representation of each module
+
+        Fields are resolved on first access and memoised, so callers only pay for the fields they read. Fields listed
+        in fields (or every field, if fields is None) are instead resolved up front for every module at once
+
+        Parameters
+        ----------
+        :param module_list:     The module codes to return modules for
+        :param fields:          The fields to resolve up front, out of Module.FIELDS
+        """
+
+        modules = [Module(m, resolver=self.resolve) for m in dict.fromkeys(module_list)]
+        for field in Module.FIELDS if fields is None else fields:
+            resolved = self.resolve(field, [m.code for m in modules])
+            for module in modules:
+                module.fill(field, resolved[module.code])
 
-        return set([Module(
-            code=m,
-            prerequisites=self.prerequisite(m),
-            preclusions=self.preclusion(m),
-            corequisites=self.corequisites(m)) for m in module_list])
+        return set(modules)
 
 
 if __name__ == '__main__':
-    parser = Parser()
-    print(parser.preclusion("CS1101S"))
-    print(parser.prerequisite("MA2001"))
+    with Parser() as parser:
+        print(parser.preclusion("CS1101S"))
+        print(parser.prerequisite("MA2001"))
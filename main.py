@@ -1,4 +1,19 @@
-from pathfinder import CLIApp
+import sys
 
 if __name__ == '__main__':
+    # python main.py batch [...] checks plan files without prompting, see batch.py
+    if sys.argv[1:2] == ["batch"]:
+        from batch import main
+        sys.exit(main(sys.argv[2:]))
+    # python main.py route [...] finds the cheapest modules to take to unlock a module, see route.py
+    if sys.argv[1:2] == ["route"]:
+        from route import main
+        sys.exit(main(sys.argv[2:]))
+
+    # python main.py analytics [...] writes the bottleneck statistics of every module to a table, see analytics.py
+    if sys.argv[1:2] == ["analytics"]:
+        from analytics import main
+        sys.exit(main(sys.argv[2:]))
+
+    from pathfinder import CLIApp
     cli = CLIApp()
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+from contextlib import contextmanager
+from typing import *
+
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds, in seconds"""
+
+    BOUNDS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """Records one observation"""
+
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Returns an upper bound of a quantile of the observations, from the bucket it falls in"""
+
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def snapshot(self) -> dict:
+        """Returns the histogram as a dictionary"""
+
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+            "buckets": {("le " + format(bound, "g")): count for bound, count in zip(self.BOUNDS, self.counts)} |
+                       {"inf": self.counts[-1]}
+        }
+
+
+class Metrics:
+    """
+    Instrumentation surface shared by the module store, Parser and ModuleGraph
+
+    Metrics holds request counters per API endpoint and status, hit and miss counters per cache, latency histograms of
+    requests, and timing histograms of resolver spans. snapshot returns all of them as a dictionary.
+
+    If a trace file is given, or the PATHFINDER_TRACE environment variable names one, every request and every span is
+    also appended to it as one JSON object per line, so production runs can be profiled without code changes.
+    """
+
+    def __init__(self, trace: Optional[str] = None):
+        self.trace = trace if trace else os.environ.get("PATHFINDER_TRACE") or None
+
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self.reset()
+
+    def reset(self):
+        """Clears every counter and histogram"""
+
+        with self._lock:
+            self.requests: Dict[str, Dict[str, int]] = {}
+            self.caches: Dict[str, Dict[str, int]] = {}
+            self.latency: Dict[str, Histogram] = {}
+            self.spans: Dict[str, Histogram] = {}
+
+    # ----- Recording ----- #
+    def request(self, endpoint: str, status: int or str, seconds: float, url: Optional[str] = None):
+        """Records a request to an API endpoint, with its status code (or error name) and latency"""
+
+        with self._lock:
+            counters = self.requests.setdefault(endpoint, {})
+            counters[str(status)] = counters.get(str(status), 0) + 1
+            self.latency.setdefault(endpoint, Histogram()).observe(seconds)
+
+        self._write({"type": "request", "endpoint": endpoint, "url": url, "status": status, "duration": seconds})
+
+    def hit(self, cache: str):
+        """Records a lookup answered by a cache"""
+
+        with self._lock:
+            counters = self.caches.setdefault(cache, {"hits": 0, "misses": 0})
+            counters["hits"] += 1
+
+    def miss(self, cache: str):
+        """Records a lookup that a cache could not answer"""
+
+        with self._lock:
+            counters = self.caches.setdefault(cache, {"hits": 0, "misses": 0})
+            counters["misses"] += 1
+
+    @contextmanager
+    def span(self, name: str, **fields):
+        """Times the block it wraps, and records the duration under the name of the span"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.spans.setdefault(name, Histogram()).observe(seconds)
+            self._write({"type": "span", "name": name, "duration": seconds, **fields})
+
+    def _write(self, event: dict):
+        if not self.trace:
+            return
+
+        event["time"] = time.time()
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            if self._trace_file is None:
+                self._trace_file = open(self.trace, "a", buffering=1)
+            self._trace_file.write(line)
+
+    # ----- Reporting ----- #
+    def snapshot(self) -> dict:
+        """Returns every counter and histogram as a dictionary"""
+
+        with self._lock:
+            return {
+                "requests": {endpoint: dict(counters) for endpoint, counters in self.requests.items()},
+                "caches": {cache: dict(counters, ratio=counters["hits"] / max(1, counters["hits"] + counters["misses"]))
+                           for cache, counters in self.caches.items()},
+                "latency": {endpoint: histogram.snapshot() for endpoint, histogram in self.latency.items()},
+                "spans": {name: histogram.snapshot() for name, histogram in self.spans.items()}
+            }
+
+    def close(self):
+        """Closes the trace file"""
+
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+METRICS = Metrics()
+
+
+def timed(name: str):
+    """
+    Decorator that records a span around every call of a method, using the metrics attribute of the instance
+
+    The positional arguments of the call are recorded in the trace along with the span
+    """
+
+    def decorator(method: Callable):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name, args=args):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
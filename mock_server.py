@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+
+
+DATABASE_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database")
+
+
+def load_fixtures(directory: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Loads the recorded module documents in the database directory into a single dictionary keyed by module code
+
+    Parameters
+    ----------
+    :param directory:       An optional directory that overrides the default database directory
+    """
+
+    directory = directory if directory else DATABASE_DIRECTORY
+    fixtures = {}
+
+    for name in ("cs_mods.json", "ge_mods.json", "other_mods.json"):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.path.getsize(path):
+            with open(path) as f:
+                fixtures.update(json.load(f))
+
+    return fixtures
+
+
+class MockServer:
+    """
+    Local stand-in for the NUSMods API, serving fixture JSON over HTTP from a background thread
+
+    The server answers the same paths as the real API, i.e. /<year>/modules/<code>.json, /<year>/moduleList.json and
+    /<year>/moduleInfo.json, and supports ETag revalidation. As in the real API, moduleInfo.json only holds the
+    condensed semesterData of every module (its semesters and exams), and the lessons of a module are only served in
+    its own document. Every request path is recorded in REQUESTS so that callers can count round-trips. An artificial
+    latency can be injected into every response, to stand in for the round-trip time to the real API.
+
+    In flaky mode, a share of the requests fail at random, either with a 503 answer or with the connection dropped
+    before any answer, and every failed request path is recorded in FAILURES. Setting down answers every request with a
+    503 until it is unset again, to stand in for an outage.
+
+    Use it as a context manager:
+
+        with MockServer() as server:
+            with Parser(endpoint=server.endpoint) as parser:
+                ...
+    """
+
+    def __init__(self, fixtures: Optional[Dict[str, dict]] = None, year: str = "2022-2023",
+                 host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, flaky: float = 0.0,
+                 seed: Optional[int] = None):
+        if not 0 <= flaky <= 1:
+            raise ValueError("The share of flaky requests must be between 0 and 1")
+
+        self.FIXTURES = fixtures if fixtures is not None else load_fixtures()
+        self.YEAR = year
+        self.latency = latency
+        self.flaky = flaky
+        self.down = False
+        self.REQUESTS: List[str] = []
+        self.FAILURES: List[str] = []
+
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def endpoint(self) -> str:
+        """The API endpoint of the running server, to be passed to Parser and ModuleStore"""
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Starts serving requests in a background thread"""
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the server and releases its socket"""
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def condense(module: dict) -> dict:
+        """Returns a module document as listed in moduleInfo.json, with the lessons left out of its semesterData"""
+
+        module = dict(module)
+        if module.get("semesterData"):
+            module["semesterData"] = [{key: value for key, value in data.items()
+                                       if key in ("semester", "examDate", "examDuration")}
+                                      for data in module["semesterData"]]
+
+        return module
+
+    def respond(self, path: str) -> Tuple[int, bytes or None]:
+        """Returns the status code and the body served for a request path"""
+
+        parts = path.strip("/").split("/")
+
+        if len(parts) == 2 and parts[0] == self.YEAR and parts[1] == "moduleList.json":
+            body = [{"moduleCode": code, "title": mod.get("title", ""), "semesters": [
+                sem.get("semester") for sem in mod.get("semesterData", [])
+            ]} for code, mod in self.FIXTURES.items()]
+            return 200, json.dumps(body).encode()
+        elif len(parts) == 2 and parts[0] == self.YEAR and parts[1] == "moduleInfo.json":
+            return 200, json.dumps([self.condense(mod) for mod in self.FIXTURES.values()]).encode()
+        elif len(parts) == 3 and parts[0] == self.YEAR and parts[1] == "modules" and parts[2].endswith(".json"):
+            module = self.FIXTURES.get(parts[2][:-len(".json")])
+            if module is not None:
+                return 200, json.dumps(module).encode()
+
+        return 404, None
+
+    def _record(self, path: str) -> str or None:
+        # records a request, and returns how it fails ("error" or "drop"), or None if it is answered
+        with self._lock:
+            self.REQUESTS.append(path)
+            if self.down:
+                failure = "error"
+            elif self.flaky and self._random.random() < self.flaky:
+                failure = self._random.choice(("error", "drop"))
+            else:
+                return None
+
+            self.FAILURES.append(path)
+            return failure
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                failure = server._record(self.path)
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if failure == "drop":
+                    self.close_connection = True
+                    return
+                elif failure == "error":
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                status, body = server.respond(self.path)
+
+                if body is None:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    with MockServer() as mock:
+        print(f"Serving {len(mock.FIXTURES)} fixture modules at {mock.endpoint}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -1,31 +1,106 @@
-from lib import *
+import os
+import threading
+
 from defaults import *
 from typing import *
 
 from InquirerPy import inquirer
 from InquirerPy.validator import *
 from InquirerPy.base.control import Choice
-from pyfiglet import Figlet
+from prompt_toolkit.completion import Completer, Completion
 from termcolor import cprint
 
+# lib (and with it requests and the catalogue snapshot), the planning engines and pyfiglet are only imported when they
+# are first needed, so the first prompt is shown as early as possible
+
+
+class ModuleCompleter(Completer):
+    """Completes module codes in InquirerPy prompts from the prefix index of the catalogue, showing their titles"""
+
+    def __init__(self, index: "ModuleIndex"):
+        self.index = index
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        if not text.strip():
+            return
+
+        for code in self.index.complete(text):
+            yield Completion(code, start_position=-len(text), display_meta=self.index.title(code))
+
 
 class CLIApp:
     """
     Class that modularize the process of gathering inputs from the user and places into functions that can be reused
 
     Calling the constructor of this class will start the app and direct all outputs to stdout
+
+    The banner is rendered once per font and cached in BANNER_DIRECTORY (or $PATHFINDER_CACHE), and lib and the
+    catalogue snapshot are loaded in a background thread while the first prompt is shown. Everything that needs them
+    waits for the thread with loaded
     """
 
+    BANNER_DIRECTORY: str = os.environ.get("PATHFINDER_CACHE") or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "database")
+
     def __init__(self, ascii_colour: Literal["grey", "red", "green", "yellow", "blue", "magenta", "cyan",
                                              "white"] = "blue",
                  font: Literal["3-d", "alphabet", "banner3", "slant", "barbwire", "block", "doom", "isometric1",
                                "ogre", "standard", "speed"] = "slant"):
         self.ASCII_ART_COLOUR = ascii_colour
         self.ASCII_ART_FONT = font
-        self.FIGLET_DEFAULT = Figlet(font=self.ASCII_ART_FONT)
         self.SELECTED = []
+        self.PROGRAMMES = []
+        self.PLAN = None
+        self._loader = threading.Thread(target=self._load, name="pathfinder-loader", daemon=True)
+        self._loader.start()
         self.welcome_screen()
 
+    def _load(self) -> None:
+        # imports lib, loads the catalogue snapshot of the year and compiles its prerequisites for the plan
+        import lib
+        from plan import PlanState
+
+        catalogue = lib.get_catalogue()
+        self.PLAN = PlanState(catalogue) if catalogue is not None else None
+
+    def loaded(self):
+        """
+        Waits for lib and the catalogue snapshot to be loaded in the background
+
+        :return: The lib module
+        """
+
+        self._loader.join()
+        import lib
+        return lib
+
+    def banner(self) -> str:
+        """
+        Returns the banner rendered in the font of the app, rendering it with pyfiglet only if it is not cached yet
+
+        :return: str
+        """
+
+        path = os.path.join(self.BANNER_DIRECTORY, f".banner-{self.ASCII_ART_FONT}.txt")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            pass
+
+        from pyfiglet import Figlet
+        banner = Figlet(font=self.ASCII_ART_FONT).renderText("Pathfinder")
+        try:
+            os.makedirs(self.BANNER_DIRECTORY, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(banner)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+        return banner
+
     def welcome_screen(self) -> None:
         """
         Welcome screen for the CLI Application
@@ -33,7 +108,7 @@ class CLIApp:
         :return: None
         """
 
-        cprint(self.FIGLET_DEFAULT.renderText("Pathfinder"), color="blue")
+        cprint(self.banner(), color="blue")
         cprint("Welcome to the NUS Pathfinder App!\n"
                "Build Version: v0.0\n\n"
                "Made with ❤️ by Kyriel\n", color="blue")
@@ -41,6 +116,80 @@ class CLIApp:
         # entry point that invokes all other function
         self.course_selection()
 
+    def module_prompt(self, message: str) -> str:
+        """
+        Prompts the user for a module code, autocompleting and validating it against the catalogue of the year
+
+        :return: The module code in upper case, or "Q" if the user wants to stop adding modules
+        """
+
+        lib = self.loaded()
+        index = lib.get_module_index()
+        return inquirer.text(
+            message,
+            completer=ModuleCompleter(index) if index is not None else None,
+            validate=lambda text: text.strip().upper() == "Q" or lib.is_module_code(text.strip().upper()),
+            invalid_message="Unrecognised module",
+            filter=lambda text: text.strip().upper()
+        ).execute()
+
+    def select(self, module_codes: Iterable[str]) -> None:
+        """
+        Adds modules picked by the user to the selection, or removes a picked module that is already selected
+
+        :return: None
+        """
+
+        module_codes = list(module_codes)
+        selected = [code for code in module_codes if code in self.SELECTED]
+        unselected = [code for code in module_codes if code not in self.SELECTED]
+        self.remove(selected)
+        self.add(unselected)
+
+    def add(self, module_codes: Iterable[str]) -> None:
+        """
+        Adds modules to the selection, leaving modules that are already selected as they are, and reports the modules
+        whose prerequisites are now fulfilled or missing
+
+        :return: None
+        """
+
+        self.loaded()
+        changed = set()
+        for code in module_codes:
+            if code not in self.SELECTED:
+                self.SELECTED.append(code)
+                changed |= self.PLAN.add(code) if self.PLAN is not None else set()
+
+        self._report(changed)
+
+    def remove(self, module_codes: Iterable[str]) -> None:
+        """
+        Removes modules from the selection, leaving modules that are not selected as they are, and reports the modules
+        whose prerequisites are now fulfilled or missing
+
+        :return: None
+        """
+
+        self.loaded()
+        changed = set()
+        for code in module_codes:
+            if code in self.SELECTED:
+                self.SELECTED.remove(code)
+                cprint(f"Removed {code}", "yellow")
+                changed |= self.PLAN.remove(code) if self.PLAN is not None else set()
+
+        self._report(changed)
+
+    def _report(self, changed: Set[str]) -> None:
+        for code in sorted(changed & set(self.SELECTED)):
+            missing = self.PLAN.missing(code)
+            if missing:
+                cprint(f"{code} needs " + " and ".join("(" + " or ".join(sorted(group)) + ")" for group in missing),
+                       "yellow")
+            else:
+                cprint(f"{code}: prerequisites fulfilled", "green")
+
     def course_selection(self) -> None:
         """
         Selects the course the user wants to plan out
@@ -62,11 +211,12 @@ class CLIApp:
 
         match (course_selector):
             case "Computer Science, Standalone":
-                self.SELECTED.extend(COMPUTER_SCIENCE_CORE_MODS)
-                self.SELECTED.extend(COMPUTER_SCIENCE_MATH_MODS)
+                self.PROGRAMMES = [PRIMARY_PROGRAMME]
+                self.add(COMPUTER_SCIENCE_CORE_MODS + COMPUTER_SCIENCE_MATH_MODS)
                 self.data_literacy_selection()
             case "Computer Science, with 2nd Degree/Major/Minor":
-                self._not_implemented()
+                self.add(COMPUTER_SCIENCE_CORE_MODS + COMPUTER_SCIENCE_MATH_MODS)
+                self.programme_selection()
             case "Custom":
                 self.custom_modules()
             case "Quit":
@@ -74,6 +224,36 @@ class CLIApp:
             case _:
                 raise ValueError("Unrecognised Command")
 
+    def programme_selection(self) -> None:
+        """
+        Function to query what second degree, major or minor the user wants to take alongside Computer Science, and
+        to add the modules it requires
+
+        :return: None
+        """
+
+        choices = [name for name, programme in PROGRAMMES.items() if programme["kind"] in ("degree", "major", "minor")
+                   and name != PRIMARY_PROGRAMME]
+        programme_selector = inquirer.select(
+            message="Select a 2nd Degree/Major/Minor:",
+            choices=choices + ["Go Back", "Quit"],
+            default=choices[0]
+        ).execute(raise_keyboard_interrupt=True)
+
+        match (programme_selector):
+            case "Go Back":
+                self.remove(COMPUTER_SCIENCE_CORE_MODS + COMPUTER_SCIENCE_MATH_MODS)
+                self.course_selection()
+            case "Quit":
+                self.quit()
+            case name if name in PROGRAMMES:
+                self.PROGRAMMES = [PRIMARY_PROGRAMME, name]
+                self.add([code for requirement in PROGRAMMES[name]["requirements"].values()
+                          for code in requirement.get("all", [])])
+                self.data_literacy_selection()
+            case _:
+                raise ValueError("Unrecognised Command")
+
     def data_literacy_selection(self) -> None:
         """
         Function to query what Data Literacy mod the user wants to take
@@ -96,7 +276,7 @@ class CLIApp:
 
         match (data_lit_selector):
             case "GEA1000" | "BT1101" | "ST1131" | "DSE1101":
-                self.SELECTED.append(data_lit_selector)
+                self.add([data_lit_selector])
                 self.custom_modules()
             case "Go Back":
                 self.course_selection()
@@ -142,13 +322,13 @@ class CLIApp:
         :return: None
         """
 
-        input_mod = inquirer.text("Key in a Core/Foundation Module for your course (key in Q to quit): ").execute()
+        input_mod = self.module_prompt("Key in a Core/Foundation Module for your course (key in Q to quit): ")
         if input_mod:
             if input_mod == "Q":
                 cprint("Terminating Module Addition Mode...", "red")
                 self.custom_modules()
             else:
-                self.SELECTED.append(input_mod)
+                self.select([input_mod])
                 self.custom_modules_adder()
 
     def specialisation_modules(self):
@@ -188,15 +368,14 @@ class CLIApp:
         :return: None
         """
 
-        input_mod = inquirer.text("Add all 4-MC modules in your specialisation/track(s) that you intend to take "
-                                  "(key in Q to quit): ")\
-            .execute()
+        input_mod = self.module_prompt("Add all 4-MC modules in your specialisation/track(s) that you intend to take "
+                                       "(key in Q to quit): ")
         if input_mod:
             if input_mod == "Q":
                 cprint("Terminating Module Addition Mode...", "red")
                 self.custom_modules()
             else:
-                self.SELECTED.append(input_mod)
+                self.select([input_mod])
                 self.custom_modules_adder()
 
     def ue_modules(self):
@@ -236,15 +415,14 @@ class CLIApp:
         :return: None
         """
 
-        input_mod = inquirer.text("Add all remaining 4-MC modules, such as remaining GE/RC4 modules"
-                                  "(key in Q to quit): ") \
-            .execute()
+        input_mod = self.module_prompt("Add all remaining 4-MC modules, such as remaining GE/RC4 modules"
+                                       "(key in Q to quit): ")
         if input_mod:
             if input_mod == "Q":
                 cprint("Terminating Module Addition Mode...", "red")
                 self.custom_modules()
             else:
-                self.SELECTED.append(input_mod)
+                self.select([input_mod])
                 self.custom_modules_adder()
 
     def finalise(self):
@@ -263,6 +441,41 @@ class CLIApp:
         else:
             cprint("Status: {Not Viable}", "red")
 
+        lib = self.loaded()
+        catalogue = lib.get_catalogue()
+        if catalogue is None:
+            cprint("Run \"python ingest.py\" to plan your modules semester by semester", "yellow")
+            return
+
+        if self.PROGRAMMES:
+            cprint("\n##### Degree Requirements #####", "cyan")
+            for result in lib.get_requirement_engine().evaluate(self.SELECTED, self.PROGRAMMES).values():
+                cprint(str(result), "green" if result else "red")
+
+        from scheduler import Scheduler, InfeasibleScheduleError
+        from clash import ClashDetector
+
+        try:
+            schedule = Scheduler(catalogue).solve(self.SELECTED)
+        except InfeasibleScheduleError as e:
+            cprint("\n##### Semester Plan: {Not Viable} #####", "red")
+            for code, reason in sorted(e.reasons.items()):
+                cprint(f"{code}: {reason}", "red")
+        else:
+            cprint("\n##### Semester Plan #####", "cyan")
+            cprint(str(schedule), "cyan")
+            detector = ClashDetector.of(catalogue, lib.get_store(), lib.API_ENDPOINT)
+            clashes = detector.clashes_schedule(schedule.semesters)
+            for s, found in clashes.items():
+                for clash in found:
+                    cprint(f"Y{s // 2 + 1}S{s % 2 + 1}: {clash.kind.capitalize()} clash between "
+                           f"{clash.modules[0]} and {clash.modules[1]} ({clash.when})", "yellow")
+            for s, modules in enumerate(schedule.semesters):
+                unchecked = detector.missing_lessons(modules, s % 2 + 1)
+                if unchecked:
+                    cprint(f"Y{s // 2 + 1}S{s % 2 + 1}: Lessons of {', '.join(unchecked)} could not be found, so "
+                           f"they were not checked for clashes", "yellow")
+
     def _not_implemented(self):
         """Utility function which tells users that the functionality has not been implemented yet"""
 
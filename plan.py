@@ -0,0 +1,153 @@
+from catalogue import Catalogue
+from closure import ClosureIndex
+from prereq import PrereqEngine
+from typing import *
+
+
+class PlanState:
+    """
+    The modules of a plan being edited, along with the prerequisites each of them is missing, kept up to date on edits
+
+    Whether a module is satisfied only depends on which of the modules under its compiled prerequisite tree are in the
+    plan, so the plan keeps, for every module code under the tree of a planned module, the planned modules that watch
+    it. Adding or removing a module then only re-evaluates the modules watching it (and the module itself), instead of
+    every module of the plan, and reports the modules whose missing prerequisites changed.
+
+    Completed modules fulfil prerequisites like planned modules, but their own prerequisites are not checked. Modules
+    that are not in the catalogue are assumed to have no prerequisites, and are listed in unknown.
+    """
+
+    def __init__(self, catalogue: Catalogue, modules: Iterable[str] = (), completed: Iterable[str] = ()):
+        self.catalogue = catalogue
+        self.engine = PrereqEngine.of(catalogue)
+        self.closure = ClosureIndex.of(catalogue)
+
+        self._modules: Dict[str, None] = {}
+        self._completed: Set[str] = set()
+        self._taken: Set[str] = set()
+        self._watchers: Dict[str, Set[str]] = {}
+        self._missing: Dict[str, List[FrozenSet[str]]] = {}
+
+        for code in completed:
+            self.add(code, completed=True)
+        for code in modules:
+            self.add(code)
+
+    def __contains__(self, module_code: str):
+        return module_code in self._modules
+
+    def __iter__(self):
+        return iter(self._modules)
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __repr__(self):
+        return f"PlanState({list(self._modules)})"
+
+    @property
+    def modules(self) -> List[str]:
+        """The planned module codes, in the order they were added"""
+
+        return list(self._modules)
+
+    @property
+    def completed(self) -> Set[str]:
+        """The completed module codes"""
+
+        return set(self._completed)
+
+    @property
+    def unknown(self) -> List[str]:
+        """The planned module codes that are not in the catalogue"""
+
+        return [code for code in self._modules if code not in self.catalogue]
+
+    @property
+    def valid(self) -> bool:
+        """Whether every planned module has all of its prerequisites in the plan or completed"""
+
+        return not self._missing
+
+    # ----- Edits ----- #
+    def add(self, module_code: str, completed: bool = False) -> Set[str]:
+        """
+        Adds a module to the plan, or marks it as completed, and returns the planned modules whose missing prerequisites
+        changed
+
+        Parameters
+        ----------
+        :param module_code:     The module code to add
+        :param completed:       Whether the module has already been completed, rather than planned
+        """
+
+        if module_code in (self._completed if completed else self._taken):
+            return set()
+
+        if completed:
+            self._unplan(module_code)
+            self._completed.add(module_code)
+        else:
+            self._modules[module_code] = None
+            for code in self._tree_codes(module_code):
+                self._watchers.setdefault(code, set()).add(module_code)
+        self._taken.add(module_code)
+
+        return self._refresh(self._watchers.get(module_code, set()) | {module_code})
+
+    def remove(self, module_code: str) -> Set[str]:
+        """Removes a planned or completed module, and returns the planned modules whose missing prerequisites changed"""
+
+        if module_code not in self._taken:
+            return set()
+
+        self._unplan(module_code)
+        self._completed.discard(module_code)
+        self._taken.discard(module_code)
+
+        return self._refresh(self._watchers.get(module_code, set()) | {module_code})
+
+    def _tree_codes(self, module_code: str) -> FrozenSet[str]:
+        root = self.engine.compile(module_code) if module_code in self.catalogue else None
+        return self.engine.codes(root) if root is not None else frozenset()
+
+    def _unplan(self, module_code: str):
+        if self._modules.pop(module_code, False) is None:
+            for code in self._tree_codes(module_code):
+                watchers = self._watchers[code]
+                watchers.discard(module_code)
+                if not watchers:
+                    del self._watchers[code]
+
+    def _refresh(self, module_codes: Set[str]) -> Set[str]:
+        # re-evaluates the given modules, and returns the ones whose missing prerequisites changed
+        changed = set()
+        for code in module_codes:
+            before = self._missing.pop(code, [])
+            after = self.engine.missing(code, self._taken) if code in self._modules and self._tree_codes(code) else []
+            if after:
+                self._missing[code] = after
+            if after != before:
+                changed.add(code)
+
+        return changed
+
+    # ----- Queries ----- #
+    def missing(self, module_code: Optional[str] = None) -> Dict[str, List[FrozenSet[str]]] or List[FrozenSet[str]]:
+        """
+        Returns the groups of prerequisites missing for a planned module, or for every planned module that is missing
+        any, keyed by module code
+
+        A group holds every module code that fulfils it, as in PrereqEngine.groups
+        """
+
+        if module_code is not None:
+            return list(self._missing.get(module_code, []))
+
+        return {code: list(groups) for code, groups in self._missing.items()}
+
+    def blocked(self) -> Set[str]:
+        """Returns the planned modules that are missing prerequisites, or that depend on a planned module that is"""
+
+        unsatisfied = set(self._missing)
+        return unsatisfied | (self.closure.descendants_of(unsatisfied) & set(self._modules))
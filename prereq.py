@@ -0,0 +1,356 @@
+import re
+import weakref
+
+from utils import MODULE_CODE_REGEX
+from store import ModuleStore
+from catalogue import Catalogue, CatalogueAttribute
+from equivalence import PreclusionIndex
+from typing import *
+
+
+class PrereqEngine:
+    """
+    Compiled prerequisite expressions of the modules in a catalogue
+
+    The prereqTree of every module is compiled once into a DAG of interned nodes, shared between every module that uses
+    the same sub-expression. Leaves stand for a module "or its equivalent", i.e. for the module and every module it
+    precludes (see PreclusionIndex.equivalents), so they are satisfied by any of them. Modules without a prereqTree
+    fall back to requiring every module code found in their prerequisite text.
+
+    Plans are evaluated against the compiled nodes without touching any string. Many plans are evaluated at once by
+    giving each plan one bit of an integer mask, so that an AND node is a bitwise and of its children, an OR node is a
+    bitwise or, and every plan is answered in the same pass.
+
+    Wildcards such as CS1010% stand for any module of the catalogue starting with the prefix, and a wildcard that
+    matches no module is left out of the tree, as if it was not listed.
+
+    The normalised trees are cached in the derived data of the module store, keyed by the snapshot of the catalogue, so
+    later sessions on the same snapshot do not re-parse them.
+    """
+
+    # the kind of the trees in the derived data of the store, versioned so that trees normalised differently are ignored
+    TREES: str = "prereqTree:2"
+
+    LEAF: int = 0
+    AND: int = 1
+    OR: int = 2
+    N_OF: int = 3
+
+    catalogue = CatalogueAttribute()
+
+    _ENGINES: "weakref.WeakKeyDictionary[Catalogue, PrereqEngine]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue, store: Optional[ModuleStore] = None):
+        self.catalogue = catalogue
+        self.index = PreclusionIndex.of(catalogue)
+        self.store = store
+
+        # nodes are (kind, threshold, children), and a node is always interned after all of its children
+        self._nodes: List[Tuple[int, int, Tuple[int, ...]]] = []
+        self._interned: Dict[tuple, int] = {}
+        self._leaf_codes: Dict[int, FrozenSet[str]] = {}
+        # a module can fulfil several leaves, as the preclusions of two modules can overlap without being the same
+        self._leaf_of: Dict[str, List[int]] = {}
+        self._codes: Dict[int, FrozenSet[str]] = {}
+        self._disjunctive: Dict[int, bool] = {}
+        self._roots: Dict[str, int or None] = {}
+
+        self._snapshot = f"{catalogue.year}:{catalogue.fingerprint}" if store else None
+        self._trees: Dict[str, Any] = store.get_derived(self.TREES, self._snapshot) if store else {}
+        self._unsaved: Dict[str, Any] = {}
+        self._sorted_codes: Optional[List[str]] = None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    @classmethod
+    def of(cls, catalogue: Catalogue, store: Optional[ModuleStore] = None) -> "PrereqEngine":
+        """
+        Returns the engine of a catalogue, compiling every module of the catalogue on first use
+
+        An engine keeps the first store it is given, so an engine built without a store (e.g. by PlanValidator) caches
+        its trees in the store of a later call, and the store of a later call is ignored otherwise.
+        """
+
+        engine = cls._ENGINES.get(catalogue)
+        if engine is None:
+            engine = cls._ENGINES[catalogue] = cls(catalogue, store)
+            engine.compile_all()
+        elif engine.store is None and store is not None:
+            engine.attach(store)
+
+        return engine
+
+    def attach(self, store: ModuleStore):
+        """Caches the trees of an engine built without a store in a store, along with every tree normalised later"""
+
+        self.store = store
+        self._snapshot = f"{self.catalogue.year}:{self.catalogue.fingerprint}"
+        self._unsaved = {**self._trees, **self._unsaved}
+        self._trees = {**store.get_derived(self.TREES, self._snapshot), **self._trees}
+        self.save()
+
+    # ----- Compilation ----- #
+    def tree(self, module_code: str) -> Any:
+        """
+        Returns the normalised prerequisite tree of a module, or None if the module has no prerequisites
+
+        A normalised tree is either a module code, ["and", [...]], ["or", [...]] or ["nOf", n, [...]]
+        """
+
+        if module_code not in self._trees:
+            module = self.catalogue.get(module_code)
+            if module is None:
+                tree = None
+            elif "prereqTree" in module:
+                tree = self._normalise(module["prereqTree"])
+            else:
+                # the text sometimes mentions the module itself, which is never its own prerequisite
+                codes = [code for code in dict.fromkeys(re.findall(MODULE_CODE_REGEX, module.get("prerequisite", "")))
+                         if code not in self.index.equivalents(module_code)]
+                tree = None if not codes else codes[0] if len(codes) == 1 else ["and", codes]
+
+            self._trees[module_code] = self._unsaved[module_code] = tree
+
+        return self._trees[module_code]
+
+    @staticmethod
+    def flatten(tree: Any) -> List[str]:
+        """Returns every module code in a normalised tree, in order"""
+
+        if tree is None:
+            return []
+        elif isinstance(tree, str):
+            return [tree]
+
+        return [code for child in tree[-1] for code in PrereqEngine.flatten(child)]
+
+    def compile(self, module_code: str) -> int or None:
+        """Returns the id of the root node of the prerequisites of a module, or None if it has no prerequisites"""
+
+        if module_code not in self._roots:
+            tree = self.tree(module_code)
+            self._roots[module_code] = self._intern(tree) if tree is not None else None
+
+        return self._roots[module_code]
+
+    def compile_all(self):
+        """Compiles the prerequisites of every module in the catalogue, and caches the new trees in the store"""
+
+        for module_code in self.catalogue:
+            self.compile(module_code)
+
+        self.save()
+
+    def save(self):
+        """Caches the trees normalised since the last save in the module store"""
+
+        if self.store is not None and self._unsaved:
+            self.store.put_derived(self.TREES, self._snapshot, self._unsaved)
+        self._unsaved = {}
+
+    def _normalise(self, raw: Any) -> Any:
+        if isinstance(raw, str):
+            code = raw.split(":")[0]
+            if "%" not in code:
+                return code
+
+            # wildcards such as CS1010% stand for any module starting with the prefix
+            if self._sorted_codes is None:
+                self._sorted_codes = self.catalogue.codes()
+            prefix = code.split("%")[0]
+            matches = [c for c in self._sorted_codes if c.startswith(prefix)]
+            return matches[0] if len(matches) == 1 else ["or", matches] if matches else None
+        elif "nOf" in raw:
+            n, children = raw["nOf"]
+            # as if the children left out were not listed, at most every child left is needed
+            children = [child for child in map(self._normalise, children) if child is not None]
+            return ["nOf", min(n, len(children)), children] if children else None
+
+        operator = "and" if "and" in raw else "or"
+        children = [child for child in map(self._normalise, raw[operator]) if child is not None]
+        return None if not children else children[0] if len(children) == 1 else [operator, children]
+
+    def _intern(self, tree: Any) -> int:
+        if isinstance(tree, str):
+            members = self.index.equivalents(tree)
+            key = (self.LEAF, 0, members)
+        elif tree[0] == "nOf":
+            key = (self.N_OF, tree[1], tuple(sorted(set(self._intern(c) for c in tree[2]))))
+        else:
+            key = (self.AND if tree[0] == "and" else self.OR, 0,
+                   tuple(sorted(set(self._intern(c) for c in tree[1]))))
+
+        node = self._interned.get(key)
+        if node is None:
+            node = self._interned[key] = len(self._nodes)
+            if key[0] == self.LEAF:
+                self._nodes.append((self.LEAF, 0, ()))
+                self._leaf_codes[node] = members
+                for code in members:
+                    self._leaf_of.setdefault(code, []).append(node)
+            else:
+                self._nodes.append(key)
+
+        return node
+
+    # ----- Inspection ----- #
+    def node(self, node: int) -> Tuple[int, int, Tuple[int, ...]]:
+        """Returns the kind, the threshold (for N_OF nodes) and the children of a node"""
+
+        return self._nodes[node]
+
+    def codes(self, node: int) -> FrozenSet[str]:
+        """Returns every module code that appears under a node"""
+
+        if node not in self._codes:
+            kind, _, children = self._nodes[node]
+            self._codes[node] = self._leaf_codes[node] if kind == self.LEAF \
+                else frozenset().union(*(self.codes(c) for c in children))
+
+        return self._codes[node]
+
+    def disjunctive(self, node: int) -> bool:
+        """Returns whether a node is fulfilled by any single module under it, i.e. it only has leaves and OR nodes"""
+
+        if node not in self._disjunctive:
+            kind, threshold, children = self._nodes[node]
+            self._disjunctive[node] = kind == self.LEAF or \
+                ((kind == self.OR or threshold == 1) and all(self.disjunctive(c) for c in children))
+
+        return self._disjunctive[node]
+
+    def groups(self, module_code: str) -> List[FrozenSet[str]]:
+        """
+        Returns groups of modules that are all required by a module, where any module in a group fulfils the group
+
+        Where the prerequisites offer alternatives that are not single modules (e.g. one of two pairs of modules), the
+        groups of the alternative needing the fewest groups are returned, so fulfilling every group is always enough
+        to take the module, but may not be the only way to. Use satisfied or missing to check a plan.
+        """
+
+        return self.missing(module_code, ())
+
+    def conjuncts(self, module_code: str) -> Tuple[int, ...]:
+        """Returns the ids of the nodes of the groups of a module, in the same order as groups"""
+
+        root = self.compile(module_code)
+        if root is None:
+            return ()
+
+        kind, _, children = self._nodes[root]
+        return children if kind == self.AND else (root,)
+
+    # ----- Evaluation ----- #
+    def leaf_masks(self, plans: Sequence[Collection[str]]) -> Dict[int, int]:
+        """Returns, for every leaf that is fulfilled by a plan, a mask with the bit of each plan that fulfils it"""
+
+        masks = {}
+        for p, plan in enumerate(plans):
+            bit = 1 << p
+            for code in plan:
+                for leaf in self._leaf_of.get(code, ()):
+                    masks[leaf] = masks.get(leaf, 0) | bit
+
+        return masks
+
+    def evaluate(self, node: int, masks: Dict[int, int], full: int, memo: Optional[Dict[int, int]] = None) -> int:
+        """
+        Evaluates a node for many plans at once, returning the mask of the plans that satisfy the node
+
+        Parameters
+        ----------
+        :param node:            The id of the node to evaluate
+        :param masks:           The leaf masks of the plans, from leaf_masks
+        :param full:            The mask with the bit of every plan set
+        :param memo:            An optional dictionary of results to share between evaluations of the same plans
+        """
+
+        memo = memo if memo is not None else {}
+        if node in memo:
+            return memo[node]
+
+        kind, threshold, children = self._nodes[node]
+        if kind == self.LEAF:
+            result = masks.get(node, 0)
+        elif kind == self.AND:
+            result = full
+            for child in children:
+                result &= self.evaluate(child, masks, full, memo)
+        elif kind == self.OR:
+            result = 0
+            for child in children:
+                result |= self.evaluate(child, masks, full, memo)
+        else:
+            # at_least[j] holds the plans that satisfy at least j of the children seen so far
+            at_least = [full] + [0] * threshold
+            for child in children:
+                mask = self.evaluate(child, masks, full, memo)
+                for j in range(threshold, 0, -1):
+                    at_least[j] |= at_least[j - 1] & mask
+            result = at_least[threshold]
+
+        memo[node] = result
+        return result
+
+    def satisfied(self, module_code: str, completed: Collection[str]) -> bool:
+        """Returns whether a set of completed module codes is sufficient to take a module"""
+
+        return self.satisfied_batch(module_code, [completed])[0]
+
+    def satisfied_batch(self, module_code: str, plans: Sequence[Collection[str]]) -> List[bool]:
+        """Returns whether each of many sets of completed module codes is sufficient to take a module"""
+
+        root = self.compile(module_code)
+        if root is None:
+            return [True] * len(plans)
+
+        result = self.evaluate(root, self.leaf_masks(plans), (1 << len(plans)) - 1)
+        return [bool(result >> p & 1) for p in range(len(plans))]
+
+    def missing(self, module_code: str, completed: Collection[str]) -> List[FrozenSet[str]]:
+        """
+        Returns the groups of prerequisites of a module that are not fulfilled by a set of completed module codes
+
+        Any module in a group fulfils the group, and fulfilling every group is enough to take the module. Each group is
+        read off the compiled tree: an unfulfilled AND node asks for the groups of its unfulfilled children, an
+        unfulfilled node that any single module under it fulfils is one group, and an unfulfilled OR or nOf node asks
+        for the groups of its children needing the fewest groups.
+        """
+
+        masks = self.leaf_masks([completed])
+        memo = {}
+        groups = {}
+        for node in self.conjuncts(module_code):
+            for group in self.unfulfilled(node, masks, memo):
+                groups[group] = None
+
+        return list(groups)
+
+    def unfulfilled(self, node: int, masks: Dict[int, int], memo: Optional[Dict[int, int]] = None) -> \
+            List[FrozenSet[str]]:
+        """
+        Returns the groups of modules a single plan still needs to fulfil a node, as in missing
+
+        Parameters
+        ----------
+        :param node:            The id of the node
+        :param masks:           The leaf masks of the plan, from leaf_masks with a single plan
+        :param memo:            An optional dictionary of evaluations to share between calls with the same plan
+        """
+
+        memo = memo if memo is not None else {}
+        if self.evaluate(node, masks, 1, memo):
+            return []
+        if self.disjunctive(node):
+            return [self.codes(node)]
+
+        kind, threshold, children = self._nodes[node]
+        if kind == self.AND:
+            return list(dict.fromkeys(group for child in children for group in self.unfulfilled(child, masks, memo)))
+
+        # an OR node needs one more child fulfilled, and an nOf node as many as it is short of
+        needed = 1 if kind == self.OR else threshold - sum(self.evaluate(c, masks, 1, memo) for c in children)
+        options = sorted((self.unfulfilled(child, masks, memo) for child in children
+                          if not self.evaluate(child, masks, 1, memo)), key=len)
+        return list(dict.fromkeys(group for option in options[:needed] for group in option))
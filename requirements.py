@@ -0,0 +1,400 @@
+import bisect
+import weakref
+
+from catalogue import Catalogue, CatalogueAttribute
+from equivalence import PreclusionIndex
+from defaults import PRIMARY_PROGRAMME, PROGRAMMES
+from typing import *
+
+
+class RuleResult:
+    """The outcome of checking one requirement of a programme against a plan"""
+
+    def __init__(self, name: str, kind: str, satisfied: bool, used: List[str], missing: List[str],
+                 required: float, counted: float, constraints: Optional[List["RuleResult"]] = None):
+        self.name = name
+        self.kind = kind
+        self.satisfied = satisfied
+        self.used = used
+        self.missing = missing
+        self.required = required
+        self.counted = counted
+        self.constraints = constraints if constraints else []
+
+    def __bool__(self):
+        return self.satisfied
+
+    def __repr__(self):
+        return f"RuleResult({self.name}, {'satisfied' if self.satisfied else 'not satisfied'})"
+
+    def __str__(self):
+        progress = f"{self.counted:g}/{self.required:g} {'MCs' if self.kind == 'mcs' else 'modules'}"
+        line = f"{'✓' if self.satisfied else '✗'} {self.name} ({progress})"
+        if self.used:
+            line += f": {', '.join(self.used)}"
+        if not self.satisfied and self.missing:
+            line += f" [still needs {'one of ' if self.kind != 'all' else ''}{', '.join(self.missing)}]"
+        return "\n".join([line] + [f"  {constraint}" for constraint in self.constraints])
+
+
+class ProgrammeResult:
+    """The outcome of checking every requirement of a programme against a plan"""
+
+    def __init__(self, name: str, kind: str, rules: List[RuleResult], shared: float, max_shared: float or None):
+        self.name = name
+        self.kind = kind
+        self.rules = rules
+        self.shared = shared
+        self.max_shared = max_shared
+
+    def __bool__(self):
+        return self.satisfied
+
+    def __repr__(self):
+        return f"ProgrammeResult({self.name}, {'satisfied' if self.satisfied else 'not satisfied'})"
+
+    def __str__(self):
+        lines = [f"{self.name} ({self.kind}): {'Satisfied' if self.satisfied else 'Not Satisfied'}"]
+        if self.max_shared is not None:
+            lines.append(f"  Shared with the primary degree: {self.shared:g}/{self.max_shared:g} MCs")
+        lines += [f"  {line}" for rule in self.rules for line in str(rule).splitlines()]
+        return "\n".join(lines)
+
+    @property
+    def satisfied(self) -> bool:
+        """Whether every requirement of the programme is satisfied"""
+
+        return all(self.rules)
+
+    @property
+    def used(self) -> List[str]:
+        """The module codes counted towards any requirement of the programme"""
+
+        return [code for rule in self.rules for code in rule.used]
+
+
+class _Rule:
+    # a compiled requirement: the groups of module ids it asks for, as bitmasks, the union of the groups, and the rules
+    # the modules it counts must also satisfy
+    __slots__ = ("name", "kind", "required", "labels", "groups", "mask", "constraints")
+
+    def __init__(self, name: str, kind: str, required: float, labels: List[str], groups: List[int],
+                 constraints: Optional[List["_Rule"]] = None):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.labels = labels
+        self.groups = groups
+        self.constraints = constraints if constraints else []
+        self.mask = 0
+        for group in groups:
+            self.mask |= group
+
+
+class _Programme:
+    __slots__ = ("name", "kind", "max_shared", "rules", "order", "mask")
+
+    KINDS: Tuple[str, ...] = ("all", "pick", "mcs")
+
+    def __init__(self, name: str, kind: str, max_shared: float or None, rules: List[_Rule]):
+        self.name = name
+        self.kind = kind
+        self.max_shared = max_shared
+        self.rules = rules
+        # rules naming specific modules, then rules matching fewer modules, are given modules first, so that a broad
+        # rule does not take the only modules a narrow rule could count
+        self.order = sorted(range(len(rules)), key=lambda i: (self.KINDS.index(rules[i].kind),
+                                                               bin(rules[i].mask).count("1")))
+        self.mask = 0
+        for rule in rules:
+            self.mask |= rule.mask
+
+
+class RequirementEngine:
+    """
+    Degree requirements of many programmes, compiled once against the catalogue of a year
+
+    Every module code of the catalogue, and every module code named by a rule, is given one bit, and every rule is
+    compiled into the bitmasks of the module groups it asks for. A code in a rule stands for the module "or its
+    equivalent", so its group holds every module the module precludes, in a chain, and a pattern ending with %
+    (e.g. CS4%) holds every module code starting with its prefix. A plan is turned into a single mask once, and checked
+    against every programme with bitwise ands: a programme sharing no bit with the plan is answered without looking at
+    its rules, and a rule only ever looks at the modules of the plan it can use.
+
+    Rules naming modules are checked before rules counting MCs, and narrower rules before broader ones, and a module
+    only counts towards one rule of a programme. A rule can also list constraints on the modules it counts (e.g. at
+    least 12 of its MCs at level 4000), which are given modules first and count towards the rule itself instead of
+    taking modules of their own. Programmes other than the primary one may only count up to max_shared MCs of the
+    modules used by the primary programme, and prefer modules the primary programme did not use. Use
+    RequirementEngine.of(catalogue) to share a single engine between every user of a catalogue.
+    """
+
+    DEFAULT_MCS: float = 4
+    PRIMARY: str = PRIMARY_PROGRAMME
+
+    catalogue = CatalogueAttribute()
+
+    _ENGINES: "weakref.WeakKeyDictionary[Catalogue, RequirementEngine]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue, programmes: Optional[Dict[str, dict]] = None):
+        self.catalogue = catalogue
+        self.index = PreclusionIndex.of(catalogue)
+
+        programmes = PROGRAMMES if programmes is None else programmes
+        self._ids: Dict[str, int] = {}
+        self._codes: List[str] = []
+        self._credits: List[float] = []
+        for code in catalogue.codes():
+            self._intern(code)
+        # modules named by a rule are interned along with their equivalents, so patterns match them as well
+        for programme in programmes.values():
+            for rule in programme["requirements"].values():
+                for label in rule.get("all", rule.get("of", ())):
+                    if not label.endswith("%"):
+                        for code in self.index.equivalents(label) | {label}:
+                            self._intern(code)
+        self._sorted: List[str] = sorted(self._ids)
+
+        self._programmes: Dict[str, _Programme] = {name: self._compile(name, programme)
+                                                   for name, programme in programmes.items()}
+
+    def __contains__(self, name: str):
+        return name in self._programmes
+
+    def __len__(self):
+        return len(self._programmes)
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "RequirementEngine":
+        """Returns the engine of a catalogue, compiling the programmes in defaults.PROGRAMMES on first use"""
+
+        engine = cls._ENGINES.get(catalogue)
+        if engine is None:
+            engine = cls._ENGINES[catalogue] = cls(catalogue)
+
+        return engine
+
+    def programmes(self, kind: Optional[str] = None) -> List[str]:
+        """Returns the names of the programmes, optionally only those of a kind, e.g. "minor" """
+
+        return [name for name, programme in self._programmes.items() if kind is None or programme.kind == kind]
+
+    def kind(self, name: str) -> str:
+        """Returns the kind of a programme, e.g. "major" or "minor" """
+
+        return self._programmes[name].kind
+
+    def modules(self, name: str) -> List[str]:
+        """Returns the module codes every "all" requirement of a programme names, in order"""
+
+        return [label for rule in self._programmes[name].rules if rule.kind == "all" for label in rule.labels]
+
+    # ----- Compiling ----- #
+    def _intern(self, module_code: str) -> int:
+        if module_code not in self._ids:
+            self._ids[module_code] = len(self._codes)
+            self._codes.append(module_code)
+            try:
+                self._credits.append(float(self.catalogue[module_code]["moduleCredit"]))
+            except (KeyError, TypeError, ValueError):
+                self._credits.append(self.DEFAULT_MCS)
+
+        return self._ids[module_code]
+
+    def _group(self, pattern: str) -> int:
+        # the mask of the module codes matched by a pattern, i.e. a code and its equivalents, or a prefix ending with %
+        mask = 0
+        if pattern.endswith("%"):
+            prefix = pattern[:-1]
+            for code in self._sorted[bisect.bisect_left(self._sorted, prefix):]:
+                if not code.startswith(prefix):
+                    break
+                mask |= 1 << self._ids[code]
+        else:
+            for code in self.index.equivalents(pattern) | {pattern}:
+                mask |= 1 << self._ids[code]
+
+        return mask
+
+    def _compile(self, name: str, programme: dict) -> _Programme:
+        rules = [self._compile_rule(name, rule_name, rule) for rule_name, rule in programme["requirements"].items()]
+        return _Programme(name, programme.get("kind", "degree"), programme.get("max_shared"), rules)
+
+    def _compile_rule(self, name: str, rule_name: str, rule: dict, within: Optional[int] = None) -> _Rule:
+        if "all" in rule:
+            labels = list(rule["all"])
+            kind, required = "all", len(labels)
+        elif "pick" in rule:
+            labels = list(rule["of"])
+            kind, required = "pick", rule["pick"]
+        elif "mcs" in rule:
+            labels = list(rule["of"])
+            kind, required = "mcs", rule["mcs"]
+        else:
+            raise ValueError(f"Requirement {rule_name} of {name} must be an \"all\", \"pick\" or \"mcs\" rule")
+
+        groups = [self._group(label) for label in labels]
+        if within is not None:
+            # a constraint only counts modules its rule counts
+            groups = [group & within for group in groups]
+        if kind == "mcs":
+            # an MC rule counts any module matched by any of its patterns, so its patterns form a single group
+            groups = [self._union(groups)]
+
+        compiled = _Rule(rule_name, kind, required, labels, groups)
+        if "including" in rule:
+            if within is not None:
+                raise ValueError(f"Constraint {rule_name} of {name} cannot have constraints of its own")
+            compiled.constraints = [self._compile_rule(name, constraint_name, constraint, compiled.mask)
+                                    for constraint_name, constraint in rule["including"].items()]
+
+        return compiled
+
+    @staticmethod
+    def _union(masks: Iterable[int]) -> int:
+        union = 0
+        for mask in masks:
+            union |= mask
+        return union
+
+    # ----- Evaluation ----- #
+    def _bits(self, mask: int) -> List[int]:
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(low.bit_length() - 1)
+            mask ^= low
+        return ids
+
+    def mask(self, module_codes: Iterable[str]) -> int:
+        """Returns the mask of the module codes of a plan, ignoring modules that no rule could count"""
+
+        mask = 0
+        for code in module_codes:
+            module_id = self._ids.get(code)
+            if module_id is not None:
+                mask |= 1 << module_id
+        return mask
+
+    def _check(self, programme: _Programme, plan: int, primary: int) -> Tuple[ProgrammeResult, int]:
+        # allocates the modules of the plan to the rules of a programme, and returns the result and the modules used
+        used = 0
+        shared = 0.0
+        cap = programme.max_shared
+
+        def take(candidates: int) -> int or None:
+            # the lowest unused and unshared candidate, or a shared one if the cap allows it, as a module id
+            nonlocal used, shared
+            candidates &= ~used
+            unshared = candidates & ~primary
+            if unshared:
+                module_id = (unshared & -unshared).bit_length() - 1
+            else:
+                for module_id in self._bits(candidates):
+                    if cap is None or shared + self._credits[module_id] <= cap:
+                        shared += self._credits[module_id]
+                        break
+                else:
+                    return None
+
+            used |= 1 << module_id
+            return module_id
+
+        def allocate(rule: _Rule, counting: List[int]) -> RuleResult:
+            # fills a rule, first with the modules already counted towards it (in counting), then with unused modules
+            # of the plan, and appends the modules it takes to counting
+            available = plan & rule.mask
+            missing = []
+            if rule.kind == "mcs":
+                taken = [module_id for module_id in counting if rule.mask >> module_id & 1]
+                counted = sum(self._credits[module_id] for module_id in taken)
+                while counted < rule.required:
+                    module_id = take(available)
+                    if module_id is None:
+                        missing = list(rule.labels)
+                        break
+                    taken.append(module_id)
+                    counting.append(module_id)
+                    counted += self._credits[module_id]
+            else:
+                # every group is fulfilled by a different module, preferring the modules already counted
+                spare = list(counting)
+                fulfilled: List[int or None] = []
+                for group in rule.groups:
+                    module_id = next((i for i in spare if group >> i & 1), None)
+                    if module_id is not None:
+                        spare.remove(module_id)
+                    fulfilled.append(module_id)
+
+                for position, (label, group) in enumerate(zip(rule.labels, rule.groups)):
+                    if fulfilled[position] is not None:
+                        continue
+                    if rule.kind == "pick" and sum(i is not None for i in fulfilled) >= rule.required:
+                        break
+                    module_id = take(available & group) if available & group else None
+                    if module_id is None:
+                        missing.append(label)
+                        continue
+                    fulfilled[position] = module_id
+                    counting.append(module_id)
+
+                taken = [module_id for module_id in fulfilled if module_id is not None]
+                counted = len(taken)
+
+            return RuleResult(rule.name, rule.kind, counted >= rule.required, [self._codes[i] for i in taken],
+                              missing, rule.required, counted)
+
+        results: List[RuleResult or None] = [None] * len(programme.rules)
+        for position in programme.order:
+            rule = programme.rules[position]
+            counting: List[int] = []
+            constraints = [allocate(constraint, counting) for constraint in rule.constraints]
+            result = allocate(rule, counting)
+            result.constraints = constraints
+            result.satisfied = result.satisfied and all(constraints)
+            results[position] = result
+
+        return ProgrammeResult(programme.name, programme.kind, results, shared, cap), used
+
+    def evaluate(self, module_codes: Iterable[str], names: Optional[Iterable[str]] = None,
+                 primary: Optional[str] = PRIMARY) -> Dict[str, ProgrammeResult]:
+        """
+        Returns the result of checking a plan against many programmes, keyed by programme name
+
+        Parameters
+        ----------
+        :param module_codes:    The module codes of the plan, planned or completed
+        :param names:           The programmes to check (default: every programme)
+        :param primary:         The programme other programmes share modules with, checked first, or None if every
+                                programme may count every module
+        """
+
+        plan = self.mask(module_codes)
+        names = list(self._programmes) if names is None else list(names)
+        for name in names:
+            if name not in self._programmes:
+                raise ValueError(f"Unknown programme {name}")
+
+        results = {}
+        shared = 0
+        if primary is not None:
+            if primary not in self._programmes:
+                raise ValueError(f"Unknown programme {primary}")
+            result, shared = self._check(self._programmes[primary], plan, 0)
+            if primary in names:
+                results[primary] = result
+
+        for name in names:
+            if name == primary:
+                continue
+            programme = self._programmes[name]
+            # a programme sharing no module with the plan is only checked to report what it still needs
+            results[name] = self._check(programme, plan if plan & programme.mask else 0, shared)[0]
+
+        return results
+
+    def satisfied(self, module_codes: Iterable[str], names: Optional[Iterable[str]] = None,
+                  primary: Optional[str] = PRIMARY) -> List[str]:
+        """Returns the names of the programmes a plan satisfies"""
+
+        return [name for name, result in self.evaluate(module_codes, names, primary).items() if result]
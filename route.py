@@ -0,0 +1,277 @@
+import sys
+import argparse
+import weakref
+
+from catalogue import Catalogue, CatalogueAttribute
+from catalogues import CatalogueManager
+from prereq import PrereqEngine
+from typing import *
+
+
+YEAR = "2022-2023"
+
+
+class Route:
+    """The modules to take to unlock some target modules, in the semesters they can first be taken in"""
+
+    def __init__(self, targets: List[str], semesters: List[List[str]], credits: Dict[str, float]):
+        self.targets = targets
+        self.semesters = semesters
+        self.credits = credits
+
+    def __contains__(self, module_code: str):
+        return module_code in self.credits
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self):
+        return len(self.credits)
+
+    def __repr__(self):
+        return f"Route({', '.join(self.targets)}: {self.modules})"
+
+    def __str__(self):
+        lines = [f"{', '.join(self.targets)}: {len(self)} modules, {self.mcs:g} MCs over {len(self.semesters)} "
+                 f"semesters"]
+        lines += [f"Semester {s + 1}: {', '.join(modules)}" for s, modules in enumerate(self.semesters)]
+        return "\n".join(lines)
+
+    @property
+    def modules(self) -> List[str]:
+        """The module codes of the route, in an order they can be taken in"""
+
+        return [code for modules in self.semesters for code in modules]
+
+    @property
+    def mcs(self) -> float:
+        """The number of MCs of the route"""
+
+        return sum(self.credits.values())
+
+
+class RouteFinder:
+    """
+    Finds a cheap set of modules that unlocks target modules, given the modules already completed
+
+    The compiled prerequisites of the catalogue form an AND/OR graph, where a leaf is fulfilled by taking any module it
+    stands for that can be taken in the year (see available), along with the route to that module. A route to every
+    node is found bottom-up over the DAG of compiled nodes: an AND node takes the union of the routes of its children,
+    so a module shared by several children is only paid for once, an OR node takes its cheapest child, and an nOf node
+    its n cheapest children. Routes are memoised per node for a set of completed modules, so asking for many targets
+    with the same completed modules only visits every node once.
+
+    This is a heuristic: an OR or nOf node picks its children by their own cost, without knowing which modules the rest
+    of the route already pays for, so a child sharing modules with its siblings under an AND node can be passed over for
+    one that is cheaper on its own but dearer overall. Finding the cheapest route is a set cover over the alternatives,
+    which is NP-hard in general.
+
+    Routes are ranked by MCs and then by semesters ("mcs"), or by semesters and then by MCs ("semesters"), where the
+    semesters of a route is the length of its longest prerequisite chain. Routes through modules missing from the
+    catalogue always rank last. Use RouteFinder.of(catalogue) to share a single finder between every user of a
+    catalogue.
+    """
+
+    OBJECTIVES: Tuple[str, ...] = ("mcs", "semesters")
+    DEFAULT_MCS: float = 4
+
+    catalogue = CatalogueAttribute()
+
+    _FINDERS: "weakref.WeakKeyDictionary[Catalogue, RouteFinder]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+        self.engine = PrereqEngine.of(catalogue)
+
+        self._credits: Dict[str, float] = {}
+        # the memo of the last set of completed modules and objective, from node id to (modules, semesters, MCs)
+        self._key: Optional[Tuple[FrozenSet[str], str]] = None
+        self._memo: Dict[int, Tuple[FrozenSet[str], int, float] or None] = {}
+        # the number of prerequisite cycles cut so far, to tell the routes that were found around a cut cycle
+        self._cuts = 0
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "RouteFinder":
+        """Returns the route finder of a catalogue, creating it on first use"""
+
+        finder = cls._FINDERS.get(catalogue)
+        if finder is None:
+            finder = cls._FINDERS[catalogue] = cls(catalogue)
+
+        return finder
+
+    def available(self, module_code: str) -> bool:
+        """
+        Returns whether a route may take a module, i.e. the catalogue holds it and offers it in some semester
+
+        Modules without offering data are assumed to be offered, as in the scheduler. A catalogue that is not complete
+        cannot tell whether the modules it does not hold exist, so they are available too, with no prerequisites, but
+        a route only takes them if it cannot do without.
+        """
+
+        if module_code not in self.catalogue:
+            return not self.catalogue.complete
+
+        return self.catalogue[module_code].get("semesterData") != []
+
+    def credits(self, module_code: str) -> float:
+        """Returns the number of MCs of a module"""
+
+        if module_code not in self._credits:
+            try:
+                self._credits[module_code] = float(self.catalogue[module_code]["moduleCredit"])
+            except (KeyError, TypeError, ValueError):
+                self._credits[module_code] = self.DEFAULT_MCS
+
+        return self._credits[module_code]
+
+    # ----- Search ----- #
+    def _rank(self, option: Tuple[FrozenSet[str], int, float], objective: str) -> Tuple[int, float, float, int]:
+        # routes through modules missing from the catalogue come last, whatever they cost
+        modules, semesters, mcs = option
+        unknown = sum(code not in self.catalogue for code in modules)
+        return (unknown, mcs, semesters, len(modules)) if objective == "mcs" else \
+            (unknown, semesters, mcs, len(modules))
+
+    def _combine(self, options: Iterable[Tuple[FrozenSet[str], int, float]]) -> Tuple[FrozenSet[str], int, float]:
+        modules, semesters = frozenset(), 0
+        for option in options:
+            modules |= option[0]
+            semesters = max(semesters, option[1])
+
+        return modules, semesters, sum(self.credits(code) for code in modules)
+
+    def _module(self, module_code: str, completed: FrozenSet[str], objective: str,
+                visiting: Set[str]) -> Tuple[FrozenSet[str], int, float] or None:
+        # the best route that ends with taking a module, or None if its prerequisites can never be fulfilled
+        if module_code in visiting:
+            self._cuts += 1
+            return None
+
+        root = self.engine.compile(module_code) if module_code in self.catalogue else None
+        if root is None:
+            return frozenset({module_code}), 1, self.credits(module_code)
+
+        visiting.add(module_code)
+        below = self._node(root, completed, objective, visiting)
+        visiting.discard(module_code)
+        if below is None:
+            return None
+
+        return below[0] | {module_code}, below[1] + 1, below[2] + self.credits(module_code)
+
+    def _node(self, node: int, completed: FrozenSet[str], objective: str,
+              visiting: Set[str]) -> Tuple[FrozenSet[str], int, float] or None:
+        if node in self._memo:
+            return self._memo[node]
+
+        cuts = self._cuts
+        kind, threshold, children = self.engine.node(node)
+        if kind == PrereqEngine.LEAF:
+            members = self.engine.codes(node)
+            if members & completed:
+                best = frozenset(), 0, 0.0
+            else:
+                options = [option for option in (self._module(code, completed, objective, visiting)
+                                                 for code in sorted(members) if self.available(code))
+                           if option is not None]
+                best = min(options, key=lambda option: self._rank(option, objective)) if options else None
+        else:
+            options = [self._node(child, completed, objective, visiting) for child in children]
+            if kind == PrereqEngine.AND:
+                best = self._combine(options) if None not in options else None
+            else:
+                needed = 1 if kind == PrereqEngine.OR else threshold
+                options = sorted((option for option in options if option is not None),
+                                 key=lambda option: self._rank(option, objective))
+                best = self._combine(options[:needed]) if len(options) >= needed else None
+
+        # a route found while a cycle was cut may be worse than the route found from elsewhere, or missing altogether,
+        # as the modules on the cycle were ruled out, so only routes found without cutting a cycle are memoised
+        if self._cuts == cuts:
+            self._memo[node] = best
+
+        return best
+
+    def route(self, targets: str or Iterable[str], completed: Iterable[str] = (), objective: str = "mcs") -> Route:
+        """
+        Returns a cheap route to one or many target modules, see RouteFinder
+
+        Parameters
+        ----------
+        :param targets:         The module code, or module codes, to unlock and take
+        :param completed:       The module codes that have already been completed
+        :param objective:       "mcs" for the fewest MCs, or "semesters" for the fewest semesters
+        :raise:                 ValueError, if the objective is unknown, or a target is not available in the year or
+                                can never be unlocked
+        """
+
+        if objective not in self.OBJECTIVES:
+            raise ValueError(f"Unknown objective {objective}, expected one of {', '.join(self.OBJECTIVES)}")
+
+        targets = [targets] if isinstance(targets, str) else list(dict.fromkeys(targets))
+        completed = frozenset(completed)
+        if self._key != (completed, objective):
+            self._key, self._memo = (completed, objective), {}
+
+        options = []
+        for target in targets:
+            if target in completed:
+                continue
+            if not self.available(target):
+                raise ValueError(f"{target} is not offered in {self.catalogue.year}")
+
+            option = self._module(target, completed, objective, set())
+            if option is None:
+                raise ValueError(f"The prerequisites of {target} can never be fulfilled")
+            options.append(option)
+
+        modules = self._combine(options)[0]
+        return Route(targets, self._layers(modules, completed), {code: self.credits(code) for code in modules})
+
+    def _layers(self, modules: FrozenSet[str], completed: FrozenSet[str]) -> List[List[str]]:
+        # places every module of a route in the first semester its prerequisites are fulfilled by the semesters before
+        layers = []
+        taken = set(completed)
+        remaining = sorted(modules)
+        while remaining:
+            layer = [code for code in remaining if self.engine.satisfied(code, taken)]
+            if not layer:
+                # only reachable if the catalogue has a prerequisite cycle, which the route has to break somewhere
+                layer = remaining
+            layers.append(layer)
+            taken.update(layer)
+            remaining = [code for code in remaining if code not in taken]
+
+        return layers
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Find a cheap set of modules to take to unlock target modules")
+    parser.add_argument("targets", nargs="+", help="module codes to unlock and take")
+    parser.add_argument("--completed", nargs="*", default=[], help="module codes already completed")
+    parser.add_argument("--objective", choices=RouteFinder.OBJECTIVES, default="mcs",
+                        help="minimise the MCs (default) or the semesters of the route")
+    parser.add_argument("--year", default=YEAR, help=f"academic year to plan in (default: {YEAR})")
+    parser.add_argument("--directory", default=None, help="directory holding the catalogue snapshot")
+    args = parser.parse_args(argv)
+
+    catalogue = CatalogueManager(args.directory).get(args.year)
+    if catalogue is None:
+        print(f"The catalogue of {args.year} has not been ingested. Run python ingest.py {args.year} first.",
+              file=sys.stderr)
+        return 1
+
+    try:
+        route = RouteFinder.of(catalogue).route([code.upper() for code in args.targets],
+                                                [code.upper() for code in args.completed], args.objective)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print(route)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
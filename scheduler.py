@@ -0,0 +1,273 @@
+import re
+
+from utils import MODULE_CODE_REGEX
+from catalogue import Catalogue
+from closure import ClosureIndex
+from prereq import PrereqEngine
+from equivalence import PreclusionIndex
+from typing import *
+
+
+class InfeasibleScheduleError(ValueError):
+    """
+    Raised when a list of modules cannot be scheduled
+
+    The reasons attribute is the certificate of infeasibility: every module that could not be placed, mapped to the
+    reason it could not be placed
+    """
+
+    def __init__(self, reasons: Dict[str, str]):
+        self.reasons = reasons
+        super().__init__("Modules cannot be scheduled: " +
+                         "; ".join(f"{code}: {reason}" for code, reason in sorted(reasons.items())))
+
+
+class Schedule:
+    """A semester-by-semester plan, holding the module codes taken in each semester and their MCs"""
+
+    def __init__(self, semesters: List[List[str]], credits: Dict[str, float]):
+        self.semesters = semesters
+        self.credits = credits
+
+    def __iter__(self):
+        return iter(self.semesters)
+
+    def __len__(self):
+        return len(self.semesters)
+
+    def __repr__(self):
+        return f"Schedule({self.semesters})"
+
+    def __str__(self):
+        return "\n".join(f"Y{s // 2 + 1}S{s % 2 + 1} ({self.mcs(s):g} MCs): {', '.join(modules)}"
+                         for s, modules in enumerate(self.semesters))
+
+    def mcs(self, semester: int) -> float:
+        """Returns the number of MCs taken in a semester"""
+
+        return sum(self.credits[code] for code in self.semesters[semester])
+
+    def semester_of(self, module_code: str) -> int or None:
+        """Returns the index of the semester a module is taken in, or None if it is not in the schedule"""
+
+        for s, modules in enumerate(self.semesters):
+            if module_code in modules:
+                return s
+
+        return None
+
+
+class Scheduler:
+    """
+    Orders a list of modules into semesters, respecting prerequisites, corequisites, offerings and MC caps
+
+    Semesters alternate between Semester 1 and Semester 2 of the academic year, starting from Semester 1, and a module
+    is only placed in a semester it is offered in according to its semesterData. Modules without offering data are
+    assumed to be offered in both semesters.
+
+    Scheduling runs in two phases. Constraint propagation first computes the earliest semester each module can be taken
+    in (the semester its prerequisites can first be fulfilled in, if every module was taken as early as possible) and
+    the latest semester it can be taken in (before every module that cannot do without it). Modules whose window is
+    empty are reported straight away. List scheduling then fills each semester up to its MC cap, taking the modules
+    with the least slack first. Corequisites are placed in the same semester.
+    """
+
+    SEMESTERS: int = 8
+    MC_CAP: float = 23
+    DEFAULT_MCS: float = 4
+
+    def __init__(self, catalogue: Catalogue, semesters: Optional[int] = None,
+                 mc_cap: Optional[float or Sequence[float]] = None):
+        self.catalogue = catalogue
+        self.engine = PrereqEngine.of(catalogue)
+        self.closure = ClosureIndex.of(catalogue)
+        self.index = PreclusionIndex.of(catalogue)
+        self.semesters = semesters if semesters else self.SEMESTERS
+
+        mc_cap = self.MC_CAP if mc_cap is None else mc_cap
+        self.caps = list(mc_cap) if isinstance(mc_cap, Sequence) else [mc_cap] * self.semesters
+        if len(self.caps) != self.semesters:
+            raise ValueError("There must be one MC cap for every semester")
+
+    # ----- Module Data ----- #
+    def credits(self, module_code: str) -> float:
+        """Returns the number of MCs of a module"""
+
+        try:
+            return float(self.catalogue[module_code]["moduleCredit"])
+        except (KeyError, TypeError, ValueError):
+            return self.DEFAULT_MCS
+
+    def offered(self, module_code: str, semester: int) -> bool:
+        """Returns whether a module is offered in a semester of the plan"""
+
+        module = self.catalogue.get(module_code)
+        if module is None or not module.get("semesterData"):
+            return True
+
+        return any(data.get("semester") == semester % 2 + 1 for data in module["semesterData"])
+
+    def corequisites(self, module_code: str, plan: Set[str]) -> Set[str]:
+        """Returns the corequisites of a module that are in a plan, along with their equivalents in the plan"""
+
+        module = self.catalogue.get(module_code)
+        if module is None or "corequisite" not in module:
+            return set()
+
+        found = set()
+        for code in re.findall(MODULE_CODE_REGEX, module["corequisite"]):
+            found |= self.index.equivalents(code) & plan
+
+        return found - {module_code}
+
+    # ----- Solving ----- #
+    def solve(self, modules: Iterable[str], completed: Iterable[str] = ()) -> Schedule:
+        """
+        Returns a schedule for a list of modules
+
+        Parameters
+        ----------
+        :param modules:         The module codes to schedule
+        :param completed:       The module codes that have already been completed before the first semester
+        :raise:                 InfeasibleScheduleError, with the reason for every module that cannot be placed
+        """
+
+        plan = list(dict.fromkeys(modules))
+        plan_set = set(plan)
+        completed = set(completed)
+        everything = completed | plan_set
+        reasons = {}
+
+        # modules whose prerequisites cannot be fulfilled even by the whole plan
+        for code in plan:
+            if not self.engine.satisfied(code, everything):
+                missing = self.engine.missing(code, everything)
+                reasons[code] = "missing prerequisites " + \
+                                " and ".join("(" + " or ".join(sorted(group)) + ")" for group in missing)
+            elif not any(self.offered(code, s) for s in range(self.semesters)):
+                reasons[code] = "not offered in Semester 1 or Semester 2"
+
+        if reasons:
+            raise InfeasibleScheduleError(reasons)
+
+        bundles = self._bundles(plan, plan_set)
+        earliest = self._earliest(plan, completed, bundles)
+        for code in plan:
+            if earliest[code] is None:
+                reasons[code] = "prerequisites cannot be fulfilled in time (prerequisite chain is too long or cyclic)"
+
+        if reasons:
+            raise InfeasibleScheduleError(reasons)
+
+        latest = self._latest(plan, plan_set, completed)
+        for code in plan:
+            if latest[code] < earliest[code]:
+                reasons[code] = f"must be taken between semester {earliest[code] + 1} and semester " \
+                                f"{latest[code] + 1} to leave room for the modules that depend on it"
+
+        if reasons:
+            raise InfeasibleScheduleError(reasons)
+
+        return self._place(plan, completed, bundles, earliest, latest)
+
+    def _bundles(self, plan: List[str], plan_set: Set[str]) -> Dict[str, Tuple[str, ...]]:
+        # corequisites in the plan are merged into bundles that must be taken in the same semester
+        bundle_of = {code: (code,) for code in plan}
+        for code in plan:
+            for coreq in self.corequisites(code, plan_set):
+                merged = tuple(sorted(set(bundle_of[code]) | set(bundle_of[coreq])))
+                for member in merged:
+                    bundle_of[member] = merged
+
+        return bundle_of
+
+    def _available(self, bundle: Tuple[str, ...], taken: Set[str], semester: int) -> bool:
+        # prerequisites may be fulfilled by the other members of the bundle, since they are taken together
+        return all(self.offered(code, semester) and self.engine.satisfied(code, taken | set(bundle) - {code})
+                   for code in bundle)
+
+    def _earliest(self, plan: List[str], completed: Set[str],
+                  bundles: Dict[str, Tuple[str, ...]]) -> Dict[str, int or None]:
+        earliest = {code: None for code in plan}
+        taken = set(completed)
+
+        for semester in range(self.semesters):
+            placed = set()
+            for bundle in set(bundles.values()):
+                if earliest[bundle[0]] is None and self._available(bundle, taken, semester):
+                    for code in bundle:
+                        earliest[code] = semester
+                    placed.update(bundle)
+            taken |= placed
+
+        return earliest
+
+    def _latest(self, plan: List[str], plan_set: Set[str], completed: Set[str]) -> Dict[str, int]:
+        # a module is needed by a dependent if the dependent cannot be taken without it
+        needed_by = {code: [] for code in plan}
+        for code in plan:
+            for dependent in self.closure.descendants_of([code]) & plan_set:
+                if not self.engine.satisfied(dependent, (completed | plan_set) - {code}):
+                    needed_by[code].append(dependent)
+
+        latest = {}
+
+        def visit(code: str, path: Set[str]) -> int:
+            if code in latest:
+                return latest[code]
+
+            bound = self.semesters - 1
+            for dependent in needed_by[code]:
+                if dependent not in path:
+                    bound = min(bound, visit(dependent, path | {code}) - 1)
+            while bound >= 0 and not self.offered(code, bound):
+                bound -= 1
+
+            latest[code] = bound
+            return bound
+
+        for code in plan:
+            visit(code, set())
+
+        return latest
+
+    def _place(self, plan: List[str], completed: Set[str], bundles: Dict[str, Tuple[str, ...]],
+               earliest: Dict[str, int], latest: Dict[str, int]) -> Schedule:
+        credits = {code: self.credits(code) for code in plan}
+        semesters = [[] for _ in range(self.semesters)]
+        remaining = set(bundles.values())
+        taken = set(completed)
+
+        for semester in range(self.semesters):
+            load = 0
+            placed = set()
+            # least slack first, then the modules that unlock the most of the plan
+            candidates = sorted(
+                (bundle for bundle in remaining if min(earliest[code] for code in bundle) <= semester),
+                key=lambda b: (min(latest[code] for code in b),
+                               -len(self.closure.descendants_of(b) & set(plan)), b)
+            )
+
+            for bundle in candidates:
+                mcs = sum(credits[code] for code in bundle)
+                if load + mcs <= self.caps[semester] and self._available(bundle, taken, semester):
+                    semesters[semester].extend(bundle)
+                    placed.update(bundle)
+                    remaining.discard(bundle)
+                    load += mcs
+
+            taken |= placed
+
+        if remaining:
+            total = sum(credits.values())
+            capacity = sum(self.caps)
+            reasons = {}
+            for bundle in remaining:
+                for code in bundle:
+                    if total > capacity:
+                        reasons[code] = f"the plan has {total:g} MCs, more than the {capacity:g} MCs that fit"
+                    else:
+                        reasons[code] = "no semester with enough MCs left once its prerequisites are fulfilled"
+            raise InfeasibleScheduleError(reasons)
+
+        return Schedule(semesters, credits)
@@ -0,0 +1,124 @@
+import re
+import bisect
+import difflib
+import weakref
+
+from catalogue import Catalogue, CatalogueAttribute
+from typing import *
+
+
+class ModuleIndex:
+    """
+    Prefix index over the module codes and titles of a catalogue, for validating and autocompleting typed input
+
+    Module codes are kept in a sorted array and every word of every title in a sorted array of (word, code) pairs, so
+    both a code and a title prefix are answered with a binary search over the arrays, without any network request.
+    Input that matches no prefix falls back to fuzzy matching against the codes of the same subject.
+
+    Use ModuleIndex.of(catalogue) to share a single index between every user of a catalogue.
+    """
+
+    LIMIT: int = 10
+
+    catalogue = CatalogueAttribute()
+
+    _INDEXES: "weakref.WeakKeyDictionary[Catalogue, ModuleIndex]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+        self._codes: List[str] = catalogue.codes()
+        self._titles: Dict[str, str] = {code: catalogue[code].get("title", "") for code in self._codes}
+        self._words: List[Tuple[str, str]] = sorted({(word, code) for code, title in self._titles.items()
+                                                     for word in re.findall(r"\w+", title.lower())})
+
+    def __contains__(self, module_code: str):
+        return module_code in self._titles
+
+    def __len__(self):
+        return len(self._codes)
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "ModuleIndex":
+        """Returns the index of a catalogue, building it on first use"""
+
+        index = cls._INDEXES.get(catalogue)
+        if index is None:
+            index = cls._INDEXES[catalogue] = cls(catalogue)
+
+        return index
+
+    def title(self, module_code: str) -> str or None:
+        """Returns the title of a module, or None if the module is not in the catalogue"""
+
+        return self._titles.get(module_code)
+
+    # ----- Lookups ----- #
+    def codes_with_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """Returns the module codes that start with a prefix, in sorted order"""
+
+        prefix = prefix.strip().upper()
+        limit = limit if limit else self.LIMIT
+        start = bisect.bisect_left(self._codes, prefix)
+
+        matches = []
+        for code in self._codes[start:start + limit]:
+            if not code.startswith(prefix):
+                break
+            matches.append(code)
+
+        return matches
+
+    def titles_with_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """Returns the module codes whose title has a word starting with the last word of a prefix"""
+
+        words = re.findall(r"\w+", prefix.lower())
+        if not words:
+            return []
+
+        limit = limit if limit else self.LIMIT
+        others = words[:-1]
+        start = bisect.bisect_left(self._words, (words[-1],))
+
+        matches = []
+        for word, code in self._words[start:]:
+            if not word.startswith(words[-1]) or len(matches) >= limit:
+                break
+            # every earlier word of the prefix must be in the title as well
+            if code not in matches and all(other in self._titles[code].lower() for other in others):
+                matches.append(code)
+
+        return matches
+
+    def fuzzy(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Returns the module codes closest to a mistyped module code, best first"""
+
+        text = text.strip().upper()
+        if not text:
+            return []
+
+        # only codes of the same subject (e.g. CS), or starting with the same letter, are compared
+        subject = re.match(r"[A-Z]*", text).group() or text[0]
+        candidates = self._bucket(subject) or self._bucket(text[0])
+        return difflib.get_close_matches(text, candidates, limit if limit else self.LIMIT, 0.6)
+
+    def _bucket(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._codes, prefix)
+        end = bisect.bisect_left(self._codes, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        return self._codes[start:end]
+
+    def complete(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Returns the module codes that best complete some typed text
+
+        Code prefixes come first, then modules with a title word starting with the text, then fuzzy matches of the
+        text as a module code
+        """
+
+        limit = limit if limit else self.LIMIT
+        matches = self.codes_with_prefix(text, limit)
+        if len(matches) < limit:
+            matches += [code for code in self.titles_with_prefix(text, limit) if code not in matches]
+        if not matches:
+            matches = self.fuzzy(text, limit)
+
+        return matches[:limit]
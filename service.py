@@ -0,0 +1,347 @@
+import re
+import sys
+import json
+import asyncio
+import argparse
+import threading
+
+from http import HTTPStatus
+from urllib.parse import urlsplit, unquote
+
+from utils import ConnectionAlertLevel
+from store import ModuleStore
+from metrics import METRICS
+from catalogues import CATALOGUES, CatalogueManager
+from prereq import PrereqEngine
+from graph import ModuleGraph
+from validator import PlanValidator
+from scheduler import Scheduler, InfeasibleScheduleError
+from lib_reworked import Parser
+from typing import *
+
+
+class ServiceError(Exception):
+    """Raised by a route to answer a request with an error status and message"""
+
+    def __init__(self, status: HTTPStatus, message: str, **details):
+        self.status = status
+        self.message = message
+        self.details = details
+        super().__init__(message)
+
+
+class YearState:
+    """The warm Parser, ModuleGraph and compiled indexes of one academic year, shared by every request of the year"""
+
+    def __init__(self, year: str, manager: CatalogueManager, store: ModuleStore, endpoint: Optional[str] = None):
+        self.year = year
+        self.catalogue = manager.get(year)
+        self.parser = Parser(year=year, endpoint=endpoint, alert_level=ConnectionAlertLevel.SUPPRESS, store=store,
+                             catalogue=self.catalogue)
+        self.graph = ModuleGraph.from_catalogue(self.catalogue) if self.catalogue is not None \
+            else ModuleGraph(endpoint=endpoint, year=year)
+        self.engine = PrereqEngine.of(self.catalogue, store) if self.catalogue is not None else None
+        self.validator = PlanValidator(self.catalogue) if self.catalogue is not None else None
+        self.scheduler = Scheduler(self.catalogue) if self.catalogue is not None else None
+
+    def close(self):
+        """Shuts the fetch threads of the parser of the year down"""
+
+        self.parser.close()
+
+    def require_catalogue(self):
+        if self.catalogue is None:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"The catalogue of {self.year} has not been ingested")
+
+
+class QueryService:
+    """
+    Long-running local HTTP service answering resolver queries from warm, shared caches
+
+    The service keeps the catalogue, closure index, compiled prerequisite trees, Parser and ModuleGraph of every year
+    it is asked about in memory, so every client shares a single warm cache instead of starting cold. It runs an asyncio
+    server, and resolver calls run in a thread pool so that slow lookups do not block other clients. Identical requests
+    that arrive while one is being computed are coalesced: they wait for the result of the first one instead of
+    computing it again.
+
+    Routes (all answers are JSON):
+
+        GET  /health
+        GET  /metrics
+        GET  /<year>/modules/<code>
+        GET  /<year>/prerequisites/<code>
+        GET  /<year>/preclusions/<code>
+        GET  /<year>/corequisites/<code>
+        POST /<year>/validate       {"plans": [[code, ...], ...]}
+        POST /<year>/schedule       {"modules": [code, ...], "completed": [code, ...]}
+
+    Use it as a context manager to run it in a background thread, or call serve_forever.
+    """
+
+    HOST: str = "127.0.0.1"
+    PORT: int = 8420
+    MAX_BODY: int = 1 << 20
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, directory: Optional[str] = None,
+                 endpoint: Optional[str] = None, store: Optional[ModuleStore] = None):
+        self.host = host if host else self.HOST
+        self.port = port if port is not None else self.PORT
+        self.endpoint = endpoint
+        self.manager = CatalogueManager(directory) if directory else CATALOGUES
+        self.store = store if store else ModuleStore()
+        self.COMPUTED = 0
+        self.COALESCED = 0
+
+        self._years: Dict[str, YearState] = {}
+        self._years_lock = threading.Lock()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ("GET", re.compile(r"/health"), self.health),
+            ("GET", re.compile(r"/metrics"), self.metrics),
+            ("GET", re.compile(r"/(\d{4}-\d{4})/modules/([A-Z0-9]+)"), self.module),
+            ("GET", re.compile(r"/(\d{4}-\d{4})/prerequisites/([A-Z0-9]+)"), self.prerequisites),
+            ("GET", re.compile(r"/(\d{4}-\d{4})/preclusions/([A-Z0-9]+)"), self.preclusions),
+            ("GET", re.compile(r"/(\d{4}-\d{4})/corequisites/([A-Z0-9]+)"), self.corequisites),
+            ("POST", re.compile(r"/(\d{4}-\d{4})/validate"), self.validate),
+            ("POST", re.compile(r"/(\d{4}-\d{4})/schedule"), self.schedule)
+        ]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """The base URL of the running service"""
+
+        return f"http://{self.host}:{self.port}/"
+
+    # ----- Lifecycle ----- #
+    def start(self):
+        """Starts serving requests from a background thread, and returns once the service is listening"""
+
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        """Stops the service started with start"""
+
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join()
+
+        with self._years_lock:
+            for state in self._years.values():
+                state.close()
+            self._years = {}
+
+    def serve_forever(self):
+        """Serves requests from the current thread until interrupted"""
+
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    # ----- HTTP ----- #
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0) or 0)
+                body = await reader.readexactly(length) if 0 < length <= self.MAX_BODY else b""
+                method, _, target = request_line.decode("latin-1").partition(" ")
+                target = target.rsplit(" ", 1)[0]
+
+                if length > self.MAX_BODY:
+                    status, answer = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Request body is too large"}
+                else:
+                    status, answer = await self._dispatch(method, target, body)
+
+                keep_alive = headers.get("connection", "").lower() != "close" and length <= self.MAX_BODY
+                payload = json.dumps(answer).encode()
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # idle keep-alive connections are cancelled when the service stops
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[HTTPStatus, Any]:
+        path = unquote(urlsplit(target).path).rstrip("/") or "/"
+        allowed = False
+
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+
+            try:
+                data = json.loads(body) if body else {}
+                # identical in-flight requests share one computation
+                return HTTPStatus.OK, await self._coalesce((method, path, body), handler, *match.groups(), data)
+            except json.JSONDecodeError:
+                return HTTPStatus.BAD_REQUEST, {"error": "Request body is not valid JSON"}
+            except ServiceError as e:
+                return e.status, {"error": e.message, **e.details}
+            except (TypeError, ValueError) as e:
+                return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+            except Exception as e:
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+        if allowed:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} is not allowed on {path}"}
+
+        return HTTPStatus.NOT_FOUND, {"error": f"No route for {path}"}
+
+    async def _coalesce(self, key: Hashable, function: Callable, *args) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            self.COMPUTED += 1
+            future = self._inflight[key] = asyncio.ensure_future(self._loop.run_in_executor(None, function, *args))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.COALESCED += 1
+
+        return await asyncio.shield(future)
+
+    # ----- Routes ----- #
+    def state(self, year: str) -> YearState:
+        """Returns the warm state of a year, building it on first use"""
+
+        with self._years_lock:
+            state = self._years.get(year)
+            if state is None:
+                state = self._years[year] = YearState(year, self.manager, self.store, self.endpoint)
+
+            return state
+
+    def health(self, data: dict) -> dict:
+        return {"status": "ok", "years": sorted(self._years)}
+
+    def metrics(self, data: dict) -> dict:
+        return {"service": {"computed": self.COMPUTED, "coalesced": self.COALESCED}, **METRICS.snapshot()}
+
+    def module(self, year: str, code: str, data: dict) -> dict:
+        document = self.state(year).parser.send_request(code)
+        if document is None:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"{code} is not offered in {year}")
+
+        return document
+
+    def prerequisites(self, year: str, code: str, data: dict) -> dict:
+        state = self.state(year)
+        if state.catalogue is not None and code in state.catalogue:
+            direct = state.graph.predecessors(code)
+        else:
+            # the graph is only read, as it is shared by every request, so other modules are looked up directly
+            document = state.parser.send_request(code)
+            direct = set(state.parser.parse_string(document.get("prerequisite", ""))) - {code} if document else []
+
+        return {
+            "module": code,
+            "direct": sorted(direct),
+            "all": sorted(state.parser.prerequisite(code)),
+            "tree": state.engine.tree(code) if state.engine is not None else None
+        }
+
+    def preclusions(self, year: str, code: str, data: dict) -> dict:
+        return {"module": code, "equivalents": sorted(self.state(year).parser.preclusion(code) | {code})}
+
+    def corequisites(self, year: str, code: str, data: dict) -> dict:
+        return {"module": code, "corequisites": sorted(self.state(year).parser.corequisites(code))}
+
+    @staticmethod
+    def _codes(values: list) -> bool:
+        # numbers or nested lists in a plan would otherwise be looked up as module codes that are never missing
+        return all(isinstance(value, str) for value in values)
+
+    def validate(self, year: str, data: dict) -> dict:
+        state = self.state(year)
+        state.require_catalogue()
+
+        plans = data.get("plans")
+        if not isinstance(plans, list) or not all(isinstance(plan, list) and self._codes(plan) for plan in plans):
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "Expected {\"plans\": [[module code, ...], ...]}")
+
+        return {"results": [{"valid": not missing, "missing": sorted(sorted(group) for group in missing)}
+                            for missing in state.validator.validate(plans)]}
+
+    def schedule(self, year: str, data: dict) -> dict:
+        state = self.state(year)
+        state.require_catalogue()
+
+        modules, completed = data.get("modules"), data.get("completed", [])
+        if not isinstance(modules, list) or not isinstance(completed, list) or not self._codes(modules + completed):
+            raise ServiceError(HTTPStatus.BAD_REQUEST,
+                               "Expected {\"modules\": [module code, ...], \"completed\": [module code, ...]}")
+
+        try:
+            schedule = state.scheduler.solve(modules, completed)
+        except InfeasibleScheduleError as e:
+            raise ServiceError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e), reasons=e.reasons)
+
+        return {"semesters": schedule.semesters, "mcs": [schedule.mcs(s) for s in range(len(schedule))]}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve pathfinder resolver queries over HTTP from warm caches")
+    parser.add_argument("--host", default=QueryService.HOST, help=f"host to listen on (default: {QueryService.HOST})")
+    parser.add_argument("--port", type=int, default=QueryService.PORT,
+                        help=f"port to listen on (default: {QueryService.PORT})")
+    parser.add_argument("--directory", default=None, help="directory holding the catalogue snapshots")
+    parser.add_argument("--endpoint", default=None, help="API endpoint for modules outside the snapshots")
+    args = parser.parse_args(argv)
+
+    service = QueryService(args.host, args.port, args.directory, args.endpoint)
+    print(f"Serving on http://{service.host}:{service.port}/", file=sys.stderr)
+    service.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import os
+import json
+import mmap
+import struct
+
+from typing import *
+
+
+class Document(dict):
+    """A module document, which unlike a plain dictionary can be held in a weak pool (see Catalogue.share)"""
+
+    __slots__ = ("__weakref__",)
+
+
+class Snapshot:
+    """
+    Binary catalogue snapshot, read through a memory map without deserialising it
+
+    A snapshot file is laid out as little-endian sections, each aligned to 4 bytes:
+
+    - a header (see HEADER) with the string id of the year and the number of entries of every section
+    - the string ids of the field names and of the relation names
+    - a string table: the offsets of every string, followed by the UTF-8 bytes of all the strings
+    - fixed-width module records, sorted by module code: the string id of the code, followed by the string id of the
+      compact JSON of every field, or -1 if the module has no value for the field
+    - the string ids of every interned module code of the relations, the modules of the records first
+    - for every relation, the offsets of the related ids of each module, followed by the related ids
+
+    Every section is exposed as a memoryview over the map, so opening a snapshot only reads its header and names, pages
+    are only read from disk when they are touched, and every process that opens the same file shares the same pages.
+    """
+
+    MAGIC: bytes = b"PFCS"
+    VERSION: int = 1
+    HEADER: struct.Struct = struct.Struct("<4sHBxIIIIII")
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, complete, year, fields, relations, strings, modules, codes = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {self.VERSION} catalogue snapshot")
+
+        view = memoryview(self._map)
+        position = self.HEADER.size
+
+        def section(count: int) -> memoryview:
+            nonlocal position
+            start, position = position, position + 4 * count
+            return view[start:position].cast("i")
+
+        names = section(fields + relations)
+        self._offsets = section(strings + 1)
+        start, position = position, position + self._offsets[-1]
+        self._blob = view[start:position]
+        position += -position % 4
+
+        self.complete = bool(complete)
+        self.size = modules
+        self.records = section(modules * (fields + 1))
+        self.codes = section(codes)
+        self.fields: Tuple[str, ...] = tuple(self.string(i) for i in names[:fields])
+        self.relations: Dict[str, Tuple[memoryview, memoryview]] = {}
+        for name in names[fields:]:
+            offsets = section(modules + 1)
+            self.relations[self.string(name)] = offsets, section(offsets[-1])
+        self.year = self.string(year)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"Snapshot({self.path})"
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path: str):
+        self.__init__(path)
+
+    # ----- Reading ----- #
+    def raw(self, string_id: int) -> memoryview:
+        """Returns the UTF-8 bytes of a string of the string table, without copying them"""
+
+        return self._blob[self._offsets[string_id]:self._offsets[string_id + 1]]
+
+    def string(self, string_id: int) -> str:
+        """Returns a string of the string table"""
+
+        return str(self.raw(string_id), "utf-8")
+
+    def code(self, record: int) -> str:
+        """Returns the module code of a record"""
+
+        return self.string(self.records[record * (len(self.fields) + 1)])
+
+    def find(self, module_code: str) -> int or None:
+        """Returns the index of the record of a module, found by binary search over the UTF-8 codes, or None"""
+
+        key = module_code.encode("utf-8")
+        width = len(self.fields) + 1
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.raw(self.records[middle * width])) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.size and self.raw(self.records[low * width]) == key:
+            return low
+
+        return None
+
+    def document(self, record: int) -> Document:
+        """Decodes the module document of a record"""
+
+        width = len(self.fields) + 1
+        row = self.records[record * width:(record + 1) * width]
+        module = Document(moduleCode=self.string(row[0]))
+        for field, string_id in zip(self.fields, row[1:]):
+            if string_id >= 0:
+                module[field] = json.loads(self.string(string_id))
+
+        return module
+
+    def key(self, record: int) -> Tuple[str or None, ...]:
+        """
+        Returns the module code of a record followed by the compact JSON of every field, or None if it is unset
+
+        The JSON is read as stored, with sorted keys, so keying a document of a snapshot costs no encoding, and gives
+        the key of Catalogue.key.
+        """
+
+        width = len(self.fields) + 1
+        return tuple(self.string(i) if i >= 0 else None for i in self.records[record * width:(record + 1) * width])
+
+    def close(self):
+        """Releases the memory map, once no view of it is in use anymore"""
+
+        self._map.close()
+
+    # ----- Writing ----- #
+    @classmethod
+    def write(cls, path: str, year: str, complete: bool, fields: Sequence[str], modules: Mapping[str, dict],
+              codes: Sequence[str], relations: Dict[str, Tuple[Sequence[int], Sequence[int]]]) -> str:
+        """
+        Writes a binary snapshot and returns its path
+
+        Parameters
+        ----------
+        :param path:            The path of the snapshot file
+        :param year:            The academic year of the catalogue
+        :param complete:        Whether the catalogue holds every module of the year
+        :param fields:          The fields of the module documents to keep
+        :param modules:         The module documents, keyed by module code
+        :param codes:           Every interned module code of the relations, the modules of the documents first in
+                                sorted order
+        :param relations:       The offsets and the related ids of every relation, in CSR form
+        """
+
+        strings: Dict[str, int] = {}
+
+        def intern(string: str) -> int:
+            if string not in strings:
+                strings[string] = len(strings)
+            return strings[string]
+
+        sorted_codes = sorted(modules)
+        if list(codes[:len(sorted_codes)]) != sorted_codes:
+            raise ValueError("The interned codes must start with the codes of the modules, in sorted order")
+
+        names = [intern(name) for name in list(fields) + list(relations)]
+        records = []
+        for code in sorted_codes:
+            records.append(intern(code))
+            for field in fields:
+                value = modules[code].get(field)
+                # keys are sorted, so the JSON of equal values is equal too (see key)
+                string = None if value is None else json.dumps(value, sort_keys=True, separators=(",", ":"))
+                records.append(-1 if string is None else intern(string))
+        code_ids = [intern(code) for code in codes]
+        year_id = intern(year)
+
+        blob = bytearray()
+        offsets = [0]
+        for string in strings:
+            blob += string.encode("utf-8")
+            offsets.append(len(blob))
+        blob += bytes(-len(blob) % 4)
+
+        sections = [names, offsets, blob, records, code_ids]
+        for relation in relations.values():
+            sections += list(relation)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, complete, year_id, len(fields), len(relations),
+                                    len(strings), len(sorted_codes), len(codes)))
+            for data in sections:
+                f.write(data if isinstance(data, bytearray) else struct.pack(f"<{len(data)}i", *data))
+        os.replace(path + ".tmp", path)
+
+        return path
+
+
+class MappedModules(Mapping):
+    """
+    Read-only mapping of module codes to module documents, decoded lazily from a snapshot and then kept
+
+    If a pool is set, decoded documents are interned in it by their key, so equal documents of different snapshots are
+    held once
+    """
+
+    def __init__(self, snapshot: Snapshot, pool: Optional[MutableMapping[tuple, Document]] = None):
+        self.snapshot = snapshot
+        self.pool = pool
+        self._documents: Dict[str, dict or None] = {}
+
+    def __getitem__(self, module_code: str) -> dict:
+        if module_code not in self._documents:
+            record = self.snapshot.find(module_code) if isinstance(module_code, str) else None
+            if record is None:
+                document = None
+            elif self.pool is not None:
+                key = self.snapshot.key(record)
+                document = self.pool.get(key)
+                if document is None:
+                    document = self.pool[key] = self.snapshot.document(record)
+            else:
+                document = self.snapshot.document(record)
+            self._documents[module_code] = document
+
+        document = self._documents[module_code]
+        if document is None:
+            raise KeyError(module_code)
+
+        return document
+
+    def __contains__(self, module_code: str):
+        try:
+            self[module_code]
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self):
+        return (self.snapshot.code(record) for record in range(len(self.snapshot)))
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __reduce__(self):
+        return MappedModules, (self.snapshot,)
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import requests
+
+from client import CLIENT, ResilientClient
+from metrics import METRICS, Metrics
+from typing import *
+
+
+class ModuleStore:
+    """
+    Persistent on-disk store for the module documents served by the NUSMods API
+
+    Documents are keyed by (endpoint, year, module code) and kept in a SQLite database, with a second in-memory layer
+    for the running session. Stored documents are served without touching the network until their TTL expires, after
+    which they are revalidated with the ETag sent by the API. Modules that the API does not know about are remembered
+    as well, so that invalid codes are not requested again and again.
+
+    Requests are sent through a ResilientClient, which retries failed requests, rate limits them and stops sending them
+    while the API is down. When the API cannot be reached, or keeps failing, an expired document is served as is. Stores
+    share client.CLIENT, and with it its connection pool, rate limits and circuit breakers, unless they are given a
+    client or their own metrics. A store only closes a client it created.
+
+    In offline mode the store never touches the network, and only answers with what it already holds.
+    """
+
+    DATABASE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "modules.sqlite3")
+    TTL: float = 7 * 24 * 60 * 60
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, offline: Optional[bool] = None,
+                 metrics: Optional[Metrics] = None, client: Optional[ResilientClient] = None):
+        self.path = path if path else self.DATABASE
+        self.metrics = metrics if metrics else METRICS
+        self.ttl = self.TTL if ttl is None else ttl
+        self.offline = os.environ.get("PATHFINDER_OFFLINE", "") not in ("", "0") if offline is None else offline
+        # a store only creates a client of its own to record its requests in its own metrics
+        self._owns_client = client is None and self.metrics is not METRICS
+        if client is None:
+            client = ResilientClient(metrics=self.metrics) if self._owns_client else CLIENT
+        self.client = client
+        self.session = self.client.session
+
+        self._lock = threading.RLock()
+        self._memory: Dict[Tuple[str, str, str], dict or None] = {}
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS modules ("
+            "endpoint TEXT NOT NULL, "
+            "year TEXT NOT NULL, "
+            "code TEXT NOT NULL, "
+            "status INTEGER NOT NULL, "
+            "etag TEXT, "
+            "fetched_at REAL NOT NULL, "
+            "body TEXT, "
+            "PRIMARY KEY (endpoint, year, code))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS derived ("
+            "kind TEXT NOT NULL, "
+            "year TEXT NOT NULL, "
+            "code TEXT NOT NULL, "
+            "body TEXT NOT NULL, "
+            "PRIMARY KEY (kind, year, code))"
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def url(endpoint: str, year: str, module_code: str) -> str:
+        """Returns the URL of the API document for a module"""
+
+        return endpoint + year + "/modules/" + module_code + ".json"
+
+    def get(self, endpoint: str, year: str, module_code: str) -> dict or None:
+        """
+        Returns the document of a module, or None if the API does not know about the module
+
+        The in-memory layer is checked first, followed by the database. The network is only used when the stored
+        document is missing or has expired, and never in offline mode.
+
+        Parameters
+        ----------
+        :param endpoint:        The API endpoint the document is fetched from
+        :param year:            The academic year of the document
+        :param module_code:     The module code of the document
+        :raise:                 requests.ConnectionError (client.CircuitOpenError while the API is down),
+                                requests.Timeout or requests.HTTPError if the document could not be fetched and no
+                                stored copy is available
+        """
+
+        key = (endpoint, year, module_code)
+
+        with self._lock:
+            if key in self._memory:
+                self.metrics.hit("store")
+                return self._memory[key]
+
+            row = self._connection.execute(
+                "SELECT status, etag, fetched_at, body FROM modules WHERE endpoint = ? AND year = ? AND code = ?",
+                key
+            ).fetchone()
+
+        if row is not None:
+            status, etag, fetched_at, body = row
+            if self.offline or time.time() - fetched_at < self.ttl:
+                self.metrics.hit("store")
+                return self._remember(key, json.loads(body) if status == 200 else None)
+        else:
+            status, etag, body = None, None, None
+            if self.offline:
+                self.metrics.miss("store")
+                return None
+
+        self.metrics.miss("store")
+        headers = {"If-None-Match": etag} if etag else {}
+
+        try:
+            r = self.client.get(self.url(*key), headers=headers, endpoint=endpoint)
+        except (requests.ConnectionError, requests.Timeout):
+            # a stale copy is better than none at all
+            if row is not None:
+                return self._remember(key, json.loads(body) if status == 200 else None)
+            raise
+
+        if r.status_code in ResilientClient.RETRY_STATUSES and row is not None:
+            return self._remember(key, json.loads(body) if status == 200 else None)
+        elif r.status_code == 304 and row is not None:
+            with self._lock:
+                self._connection.execute(
+                    "UPDATE modules SET fetched_at = ? WHERE endpoint = ? AND year = ? AND code = ?",
+                    (time.time(), *key)
+                )
+                self._connection.commit()
+            return self._remember(key, json.loads(body) if status == 200 else None)
+        elif r.status_code == 404:
+            self._save(key, 404, None, None)
+            return self._remember(key, None)
+
+        r.raise_for_status()
+        document = r.json()
+        self._save(key, 200, r.headers.get("ETag"), document)
+
+        return self._remember(key, document)
+
+    def put(self, endpoint: str, year: str, module_code: str, document: dict or None, etag: Optional[str] = None):
+        """Stores a module document directly, as if it had just been fetched from the API"""
+
+        self._save((endpoint, year, module_code), 200 if document is not None else 404, etag, document)
+        self._remember((endpoint, year, module_code), document)
+
+    def invalidate(self, endpoint: str, year: str, module_code: Optional[str] = None):
+        """Removes the documents of a year, or of a single module in the year, from the store"""
+
+        with self._lock:
+            if module_code is None:
+                self._connection.execute("DELETE FROM modules WHERE endpoint = ? AND year = ?", (endpoint, year))
+                self._memory = {k: v for k, v in self._memory.items() if k[:2] != (endpoint, year)}
+            else:
+                self._connection.execute("DELETE FROM modules WHERE endpoint = ? AND year = ? AND code = ?",
+                                         (endpoint, year, module_code))
+                self._memory.pop((endpoint, year, module_code), None)
+            self._connection.commit()
+
+    # ----- Derived Data ----- #
+    def get_derived(self, kind: str, snapshot: str) -> Dict[str, Any]:
+        """
+        Returns every value of a kind of data derived from a catalogue snapshot, keyed by module code
+
+        Derived data (such as compiled prerequisite trees) is computed from the module documents once, and kept in
+        the store so that later sessions do not need to compute it again. It is keyed by the snapshot it was derived
+        from, as "<year>:<fingerprint>" (see Catalogue.fingerprint), so data derived from another snapshot of the same
+        year is never returned
+        """
+
+        with self._lock:
+            rows = self._connection.execute("SELECT code, body FROM derived WHERE kind = ? AND year = ?",
+                                            (kind, snapshot)).fetchall()
+
+        return {code: json.loads(body) for code, body in rows}
+
+    def put_derived(self, kind: str, snapshot: str, values: Dict[str, Any]):
+        """Stores values of a kind of data derived from a catalogue snapshot, keyed by module code"""
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO derived (kind, year, code, body) VALUES (?, ?, ?, ?)",
+                [(kind, snapshot, code, json.dumps(value)) for code, value in values.items()]
+            )
+            self._connection.commit()
+
+    def clear_derived(self, year: str, keep: Optional[str] = None):
+        """
+        Removes the data derived from every snapshot of a year, except from the snapshot keep if given, to be called
+        when the snapshot of the year changes
+        """
+
+        with self._lock:
+            self._connection.execute("DELETE FROM derived WHERE (year = ? OR year LIKE ?) AND year IS NOT ?",
+                                     (year, year + ":%", keep))
+            self._connection.commit()
+
+    def close(self):
+        """Closes the connection to the database, and the HTTP client if the store created it"""
+
+        with self._lock:
+            self._connection.close()
+            if self._owns_client:
+                self.client.close()
+
+    def _save(self, key: Tuple[str, str, str], status: int, etag: Optional[str], document: dict or None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO modules (endpoint, year, code, status, etag, fetched_at, body) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, status, etag, time.time(), json.dumps(document) if document is not None else None)
+            )
+            self._connection.commit()
+
+    def _remember(self, key: Tuple[str, str, str], document: dict or None) -> dict or None:
+        with self._lock:
+            self._memory[key] = document
+
+        return document
@@ -0,0 +1,174 @@
+import re
+import sys
+import weakref
+
+from array import array
+from utils import MODULE_CODE_REGEX, Module
+from catalogue import Catalogue
+from snapshot import Snapshot
+from equivalence import PreclusionIndex
+from prereq import PrereqEngine
+from typing import *
+
+
+class ModuleTable:
+    """
+    Compact table of the preclusions, prerequisites and corequisites of every module in a catalogue
+
+    Module codes are interned once and given integer ids, the modules of the catalogue first in sorted order, followed
+    by the modules that are only referenced by them. The relations are held in CSR form: for each relation, one array
+    of offsets with an entry per module, and one array with the ids of the related modules, so a whole year costs a few
+    flat integer arrays rather than a list or set of strings per module, and graph algorithms work on ids without
+    hashing strings.
+
+    The prerequisites of a module are every module code in its prerequisite tree, the preclusions are the other
+    modules it precludes, in a chain, and the corequisites are the module codes in its corequisite text.
+
+    Tables only hold tuples and arrays, so they pickle into a compact form that can be sent to worker processes. Use
+    ModuleTable.of(catalogue) to share a single table between every user of a catalogue.
+    """
+
+    RELATIONS: Tuple[str, ...] = ("preclusions", "prerequisites", "corequisites")
+
+    _TABLES: "weakref.WeakKeyDictionary[Catalogue, ModuleTable]" = weakref.WeakKeyDictionary()
+
+    def __init__(self, year: str, codes: Sequence[str], size: int, relations: Dict[str, Tuple[array, array]]):
+        self.year = year
+        self.codes: Tuple[str, ...] = tuple(sys.intern(code) for code in codes)
+        self.size = size
+        self.relations = relations
+        self._ids: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+
+    def __contains__(self, module_code: str):
+        return self._ids.get(module_code, self.size) < self.size
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"ModuleTable({self.year}, {self.size} modules)"
+
+    def __getstate__(self):
+        # relations read in place from a snapshot are copied out of the memory map
+        return self.year, self.codes, self.size, {relation: (array("i", offsets), array("i", targets))
+                                                  for relation, (offsets, targets) in self.relations.items()}
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def of(cls, catalogue: Catalogue) -> "ModuleTable":
+        """Returns the table of a catalogue, building it on first use"""
+
+        table = cls._TABLES.get(catalogue)
+        if table is None:
+            if catalogue.snapshot is not None:
+                table = cls.from_snapshot(catalogue.snapshot)
+            else:
+                table = cls.build(catalogue)
+            cls._TABLES[catalogue] = table
+
+        return table
+
+    @classmethod
+    def build(cls, catalogue: Catalogue) -> "ModuleTable":
+        """Builds the table of every module in a catalogue"""
+
+        engine = PrereqEngine.of(catalogue)
+        index = PreclusionIndex.of(catalogue)
+
+        codes = catalogue.codes()
+        ids = {code: i for i, code in enumerate(codes)}
+
+        def intern(code: str) -> int:
+            if code not in ids:
+                ids[code] = len(codes)
+                codes.append(code)
+            return ids[code]
+
+        related: Dict[str, List[Iterable[str]]] = {relation: [] for relation in cls.RELATIONS}
+        for code in codes[:len(catalogue)]:
+            module = catalogue[code]
+            related["preclusions"].append(sorted(index.equivalents(code) - {code}))
+            related["prerequisites"].append(PrereqEngine.flatten(engine.tree(code)))
+            related["corequisites"].append(re.findall(MODULE_CODE_REGEX, module.get("corequisite", "")))
+
+        relations = {}
+        for relation, rows in related.items():
+            offsets, targets = array("i", [0]), array("i")
+            for row in rows:
+                targets.extend(dict.fromkeys(intern(code) for code in row))
+                offsets.append(len(targets))
+            relations[relation] = offsets, targets
+
+        return cls(catalogue.year, codes, len(catalogue), relations)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "ModuleTable":
+        """Returns the table stored in a binary snapshot, reading the relations in place from the memory map"""
+
+        return cls(snapshot.year, [snapshot.string(i) for i in snapshot.codes], len(snapshot), snapshot.relations)
+
+    # ----- Interning ----- #
+    def id_of(self, module_code: str) -> int or None:
+        """Returns the id of a module code, or None if the code is not in the table"""
+
+        return self._ids.get(module_code)
+
+    def code_of(self, module_id: int) -> str:
+        """Returns the interned module code of an id"""
+
+        return self.codes[module_id]
+
+    # ----- Relations ----- #
+    def related(self, relation: str, module_id: int) -> array:
+        """
+        Returns the ids of the modules related to a module of the catalogue
+
+        Parameters
+        ----------
+        :param relation:        One of RELATIONS
+        :param module_id:       The id of a module of the catalogue
+        """
+
+        if relation not in self.relations:
+            raise ValueError(f"Unknown relation {relation}, expected one of {', '.join(self.RELATIONS)}")
+
+        if not 0 <= module_id < self.size:
+            return array("i")
+
+        offsets, targets = self.relations[relation]
+        return targets[offsets[module_id]:offsets[module_id + 1]]
+
+    def preclusions(self, module_id: int) -> array:
+        """Returns the ids of the modules equivalent to a module, excluding the module itself"""
+
+        return self.related("preclusions", module_id)
+
+    def prerequisites(self, module_id: int) -> array:
+        """Returns the ids of every module in the prerequisite tree of a module"""
+
+        return self.related("prerequisites", module_id)
+
+    def corequisites(self, module_id: int) -> array:
+        """Returns the ids of the corequisites of a module"""
+
+        return self.related("corequisites", module_id)
+
+    def module(self, module_code: str) -> Module or None:
+        """Returns the Module of a module code, or None if the module is not in the catalogue"""
+
+        module_id = self._ids.get(module_code, self.size)
+        if module_id >= self.size:
+            return None
+
+        return Module(self.codes[module_id],
+                      preclusions=[self.codes[i] for i in self.preclusions(module_id)],
+                      prerequisites=[self.codes[i] for i in self.prerequisites(module_id)],
+                      corequisites=[self.codes[i] for i in self.corequisites(module_id)])
+
+    def modules(self) -> Iterator[Module]:
+        """Yields the Module of every module in the catalogue, in the order of their ids"""
+
+        for code in self.codes[:self.size]:
+            yield self.module(code)
@@ -1,6 +1,12 @@
+import sys
+
+from enum import IntEnum
 from typing import *
 
 
+MODULE_CODE_REGEX = r"[A-Z]{2,3}\d{4}[A-Z]{0,}"
+
+
 class ConnectionAlertLevel(IntEnum):
     RAISE = 1
     LOG = 2
@@ -8,12 +14,32 @@ class ConnectionAlertLevel(IntEnum):
 
 
 class Module:
+    """
+    A module code along with the codes of its preclusions, prerequisites and corequisites
+
+    Modules are slotted, their codes are interned so that equal codes share a single string, and the related codes are
+    held in tuples, so whole-catalogue workloads keep one compact immutable record per module.
+
+    A module can be given a resolver instead of some of its fields, i.e. a function that takes a field name and a list
+    of module codes and returns the codes of that field for each module, keyed by module code. Fields left out are then
+    resolved on first access and memoised, so a caller only pays for the fields it reads. Resolvers such as
+    Parser.resolve also fill in a field for many modules at once with fill.
+    """
+
+    FIELDS: Tuple[str, ...] = ("preclusions", "prerequisites", "corequisites")
+
+    __slots__ = ("code", "_preclusions", "_prerequisites", "_corequisites", "_resolver", "_hash")
+
     def __init__(self, code: str, preclusions: Optional[Collection[str]] = None,
-                 prerequisites: Optional[Collection[str]] = None, corequisites: Optional[Collection[str]] = None):
-        self.code = code
-        self.preclusions = preclusions if preclusions else []
-        self.prerequisites = prerequisites if prerequisites else []
-        self.corequisites = corequisites if corequisites else []
+                 prerequisites: Optional[Collection[str]] = None, corequisites: Optional[Collection[str]] = None,
+                 resolver: Optional[Callable[[str, List[str]], Dict[str, Collection[str]]]] = None):
+        self.code = sys.intern(code)
+        self._resolver = resolver
+        # a field is None until it is resolved, which only happens for modules with a resolver
+        self._preclusions = intern_codes(preclusions) if preclusions is not None or resolver is None else None
+        self._prerequisites = intern_codes(prerequisites) if prerequisites is not None or resolver is None else None
+        self._corequisites = intern_codes(corequisites) if corequisites is not None or resolver is None else None
+        self._hash = hash(self.code)
 
     def __repr__(self):
         return self.code
@@ -28,4 +54,50 @@ class Module:
         return False
 
     def __hash__(self):
-        return hash(self.code)
+        return self._hash
+
+    def __getstate__(self):
+        # resolvers are not pickled, so every field is resolved first
+        return self.code, self.preclusions, self.prerequisites, self.corequisites
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @property
+    def preclusions(self) -> Tuple[str, ...]:
+        return self._get("preclusions")
+
+    @property
+    def prerequisites(self) -> Tuple[str, ...]:
+        return self._get("prerequisites")
+
+    @property
+    def corequisites(self) -> Tuple[str, ...]:
+        return self._get("corequisites")
+
+    def _get(self, field: str) -> Tuple[str, ...]:
+        value = getattr(self, "_" + field)
+        if value is None:
+            self.fill(field, self._resolver(field, [self.code]).get(self.code))
+            value = getattr(self, "_" + field)
+
+        return value
+
+    def resolved(self, field: str) -> bool:
+        """Returns whether a field of the module has been resolved"""
+
+        return getattr(self, "_" + field) is not None
+
+    def fill(self, field: str, codes: Optional[Collection[str]]):
+        """Sets a field of the module to the codes resolved for it"""
+
+        if field not in self.FIELDS:
+            raise ValueError(f"Unknown field {field}, expected one of {', '.join(self.FIELDS)}")
+
+        setattr(self, "_" + field, intern_codes(codes))
+
+
+def intern_codes(codes: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Returns a tuple of the interned module codes in a collection, in order and without duplicates"""
+
+    return tuple(dict.fromkeys(sys.intern(code) for code in codes)) if codes else ()
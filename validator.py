@@ -0,0 +1,102 @@
+from catalogue import Catalogue
+from prereq import PrereqEngine
+from typing import *
+
+
+class PlanValidator:
+    """
+    Validates many plans against the compiled prerequisite trees of a catalogue in a single vectorised pass
+
+    Plans are transposed into one bitmask per module, with a bit set for every plan that contains the module, and one
+    bitmask per prerequisite leaf. Every prerequisite group of every module is then evaluated once for all the plans
+    together, and a group is missing from the plans that contain the module but not the group. No plan is copied, and
+    the cost grows with the number of distinct modules rather than with the number of plans times their size.
+
+    Plans are given either as collections of module codes, or as rows of a bitset matrix, i.e. integers with the bit
+    of every interned module id (see id_of) set.
+    """
+
+    def __init__(self, catalogue: Catalogue):
+        self.catalogue = catalogue
+        self.engine = PrereqEngine.of(catalogue)
+        self._codes = catalogue.codes()
+        self._ids = {code: i for i, code in enumerate(self._codes)}
+
+    # ----- Interning ----- #
+    def id_of(self, module_code: str) -> int or None:
+        """Returns the interned id of a module, or None if the module is not in the catalogue"""
+
+        return self._ids.get(module_code)
+
+    def code_of(self, module_id: int) -> str:
+        """Returns the module code of an interned id"""
+
+        return self._codes[module_id]
+
+    def encode(self, plan: Iterable[str]) -> int:
+        """Returns the bitset row of a plan, ignoring modules that are not in the catalogue"""
+
+        row = 0
+        for code in plan:
+            module_id = self._ids.get(code)
+            if module_id is not None:
+                row |= 1 << module_id
+
+        return row
+
+    def decode(self, row: int) -> List[str]:
+        """Returns the module codes in a bitset row"""
+
+        codes = []
+        while row:
+            low = row & -row
+            codes.append(self._codes[low.bit_length() - 1])
+            row ^= low
+
+        return codes
+
+    # ----- Validation ----- #
+    def validate(self, plans: Sequence[Collection[str] or int]) -> List[Set[FrozenSet[str]]]:
+        """
+        Returns, for every plan, the groups of prerequisites that are missing from the plan
+
+        A group holds every module code that fulfils it, as in PrereqEngine.missing. A plan with no missing groups is
+        valid. Whether a plan fulfils a module is decided on the compiled tree for every plan at once, and the groups
+        are only read off the tree for the plans that do not.
+        """
+
+        plans = [self.decode(plan) if isinstance(plan, int) else plan for plan in plans]
+        full = (1 << len(plans)) - 1
+        leaf_masks = self.engine.leaf_masks(plans)
+
+        module_masks: Dict[str, int] = {}
+        for p, plan in enumerate(plans):
+            bit = 1 << p
+            for code in plan:
+                module_masks[code] = module_masks.get(code, 0) | bit
+
+        missing = [set() for _ in plans]
+        memo = {}
+        failures: Dict[int, List[int]] = {}
+        for code, module_mask in module_masks.items():
+            if code not in self.catalogue:
+                continue
+
+            for node in self.engine.conjuncts(code):
+                unfulfilled = module_mask & ~self.engine.evaluate(node, leaf_masks, full, memo)
+                while unfulfilled:
+                    low = unfulfilled & -unfulfilled
+                    failures.setdefault(low.bit_length() - 1, []).append(node)
+                    unfulfilled ^= low
+
+        for p, nodes in failures.items():
+            masks, plan_memo = self.engine.leaf_masks([plans[p]]), {}
+            for node in nodes:
+                missing[p].update(self.engine.unfulfilled(node, masks, plan_memo))
+
+        return missing
+
+    def valid(self, plans: Sequence[Collection[str] or int]) -> List[bool]:
+        """Returns whether every plan fulfils the prerequisites of all of its modules"""
+
+        return [not groups for groups in self.validate(plans)]